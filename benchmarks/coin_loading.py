@@ -0,0 +1,83 @@
+"""
+Compares the eager (marshmallow schema), lazy and memory-mapped index coin loading
+paths on a synthetic Coin Paprika universe, looking up a few hundred tokens as
+run_missing_prices does. The index is built before measuring (as it is reused
+across runs).
+
+    python -m benchmarks.coin_loading --coins 50000 --lookups 300
+"""
+
+import argparse
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Callable, Mapping
+
+from marshmallow import fields
+
+from src.address import Address
+from src.address_index import AddressIndex
+from src.utils import CoinSchema, CoinsSchema, EthereumAddress, LazyCoins
+
+
+def synthetic_entries(num_coins: int) -> dict[str, dict[str, Any]]:
+    """Coin Paprika like entries keyed by lower case address"""
+    entries = {}
+    for i in range(num_coins):
+        address = str(Address.from_int(i + 1))
+        entries[address] = {
+            "id": f"coin{i}-coin-{i}",
+            "name": f"Coin {i}",
+            "symbol": f"C{i}",
+            "rank": i,
+            "is_new": False,
+            "is_active": True,
+            "type": "token",
+            "address": address,
+        }
+    return entries
+
+
+def eager(entries: dict[str, dict[str, Any]]) -> Mapping[Address, Any]:
+    return CoinsSchema(keys=EthereumAddress, values=fields.Nested(CoinSchema)).load(
+        entries
+    )
+
+
+def measure(
+    name: str,
+    load: Callable[[dict[str, dict[str, Any]]], Mapping[Address, Any]],
+    entries: dict[str, dict[str, Any]],
+    lookups: list[Address],
+) -> None:
+    tracemalloc.start()
+    start = time.perf_counter()
+    coins = load(entries)
+    found = sum(1 for token in lookups if coins.get(token) is not None)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(
+        f"{name:>6}: {elapsed:8.3f}s  peak {peak / 2**20:8.1f} MiB  ({found} matches)"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("Coin loading benchmark")
+    parser.add_argument("--coins", type=int, default=50_000)
+    parser.add_argument("--lookups", type=int, default=300)
+    args = parser.parse_args()
+
+    coin_entries = synthetic_entries(args.coins)
+    # Half of the looked up tokens are known to Coin Paprika.
+    tokens = [
+        Address.from_int(random.randint(1, 2 * args.coins)) for _ in range(args.lookups)
+    ]
+    measure("eager", eager, coin_entries, tokens)
+    measure("lazy", LazyCoins, coin_entries, tokens)
+    with tempfile.TemporaryDirectory() as tmp:
+        index_path = os.path.join(tmp, "coins.idx")
+        AddressIndex.build(index_path, coin_entries)
+        measure("index", lambda _: LazyCoins(AddressIndex(index_path)), {}, tokens)
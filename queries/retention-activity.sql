@@ -0,0 +1,49 @@
+-- Daily trading activity of all CowProtocol traders, from which the classification
+-- of retention-on-date.sql can be computed locally for any date and window.
+-- One row per
+--   (trader, 'first', day): the midnight at or before the trader's first CoW trade
+--   (trader, 'cow', day):   a midnight following (or at) one of their CoW trades
+--   (trader, 'other', day): a midnight following (or at) one of their trades on other dexes
+-- Rounding trades up to the next midnight keeps comparisons against the half open
+-- windows (DateFor - NumDays, DateFor] of retention-on-date.sql exact.
+with
+cow_trades as (
+    select
+        owner          as trader,
+        evt_block_time as block_time
+    from gnosis_protocol_v2."GPv2Settlement_evt_Trade"
+    where evt_block_time >= '2021-04-28'
+),
+
+cow_traders as (
+    select
+        trader,
+        date_trunc('day', min(block_time)) as first_day
+    from cow_trades
+    group by trader
+),
+
+other_trades as (
+    select
+        trader,
+        block_time
+    from cow_traders
+    inner join dex.trades
+        on trader = trader_a
+        and project != 'CoW Protocol'
+)
+
+select concat('0x', encode(trader, 'hex')) as trader, 'first' as source, first_day as day
+from cow_traders
+union all
+select distinct
+    concat('0x', encode(trader, 'hex')),
+    'cow',
+    date_trunc('day', block_time - interval '1 microsecond') + interval '1 day'
+from cow_trades
+union all
+select distinct
+    concat('0x', encode(trader, 'hex')),
+    'other',
+    date_trunc('day', block_time - interval '1 microsecond') + interval '1 day'
+from other_trades
@@ -0,0 +1,93 @@
+"""
+Compact, interned Ethereum address.
+
+Drop-in replacement for dune_client's Address: the same constructor, `address`
+(lower case hex) attribute and ordering, but each distinct address is a single
+shared instance holding the raw 20 bytes. The lower case and checksummed
+representations are computed at most once per address.
+"""
+
+from __future__ import annotations
+
+import re
+import weakref
+from typing import Optional, Union
+
+from eth_utils import to_checksum_address
+
+ADDRESS_PATTERN = re.compile(r"^(0x)?[0-9a-f]{40}$", flags=re.IGNORECASE)
+
+
+class Address:
+    """Ethereum Address, interned by its raw 20 bytes"""
+
+    __slots__ = ("raw", "address", "_checksum", "__weakref__")
+    _interned: weakref.WeakValueDictionary[bytes, Address] = (
+        weakref.WeakValueDictionary()
+    )
+
+    raw: bytes
+    address: str
+    _checksum: Optional[str]
+
+    def __new__(cls, address: Union[str, bytes, Address]) -> Address:
+        if isinstance(address, Address):
+            return address
+        if isinstance(address, bytes):
+            if len(address) != 20:
+                raise ValueError(f"Invalid Ethereum Address {address!r}")
+            raw = address
+        else:
+            # Dune uses \x instead of 0x (i.e. bytea instead of hex string)
+            address = address.replace("\\x", "0x")
+            if not ADDRESS_PATTERN.match(address):
+                raise ValueError(f"Invalid Ethereum Address {address}")
+            raw = bytes.fromhex(address.removeprefix("0x").removeprefix("0X"))
+
+        interned = cls._interned.get(raw)
+        if interned is not None:
+            return interned
+        instance = super().__new__(cls)
+        instance.raw = raw
+        instance.address = "0x" + raw.hex()
+        instance._checksum = None
+        return cls._interned.setdefault(raw, instance)
+
+    @property
+    def checksum(self) -> str:
+        """EIP-55 checksummed representation (computed once per address)"""
+        if self._checksum is None:
+            self._checksum = to_checksum_address(self.address)
+        return self._checksum
+
+    def __str__(self) -> str:
+        return self.address
+
+    def __repr__(self) -> str:
+        return f"Address({self.address})"
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, Address):
+            return self.raw == other.raw
+        return False
+
+    def __lt__(self, other: object) -> bool:
+        if isinstance(other, Address):
+            return self.raw < other.raw
+        return NotImplemented
+
+    def __hash__(self) -> int:
+        return hash(self.raw)
+
+    @classmethod
+    def zero(cls) -> Address:
+        """Returns Null Ethereum Address"""
+        return cls("0x0000000000000000000000000000000000000000")
+
+    @classmethod
+    def from_int(cls, num: int) -> Address:
+        """
+        Construct an address from int.
+        Used for testing, so that 123 -> "0x0000000000000000000000000000000000000123"
+        """
+        return cls(f"0x{str(num).rjust(40, '0')}")
@@ -0,0 +1,136 @@
+"""
+Memory-mapped, sorted address index.
+
+File layout (all integers little endian):
+    header:     b"ADDRIDX1" followed by the number of entries N (uint64)
+    addresses:  N sorted 20-byte addresses
+    offsets:    N + 1 uint64 offsets of each entry's payload within the payload block
+    payloads:   concatenated JSON encoded entries
+
+Opening an index only maps the file; lookups binary search the address block and
+decode the single matching payload, so nothing is parsed for the rest of the list.
+"""
+
+from __future__ import annotations
+
+import json
+import mmap
+import os
+import struct
+import tempfile
+from bisect import bisect_left
+from typing import Any, Iterator, Mapping
+
+MAGIC = b"ADDRIDX1"
+HEADER = struct.Struct("<8sQ")
+OFFSET = struct.Struct("<Q")
+ADDRESS_SIZE = 20
+
+
+def address_bytes(address: str) -> bytes:
+    """
+    Raw 20 bytes of a hex address string
+    >>> address_bytes("0x00000000000000000000000000000000000000ff")[-1]
+    255
+    """
+    raw = bytes.fromhex(address[2:] if address.startswith("0x") else address)
+    if len(raw) != ADDRESS_SIZE:
+        raise ValueError(f"Invalid address {address}")
+    return raw
+
+
+class _AddressColumn:  # pylint:disable=too-few-public-methods
+    """Sequence view over the address block (for bisect)"""
+
+    def __init__(self, buffer: mmap.mmap, count: int):
+        self.buffer = buffer
+        self.count = count
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __getitem__(self, i: int) -> bytes:
+        start = HEADER.size + i * ADDRESS_SIZE
+        return self.buffer[start : start + ADDRESS_SIZE]
+
+
+class AddressIndex(Mapping[str, dict[str, Any]]):
+    """Read-only mapping of lower case hex address to entry, backed by an index file"""
+
+    def __init__(self, path: str):
+        with open(path, "rb") as file:
+            self._buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self._count = HEADER.unpack_from(self._buffer, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not an address index")
+        self._addresses = _AddressColumn(self._buffer, self._count)
+        self._offsets_start = HEADER.size + self._count * ADDRESS_SIZE
+        self._payload_start = self._offsets_start + (self._count + 1) * OFFSET.size
+
+    @staticmethod
+    def build(path: str, entries: Mapping[str, dict[str, Any]]) -> None:
+        """
+        Writes (atomically replacing) an index of `entries` keyed by address.
+        Entries with invalid addresses are skipped.
+        """
+        keyed = {}
+        for address, entry in entries.items():
+            try:
+                keyed[address_bytes(address)] = entry
+            except ValueError:
+                print(f"{address} is not a valid ethereum address")
+        items = sorted(keyed.items())
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=directory, delete=False) as file:
+            file.write(HEADER.pack(MAGIC, len(items)))
+            for raw, _ in items:
+                file.write(raw)
+            payloads = [json.dumps(e, separators=(",", ":")).encode() for _, e in items]
+            offset = 0
+            for payload in payloads:
+                file.write(OFFSET.pack(offset))
+                offset += len(payload)
+            file.write(OFFSET.pack(offset))
+            for payload in payloads:
+                file.write(payload)
+        os.replace(file.name, path)
+
+    def _position(self, address: str) -> int:
+        try:
+            key = address_bytes(address)
+        except ValueError:
+            return -1
+        i = bisect_left(self._addresses, key)
+        if i < self._count and self._addresses[i] == key:
+            return i
+        return -1
+
+    def __getitem__(self, address: str) -> dict[str, Any]:
+        i = self._position(address)
+        if i < 0:
+            raise KeyError(address)
+        (start,) = OFFSET.unpack_from(
+            self._buffer, self._offsets_start + i * OFFSET.size
+        )
+        (end,) = OFFSET.unpack_from(
+            self._buffer, self._offsets_start + (i + 1) * OFFSET.size
+        )
+        entry: dict[str, Any] = json.loads(
+            self._buffer[self._payload_start + start : self._payload_start + end]
+        )
+        return entry
+
+    def __contains__(self, address: object) -> bool:
+        return isinstance(address, str) and self._position(address) >= 0
+
+    def __iter__(self) -> Iterator[str]:
+        for i in range(self._count):
+            yield "0x" + self._addresses[i].hex()
+
+    def __len__(self) -> int:
+        return self._count
+
+    def close(self) -> None:
+        """Unmaps the index file"""
+        self._buffer.close()
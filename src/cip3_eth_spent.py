@@ -1,24 +1,53 @@
-from duneapi.api import DuneAPI
-from duneapi.types import DuneQuery, Network
+from __future__ import annotations
+
+import argparse
+from datetime import timedelta
+from typing import TYPE_CHECKING, Optional
+
 from duneapi.util import open_query
 
+from src.clients import legacy_dune_client
+from src.dune_cache import ResultCache, fetch_legacy_results
+
+if TYPE_CHECKING:
+    from duneapi.api import DuneAPI
+
 
-def fetch_eth_spent(dune: DuneAPI) -> None:
+def fetch_eth_spent(dune: DuneAPI, cache: Optional[ResultCache] = None) -> None:
     """
     Fetches ETH spent on CIP-9 Fee subsidies
     https://snapshot.org/#/cow.eth/proposal/0x4bb9b614bdc4354856c4d0002ad0845b73b5290e5799013192cbc6491e6eea0e
+    (reusing results from `cache` when fresh enough)
     """
+    # duneapi configures logging from ./logging.conf as soon as it is imported.
+    # pylint:disable=import-outside-toplevel
+    from duneapi.types import DuneQuery, Network
+
     query = DuneQuery.from_environment(
         raw_sql=open_query("./queries/blockwise-discount-factors.sql"),
         name="ETH Spent on Fee Discounts",
         network=Network.MAINNET,
         parameters=[],
     )
-    results = dune.fetch(query)
+    results = fetch_legacy_results(dune, query, cache)
     print(results)
 
 
 if __name__ == "__main__":
-    dune_conn = DuneAPI.new_from_environment()
+    parser = argparse.ArgumentParser("CIP-3 ETH Spent")
+    parser.add_argument(
+        "--max-age",
+        type=float,
+        help="Reuse results cached (in out/dune-cache) within this many hours",
+    )
+    args = parser.parse_args()
+    dune_conn = legacy_dune_client()
     print("Getting ETH Spent on Fee subsidies from: https://dune.com/queries/529638")
-    fetch_eth_spent(dune_conn)
+    fetch_eth_spent(
+        dune_conn,
+        (
+            None
+            if args.max_age is None
+            else ResultCache(max_age=timedelta(hours=args.max_age))
+        ),
+    )
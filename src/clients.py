@@ -0,0 +1,150 @@
+"""
+Process-wide registry of lazily created clients.
+
+Nothing is constructed (and no environment variable is read) at import time.
+Each client is created on first use and shared by all later callers, so that
+connection pools are reused across calls and threads.
+"""
+
+from __future__ import annotations
+
+import functools
+import os
+import threading
+from typing import TYPE_CHECKING, Any, Callable, ParamSpec, TypeVar
+from urllib.parse import urlparse
+
+import requests
+from dotenv import load_dotenv
+from dune_client.client import DuneClient
+from requests.adapters import HTTPAdapter
+from web3 import Web3
+
+from src.rate_limit import TokenBucket, configured_rate
+
+if TYPE_CHECKING:
+    from duneapi.api import DuneAPI
+
+    from src.dune_executor import DuneExecutor
+
+P = ParamSpec("P")
+T = TypeVar("T")
+
+_REGISTRY: dict[tuple[Any, ...], Any] = {}
+# Held while the client of a key is created (so only its callers wait for it)
+_KEY_LOCKS: dict[tuple[Any, ...], threading.Lock] = {}
+# Guards _REGISTRY and _KEY_LOCKS (never held while creating a client)
+_LOCK = threading.Lock()
+
+
+def registered(factory: Callable[P, T]) -> Callable[P, T]:
+    """
+    Turns `factory` into an accessor returning one shared instance per distinct
+    set of arguments, created on first access. Only callers with the same
+    arguments wait while an instance is created (e.g. while logging in).
+    """
+
+    @functools.wraps(factory)
+    def get(*args: P.args, **kwargs: P.kwargs) -> T:
+        key = (factory.__module__, factory.__qualname__, args, tuple(kwargs.items()))
+        with _LOCK:
+            if key in _REGISTRY:
+                client: T = _REGISTRY[key]
+                return client
+            key_lock = _KEY_LOCKS.setdefault(key, threading.Lock())
+        with key_lock:
+            with _LOCK:
+                if key in _REGISTRY:
+                    client = _REGISTRY[key]
+                    return client
+            client = factory(*args, **kwargs)
+            with _LOCK:
+                _REGISTRY[key] = client
+            return client
+
+    return get
+
+
+def reset_clients() -> None:
+    """Forgets all registered clients (new ones are created on next access)"""
+    with _LOCK:
+        _REGISTRY.clear()
+        _KEY_LOCKS.clear()
+
+
+class _ThrottledSession(requests.Session):
+    """Session taking a token of `limiter` before every request"""
+
+    def __init__(self, limiter: TokenBucket):
+        super().__init__()
+        self.limiter = limiter
+
+    def request(  # type: ignore[override]
+        self, method: str, url: str, *args: Any, **kwargs: Any
+    ) -> requests.Response:
+        self.limiter.acquire()
+        return super().request(method, url, *args, **kwargs)
+
+
+def _pooled(session: requests.Session) -> requests.Session:
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+@registered
+def web3_client(node_url: str) -> Web3:
+    """
+    Web3 instance connected to `node_url`. Its requests share the "rpc" rate limit
+    of the node's host (with those of src.multicall).
+    """
+    limiter = rate_limiter("rpc", urlparse(node_url).netloc)
+    return Web3(
+        Web3.HTTPProvider(node_url, session=_pooled(_ThrottledSession(limiter)))
+    )
+
+
+@registered
+def dune_client() -> DuneClient:
+    """Official Dune API client, authenticated via DUNE_API_KEY"""
+    load_dotenv()
+    return DuneClient(os.environ["DUNE_API_KEY"])
+
+
+@registered
+def dune_executor() -> DuneExecutor:
+    """Executor of saved Dune queries shared by all scripts (see src.dune_executor)"""
+    # pylint:disable=import-outside-toplevel
+    from src.dune_executor import DuneExecutor
+
+    return DuneExecutor(dune_client(), limiter=rate_limiter("dune"))
+
+
+@registered
+def legacy_dune_client() -> DuneAPI:
+    """Legacy Dune client, authenticated via DUNE_USER and DUNE_PASSWORD"""
+    # duneapi configures logging from ./logging.conf as soon as it is imported.
+    # pylint:disable=import-outside-toplevel
+    from duneapi.api import DuneAPI
+
+    load_dotenv()
+    return DuneAPI.new_from_environment()
+
+
+@registered
+def rate_limiter(
+    name: str, upstream: str = ""  # pylint:disable=unused-argument
+) -> TokenBucket:
+    """
+    Token bucket shared by all requests to `upstream` (e.g. a host) of the kind
+    `name`, at the rate configured for `name` (see src.rate_limit)
+    """
+    rate, capacity = configured_rate(name)
+    return TokenBucket(rate, capacity)
+
+
+@registered
+def http_session(name: str) -> requests.Session:  # pylint:disable=unused-argument
+    """Keep-alive HTTP session (with its own connection pool) for upstream `name`"""
+    return _pooled(requests.Session())
@@ -1,7 +1,6 @@
 import os
 from pathlib import Path
 
-
 PROJECT_ROOT = Path(__file__).parent.parent
 
 PUBLIC_RESOLVER_ABI = [
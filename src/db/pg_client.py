@@ -5,12 +5,19 @@ from dotenv import load_dotenv
 from psycopg2._psycopg import connection
 from sqlalchemy import create_engine, Engine
 
-load_dotenv()
-host = os.environ["ORDERBOOK_HOST"]
-port = os.environ["ORDERBOOK_PORT"]
-database = os.environ["ORDERBOOK_DB"]
-user = os.environ["ORDERBOOK_USER"]
-password = os.environ["ORDERBOOK_PASSWORD"]
+from src.clients import registered
+
+
+def credentials() -> dict[str, str]:
+    """Orderbook DB connection parameters from the ORDERBOOK_* environment variables"""
+    load_dotenv()
+    return {
+        "host": os.environ["ORDERBOOK_HOST"],
+        "port": os.environ["ORDERBOOK_PORT"],
+        "database": os.environ["ORDERBOOK_DB"],
+        "user": os.environ["ORDERBOOK_USER"],
+        "password": os.environ["ORDERBOOK_PASSWORD"],
+    }
 
 
 def pg_connect() -> connection:
@@ -22,18 +29,19 @@ def pg_connect() -> connection:
         UserWarning,
     )
     """
-    return psycopg2.connect(
-        host=host,
-        port=port,
-        database=database,
-        user=user,
-        password=password,
-    )
+    return psycopg2.connect(**credentials())
 
 
+@registered
 def pg_engine() -> Engine:
+    """Orderbook DB engine, shared (along with its connection pool) process-wide"""
     return create_engine(db_string())
 
 
 def db_string() -> str:
-    return f"postgresql+psycopg2://{user}:{password}@{host}:{port}/{database}"
+    """SQLAlchemy URL of the orderbook DB"""
+    cred = credentials()
+    return (
+        f"postgresql+psycopg2://{cred['user']}:{cred['password']}"
+        f"@{cred['host']}:{cred['port']}/{cred['database']}"
+    )
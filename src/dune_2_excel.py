@@ -1,88 +1,238 @@
-import os
-from typing import List, Any
-from datetime import datetime
+import functools
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, Iterator, List, Mapping, Optional, Sequence
+from datetime import datetime, timedelta
 
 import click
 from dotenv import load_dotenv
-from dune_client.client import DuneClient
-from dune_client.models import ResultsResponse
+from dune_client.models import ExecutionStatusResponse
 from dune_client.query import QueryBase as Query
 from dune_client.types import QueryParameter
 import pandas as pd
 from tqdm import tqdm
+from xlsxwriter import Workbook
 
+from src.clients import dune_executor
 from src.constants import PROJECT_ROOT
+from src.dune_cache import ResultCache, query_params
+from src.dune_executor import DuneExecutor
+from src.dune_results import PAGE_SIZE, execution_pages
+
+# Number of Dune executions awaited at the same time
+MAX_CONCURRENT_POLLS = 4
+# Number of rows (including the header) of an Excel worksheet
+EXCEL_MAX_ROWS = 1_048_576
 
 
 @click.command()
 @click.option("--query", "-q", "queries_", multiple=True)
 @click.option("--start-date", "-s", type=click.DateTime(formats=["%Y-%m-%d"]))
-def main(queries_: List[str], start_date: datetime) -> Any:
+@click.option(
+    "--max-age",
+    type=float,
+    default=None,
+    help="Reuse results cached (in out/dune-cache) within this many hours",
+)
+@click.option(
+    "--page-size",
+    type=int,
+    default=PAGE_SIZE,
+    help="Number of rows downloaded (and held in memory) at a time",
+)
+def main(
+    queries_: List[str],
+    start_date: datetime,
+    max_age: Optional[float],
+    page_size: int,
+) -> Any:
     """
     Main function of the script
     Args:
         queries_: List of queries to fetch
         start_date: start_date query parameter
+        max_age: hours for which cached results are reused (no caching if None)
+        page_size: number of result rows downloaded at a time
 
     Returns:
 
     """
-    monthly_reporting(queries_, start_date)
+    cache = None if max_age is None else ResultCache(max_age=timedelta(hours=max_age))
+    monthly_reporting(queries_, start_date, cache, page_size)
     return 0
 
 
-def store_results(results: List[ResultsResponse], start_date: datetime) -> None:
+def frame_rows(frame: pd.DataFrame, chunk_size: int = 10_000) -> Iterator[tuple]:
+    """
+    Rows of `frame` as tuples of Python values (None for nulls),
+    converted `chunk_size` rows at a time.
+    """
+    for start in range(0, len(frame), chunk_size):
+        chunk = frame.iloc[start : start + chunk_size].astype(object)
+        yield from chunk.where(chunk.notna(), None).itertuples(index=False, name=None)
+
+
+def write_sheets(
+    workbook: Workbook,
+    name: str,
+    columns: list[str],
+    rows: Iterable[Sequence[Any]],
+    max_rows: int = EXCEL_MAX_ROWS,
+) -> int:
+    """
+    Writes `rows` (of values in the order of `columns`) below a header of `columns`
+    into worksheet `name`, continuing in
+    worksheets `name`_2, `name`_3, ... whenever one reaches `max_rows`. Rows are
+    written as they are consumed, and each value keeps the type it was received in
+    (numbers, strings, booleans, or blank for null).
+    Returns the number of worksheets written.
     """
-    Store results into xlsx file
+    header = workbook.add_format({"bold": True})
+    worksheets = 0
+    worksheet = None
+    for index, row in enumerate(rows):
+        row_index = index % (max_rows - 1) + 1
+        if row_index == 1:
+            worksheets += 1
+            worksheet = workbook.add_worksheet(
+                name if worksheets == 1 else f"{name}_{worksheets}"
+            )
+            worksheet.write_row(0, 0, columns, header)
+        assert worksheet is not None
+        worksheet.write_row(row_index, 0, row)
+    if worksheets == 0:
+        workbook.add_worksheet(name).write_row(0, 0, columns, header)
+        worksheets = 1
+    return worksheets
+
+
+def store_results(
+    results: Mapping[int, Iterable[pd.DataFrame]], start_date: datetime
+) -> None:
+    """
+    Store results into xlsx file. The workbook is written in constant memory mode,
+    i.e. rows are flushed to disk as they are written, and results are consumed
+    page by page.
     Args:
-        results: results to be stored
+        results: pages of results (by query id) to be stored
         start_date: start_date query parameter
     """
-    writer = pd.ExcelWriter(  # pylint: disable=abstract-class-instantiated
-        PROJECT_ROOT / f'out/{"_".join([str(x.query_id) for x in results])}'
-        f'_{start_date.strftime("%Y-%m-%d")}.xlsx',
-        engine="xlsxwriter",
+    path = (
+        PROJECT_ROOT / f'out/{"_".join([str(x) for x in results])}'
+        f'_{start_date.strftime("%Y-%m-%d")}.xlsx'
     )
-    for result in results:
-        pd.DataFrame(result.get_rows()).to_excel(
-            writer, sheet_name=f"{result.query_id}", index=False
-        )
-    writer.close()
+    with Workbook(path, {"constant_memory": True}) as workbook:
+        for query_id, pages in results.items():
+            pages = iter(pages)
+            first = next(pages)
+            rows = itertools.chain.from_iterable(
+                frame_rows(page) for page in itertools.chain([first], pages)
+            )
+            write_sheets(workbook, f"{query_id}", list(first.columns), rows)
+
+
+def await_result(
+    executor: DuneExecutor, job_id: str, progress: tqdm
+) -> ExecutionStatusResponse:
+    """
+    Waits for the (already submitted) execution `job_id`,
+    reporting the execution state on `progress`.
+    """
+    status = executor.await_execution(
+        job_id, lambda state: progress.set_postfix_str(state.value)
+    )
+    progress.update()
+    return status
 
 
-def fetch_results(queries: List[str], start_date: datetime) -> List[ResultsResponse]:
+def await_results(
+    executor: DuneExecutor, job_ids: Dict[int, str]
+) -> List[ExecutionStatusResponse]:
+    """
+    Awaits the executions `job_ids` (by query id) concurrently, at most
+    MAX_CONCURRENT_POLLS at a time, with one progress line per query.
     """
-    Fetches results from Dune
+    bars = [
+        tqdm(desc=f"query {q}", total=1, position=i, leave=True)
+        for i, q in enumerate(job_ids)
+    ]
+    try:
+        with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_POLLS) as pool:
+            await_job = functools.partial(await_result, executor)
+            return list(pool.map(await_job, job_ids.values(), bars))
+    finally:
+        for progress_bar in bars:
+            progress_bar.close()
+
+
+def fetch_results(
+    queries: List[str],
+    start_date: datetime,
+    cache: Optional[ResultCache] = None,
+    page_size: int = PAGE_SIZE,
+    executor: Optional[DuneExecutor] = None,
+) -> Dict[int, Iterator[pd.DataFrame]]:
+    """
+    Fetches results from Dune. Results found in `cache` are used as is, all other
+    executions are submitted up front and awaited concurrently (see await_results).
     Args:
         queries: List of queries to fetch
         start_date: start_date query parameter
+        cache: local result cache (results are neither read nor stored if None)
+        page_size: number of rows per page of results
+        executor: executor of the queries (the shared one if None)
 
     Returns:
-        List[ResultsResponse]
+        Pages of results by query id, in the order of `queries`. Pages are read
+        (and stored in `cache`) as they are consumed.
     """
-    dune_client: DuneClient = DuneClient(os.environ["DUNE_API_KEY"])
-    results: List[ResultsResponse] = []
-    # TODO: Make fetching of queries asynchronous #24
-    for q in tqdm(queries):
-        query = Query(
+    executor = executor or dune_executor()
+    report_queries = {
+        int(q): Query(
             name="",
             query_id=int(q),
             params=[QueryParameter.date_type("StartTime", start_date)],
         )
-        result = dune_client.refresh(query)
-        results.append(result)
-
-    return results
-
-
-def monthly_reporting(queries: List[str], start_date: datetime) -> None:
+        for q in queries
+    }
+    results: Dict[int, Optional[Iterator[pd.DataFrame]]] = {
+        query_id: (
+            cache.pages(query_id, query_params(query), page_size) if cache else None
+        )
+        for query_id, query in report_queries.items()
+    }
+    job_ids = {
+        query_id: executor.submit(report_queries[query_id])
+        for query_id, pages in results.items()
+        if pages is None
+    }
+    statuses = await_results(executor, job_ids)
+    for (query_id, job_id), status in zip(job_ids.items(), statuses):
+        pages = execution_pages(
+            executor.dune, job_id, status.result_metadata, page_size
+        )
+        if cache:
+            params = query_params(report_queries[query_id])
+            pages = cache.put_pages(query_id, params, pages)
+        results[query_id] = pages
+    return {query_id: pages for query_id, pages in results.items() if pages is not None}
+
+
+def monthly_reporting(
+    queries: List[str],
+    start_date: datetime,
+    cache: Optional[ResultCache] = None,
+    page_size: int = PAGE_SIZE,
+) -> None:
     """
     Fetches and stores results from list of input queries.
     Args:
         queries: List of queries to fetch
         start_date: start_date query parameter
+        cache: local result cache (not used if None)
+        page_size: number of result rows downloaded at a time
     """
-    results = fetch_results(queries, start_date)
+    results = fetch_results(queries, start_date, cache=cache, page_size=page_size)
     store_results(results, start_date)
 
 
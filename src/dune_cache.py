@@ -0,0 +1,255 @@
+"""
+Local, content addressed cache of Dune query results.
+
+Results are keyed by a hash of the query (saved query id or raw SQL) and its
+parameters, and stored as Parquet files so they are read back as typed columns.
+Results younger than `max_age` are served without touching Dune. On a miss, saved
+queries can reuse Dune's latest result for the same parameters (if it is younger
+than `max_age` as well) instead of triggering a new execution. Executions go
+through a (shared) DuneExecutor.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Callable, Iterable, Iterator, Optional
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import requests
+from dune_client.models import DuneError
+from dune_client.query import QueryBase
+
+from src.constants import PROJECT_ROOT
+from src.dune_results import execution_frame
+
+if TYPE_CHECKING:
+    from src.dune_executor import DuneExecutor
+    from duneapi.api import DuneAPI
+    from duneapi.types import DuneQuery
+
+DUNE_CACHE_DIR = PROJECT_ROOT / "out" / "dune-cache"
+# Maximum age (in hours) for which Dune's client never re-executes a query itself
+NEVER_STALE_HOURS = 2**31
+
+
+def result_key(query: int | str, params: dict[str, Any]) -> str:
+    """
+    Content address of the results of `query` (saved query id or raw SQL)
+    with `params`, independent of the order of the parameters.
+    """
+    content = json.dumps({"query": query, "params": params}, sort_keys=True)
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def frame_records(frame: pd.DataFrame) -> list[dict[str, Any]]:
+    """Rows of `frame` as dicts of Python values (None for nulls), like get_rows()"""
+    values = frame.astype(object)
+    records: list[dict[str, Any]] = values.where(values.notna(), None).to_dict(
+        "records"
+    )
+    return records
+
+
+def query_params(query: QueryBase) -> dict[str, Any]:
+    """Parameter values of the saved `query` by name"""
+    params = query.request_format()["query_parameters"]
+    assert isinstance(params, dict)
+    return params
+
+
+class ResultCache:
+    """Directory of Parquet result sets keyed by query and parameters"""
+
+    def __init__(
+        self,
+        directory: Path | str = DUNE_CACHE_DIR,
+        max_age: timedelta = timedelta(hours=24),
+    ):
+        self.directory = Path(directory)
+        self.max_age = max_age
+
+    def _paths(self, key: str) -> tuple[Path, Path]:
+        return self.directory / f"{key}.parquet", self.directory / f"{key}.meta.json"
+
+    def _write(self, path: Path, write: Callable[[str], Any]) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        handle, name = tempfile.mkstemp(dir=self.directory)
+        os.close(handle)
+        try:
+            write(name)
+            os.replace(name, path)
+        finally:
+            if os.path.exists(name):
+                os.remove(name)
+
+    def _is_fresh(self, meta_path: Path, max_age: Optional[timedelta]) -> bool:
+        if not meta_path.exists():
+            return False
+        meta = json.loads(meta_path.read_text(encoding="utf-8"))
+        age = time.time() - meta["fetched_at"]
+        return age <= (max_age or self.max_age).total_seconds()
+
+    def get(
+        self,
+        query: int | str,
+        params: dict[str, Any],
+        max_age: Optional[timedelta] = None,
+    ) -> Optional[pd.DataFrame]:
+        """Cached results of `query` with `params`, unless missing or expired"""
+        data_path, meta_path = self._paths(result_key(query, params))
+        if not self._is_fresh(meta_path, max_age):
+            return None
+        return pd.read_parquet(data_path)
+
+    def pages(
+        self,
+        query: int | str,
+        params: dict[str, Any],
+        page_size: int,
+        max_age: Optional[timedelta] = None,
+    ) -> Optional[Iterator[pd.DataFrame]]:
+        """
+        Same as `get`, but read in pages of (at most) `page_size` rows. There is
+        always at least one (possibly empty) page, carrying the columns.
+        """
+        data_path, meta_path = self._paths(result_key(query, params))
+        if not self._is_fresh(meta_path, max_age):
+            return None
+        parquet = pq.ParquetFile(data_path)
+        if parquet.metadata.num_rows == 0:
+            return iter([parquet.schema_arrow.empty_table().to_pandas()])
+        return (
+            batch.to_pandas() for batch in parquet.iter_batches(batch_size=page_size)
+        )
+
+    def put_pages(
+        self, query: int | str, params: dict[str, Any], pages: Iterable[pd.DataFrame]
+    ) -> Iterator[pd.DataFrame]:
+        """
+        Passes `pages` through, storing them as the results of `query` with
+        `params` once all were consumed. Results which have no columnar
+        representation (e.g. mixed types in a column) are not cached.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        handle, name = tempfile.mkstemp(dir=self.directory)
+        os.close(handle)
+        writer: Optional[pq.ParquetWriter] = None
+        rows: Optional[int] = 0
+        try:
+            for page in pages:
+                if rows is not None:
+                    try:
+                        table = pa.Table.from_pandas(page, preserve_index=False)
+                        if writer is None:
+                            writer = pq.ParquetWriter(name, table.schema)
+                        writer.write_table(table.cast(writer.schema))
+                        rows += len(page)
+                    except (pa.ArrowException, OverflowError) as err:
+                        print(f"Not caching results of query {query}: {err}")
+                        rows = None
+                yield page
+            if writer is not None and rows is not None:
+                writer.close()
+                writer = None
+                data_path, meta_path = self._paths(result_key(query, params))
+                os.replace(name, data_path)
+                meta = {
+                    "query": query,
+                    "params": params,
+                    "rows": rows,
+                    "fetched_at": time.time(),
+                }
+                self._write(
+                    meta_path,
+                    lambda path: Path(path).write_text(json.dumps(meta), "utf-8"),
+                )
+        finally:
+            if writer is not None:
+                writer.close()
+            if os.path.exists(name):
+                os.remove(name)
+
+    def put(
+        self, query: int | str, params: dict[str, Any], frame: pd.DataFrame
+    ) -> None:
+        """Stores `frame` as the results of `query` with `params` (see put_pages)"""
+        for _ in self.put_pages(query, params, [frame]):
+            pass
+
+    def fetch(
+        self,
+        query: int | str,
+        params: dict[str, Any],
+        load: Callable[[], pd.DataFrame],
+        max_age: Optional[timedelta] = None,
+    ) -> pd.DataFrame:
+        """Cached results of `query` with `params`, or those returned by `load`"""
+        frame = self.get(query, params, max_age)
+        if frame is None:
+            frame = load()
+            self.put(query, params, frame)
+        return frame
+
+
+def run_query_frame(executor: DuneExecutor, query: QueryBase) -> pd.DataFrame:
+    """Executes `query` and reads its results (see execution_frame)"""
+    status = executor.run(query)
+    return execution_frame(executor.dune, status.execution_id, status.result_metadata)
+
+
+def fetch_query_results(
+    executor: DuneExecutor,
+    query: QueryBase,
+    cache: Optional[ResultCache] = None,
+) -> pd.DataFrame:
+    """
+    Results of the saved `query`. With a `cache`, cached results are used when
+    fresh enough and so is Dune's latest result of the query; otherwise (or when
+    there is no latest result) the query is executed by `executor` (and its results
+    read from the CSV export).
+    """
+    if cache is None:
+        return run_query_frame(executor, query)
+
+    def load() -> pd.DataFrame:
+        # A single row of the latest result tells its age (but never re-executes)
+        try:
+            latest = executor.dune.get_latest_result(
+                query, max_age_hours=NEVER_STALE_HOURS, sample_count=1
+            )
+        except (requests.HTTPError, DuneError) as err:
+            # e.g. the query was never executed with these parameters
+            print(f"No latest result of query {query.query_id} ({err}), executing")
+            return run_query_frame(executor, query)
+        ended = latest.times.execution_ended_at
+        if ended is None or datetime.now(timezone.utc) - ended > cache.max_age:
+            return run_query_frame(executor, query)
+        metadata = latest.result.metadata if latest.result else None
+        return execution_frame(executor.dune, latest.execution_id, metadata)
+
+    return cache.fetch(query.query_id, query_params(query), load)
+
+
+def fetch_legacy_results(
+    dune: DuneAPI, query: DuneQuery, cache: Optional[ResultCache] = None
+) -> pd.DataFrame:
+    """Results of the raw SQL `query` (executed via the legacy API unless cached)"""
+
+    def load() -> pd.DataFrame:
+        return pd.DataFrame.from_records(dune.fetch(query))
+
+    if cache is None:
+        return load()
+    params = {
+        "network": str(query.network),
+        "parameters": [p.to_dict() for p in query.parameters],
+    }
+    return cache.fetch(query.raw_sql, params, load)
@@ -0,0 +1,296 @@
+"""
+Shared execution of saved Dune queries.
+
+Scripts execute queries through a DuneExecutor rather than polling Dune on their
+own, which
+
+- collapses identical executions (same query and parameters): while one is in
+  flight it is recorded in a local SQLite database, so that later submissions,
+  from this or any other process, wait for it instead of executing it again;
+- polls adaptively: the status is requested again after a fraction of the time
+  the execution has been running (or the query usually runs, by the runtimes
+  recorded for it), so short queries are seen to finish quickly while long ones
+  are not polled needlessly.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import os
+import sqlite3
+import statistics
+import threading
+import time
+from concurrent.futures import Future
+from datetime import timedelta
+from pathlib import Path
+from typing import Callable, Iterator, NamedTuple, Optional
+
+from dune_client.client import DuneClient
+from dune_client.models import (
+    ExecutionState,
+    ExecutionStatusResponse,
+    QueryFailedError,
+)
+from dune_client.query import QueryBase
+
+from src.constants import PROJECT_ROOT
+from src.dune_cache import query_params, result_key
+from src.rate_limit import TokenBucket
+
+EXECUTOR_STATE_PATH = PROJECT_ROOT / "out" / "dune-executor.sqlite"
+# Bounds (in seconds) of the delay between status requests of an execution
+MIN_POLL_DELAY = 1.0
+MAX_POLL_DELAY = 30.0
+# Delay between status requests as a fraction of the (expected) runtime
+POLL_BACKOFF = 0.2
+# Number of most recent runtimes of a query its expected runtime is based on
+RUNTIME_HISTORY = 10
+# Executions in flight for longer are assumed abandoned (and not joined)
+IN_FLIGHT_TTL = timedelta(hours=2)
+# Execution id of a key claimed by a submission still awaiting its execution id
+PENDING = ""
+# Claims older than this are assumed abandoned (and taken over)
+CLAIM_TTL = timedelta(minutes=2)
+
+
+class InFlight(NamedTuple):
+    """Execution submitted by an executor and not seen to end yet"""
+
+    query_id: int
+    submitted_at: float
+
+
+class DuneExecutor:
+    """Submits and awaits executions of saved queries (see module docstring)"""
+
+    def __init__(  # pylint:disable=too-many-arguments
+        self,
+        dune: DuneClient,
+        path: Path | str = EXECUTOR_STATE_PATH,
+        *,
+        min_delay: float = MIN_POLL_DELAY,
+        max_delay: float = MAX_POLL_DELAY,
+        clock: Callable[[], float] = time.time,
+        sleep: Callable[[float], None] = time.sleep,
+        limiter: Optional[TokenBucket] = None,
+    ):
+        self.dune = dune
+        self.path = path
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        # Throttles the execution and status requests (of all executors sharing it)
+        self.limiter = limiter
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        # Status of the executions polled by a thread of this executor, by id
+        self._polling: dict[str, Future[ExecutionStatusResponse]] = {}
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._transaction() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS in_flight (
+                    key TEXT PRIMARY KEY,
+                    query_id INTEGER NOT NULL,
+                    execution_id TEXT NOT NULL,
+                    submitted_at REAL NOT NULL
+                )
+                """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS runtimes (
+                    query_id INTEGER NOT NULL,
+                    seconds REAL NOT NULL,
+                    ended_at REAL NOT NULL
+                )
+                """)
+
+    @contextlib.contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        """Write transaction (excluding all other writers) on the state database"""
+        conn = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+    def expected_runtime(self, query_id: int) -> Optional[float]:
+        """Median of the recent runtimes (in seconds) of `query_id`, if any"""
+        with self._transaction() as conn:
+            rows = conn.execute(
+                "SELECT seconds FROM runtimes WHERE query_id = ? "
+                "ORDER BY ended_at DESC LIMIT ?",
+                (query_id, RUNTIME_HISTORY),
+            ).fetchall()
+        return statistics.median(seconds for (seconds,) in rows) if rows else None
+
+    def poll_delay(self, elapsed: float, expected: Optional[float] = None) -> float:
+        """
+        Seconds to wait before the next status request of an execution which has
+        been running for `elapsed` seconds (and usually takes `expected` seconds)
+        >>> executor = DuneExecutor.__new__(DuneExecutor)
+        >>> executor.min_delay, executor.max_delay = 1, 30
+        >>> [executor.poll_delay(s) for s in (0, 10, 60, 600)]
+        [1, 2.0, 12.0, 30]
+        >>> executor.poll_delay(10, expected=100)
+        20.0
+        """
+        delay = POLL_BACKOFF * max(elapsed, expected or 0)
+        return min(self.max_delay, max(self.min_delay, delay))
+
+    def _claim(self, key: str, query_id: int) -> Optional[str]:
+        """
+        Id of the execution in flight for `key` if there is one. Otherwise claims
+        `key` for this executor (returning None) unless another one claimed it.
+        """
+        now = self._clock()
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT execution_id, submitted_at FROM in_flight "
+                "WHERE key = ? AND submitted_at > ?",
+                (key, now - IN_FLIGHT_TTL.total_seconds()),
+            ).fetchone()
+            if row is not None:
+                execution_id, claimed_at = row
+                if (
+                    execution_id != PENDING
+                    or claimed_at > now - CLAIM_TTL.total_seconds()
+                ):
+                    return str(execution_id)
+            conn.execute(
+                "INSERT OR REPLACE INTO in_flight "
+                "(key, query_id, execution_id, submitted_at) VALUES (?, ?, ?, ?)",
+                (key, query_id, PENDING, now),
+            )
+        return None
+
+    def submit(self, query: QueryBase) -> str:
+        """
+        Id of an execution of `query`: the one already in flight with the same
+        parameters if there is one, a new one otherwise.
+        The database is not locked while the execution is requested: the key is
+        claimed first, and submissions of the same key wait for the claim to
+        turn into an execution id.
+        """
+        key = result_key(query.query_id, query_params(query))
+        while (execution_id := self._claim(key, query.query_id)) == PENDING:
+            self._sleep(self.min_delay)
+        if execution_id is not None:
+            print(f"Joining execution {execution_id} of query {query.query_id}")
+            return execution_id
+        try:
+            if self.limiter:
+                self.limiter.acquire()
+            execution_id = self.dune.execute_query(query).execution_id
+        except BaseException:
+            with self._transaction() as conn:
+                conn.execute(
+                    "DELETE FROM in_flight WHERE key = ? AND execution_id = ?",
+                    (key, PENDING),
+                )
+            raise
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE in_flight SET execution_id = ?, submitted_at = ? "
+                "WHERE key = ? AND execution_id = ?",
+                (execution_id, self._clock(), key, PENDING),
+            )
+        return execution_id
+
+    def _in_flight(self, job_id: str) -> Optional[InFlight]:
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT query_id, submitted_at FROM in_flight "
+                "WHERE execution_id = ?",
+                (job_id,),
+            ).fetchone()
+        return InFlight(*row) if row else None
+
+    def _finish(self, job_id: str, status: ExecutionStatusResponse) -> None:
+        """Forgets the ended execution `job_id`, recording its runtime if completed"""
+        now = self._clock()
+        with self._transaction() as conn:
+            row = conn.execute(
+                "DELETE FROM in_flight WHERE execution_id = ? "
+                "RETURNING query_id, submitted_at",
+                (job_id,),
+            ).fetchone()
+            if row is not None and status.state == ExecutionState.COMPLETED:
+                query_id, submitted_at = row
+                conn.execute(
+                    "INSERT INTO runtimes (query_id, seconds, ended_at) "
+                    "VALUES (?, ?, ?)",
+                    (query_id, now - submitted_at, now),
+                )
+
+    def _status(self, job_id: str) -> ExecutionStatusResponse:
+        if self.limiter:
+            self.limiter.acquire()
+        return self.dune.get_execution_status(job_id)
+
+    def _poll(
+        self, job_id: str, on_state: Optional[Callable[[ExecutionState], None]]
+    ) -> ExecutionStatusResponse:
+        in_flight = self._in_flight(job_id)
+        started = in_flight.submitted_at if in_flight else self._clock()
+        expected = self.expected_runtime(in_flight.query_id) if in_flight else None
+        status = self._status(job_id)
+        while status.state not in ExecutionState.terminal_states():
+            if on_state:
+                on_state(status.state)
+            self._sleep(self.poll_delay(self._clock() - started, expected))
+            status = self._status(job_id)
+        if on_state:
+            on_state(status.state)
+        self._finish(job_id, status)
+        return status
+
+    def await_execution(
+        self,
+        job_id: str,
+        on_state: Optional[Callable[[ExecutionState], None]] = None,
+    ) -> ExecutionStatusResponse:
+        """
+        Polls the status of the (already submitted) execution `job_id` until it
+        ends, passing every state seen to `on_state`. Threads awaiting the same
+        execution share the status requests of the first one.
+        Raises QueryFailedError unless the execution completed.
+        """
+        with self._lock:
+            polling = self._polling.get(job_id)
+            owner = polling is None
+            if polling is None:
+                polling = self._polling[job_id] = Future()
+        if owner:
+            try:
+                status = self._poll(job_id, on_state)
+                polling.set_result(status)
+            except BaseException as err:
+                polling.set_exception(err)
+                raise
+            finally:
+                with self._lock:
+                    del self._polling[job_id]
+        else:
+            status = polling.result()
+            if on_state:
+                on_state(status.state)
+        if status.state != ExecutionState.COMPLETED:
+            message = status.error.message if status.error else "Query execution failed"
+            raise QueryFailedError(
+                f"Execution {job_id} ended in {status.state}: {message}"
+            )
+        return status
+
+    def run(
+        self,
+        query: QueryBase,
+        on_state: Optional[Callable[[ExecutionState], None]] = None,
+    ) -> ExecutionStatusResponse:
+        """Executes `query` (see submit) and awaits its completion"""
+        return self.await_execution(self.submit(query), on_state)
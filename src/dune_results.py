@@ -0,0 +1,100 @@
+"""
+Columnar ingestion of Dune results.
+
+Results are downloaded from the CSV export of an execution, page by page, and
+parsed straight into typed DataFrame columns, rather than into one dict per row
+(as ResultsResponse.get_rows does). Consumers that work page by page
+(execution_pages) only ever hold two pages in memory. Where the column types of
+the execution are known they fix the dtypes, so that e.g. a varchar column of digits stays a string
+column and integer columns with nulls stay integers.
+"""
+
+from __future__ import annotations
+
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import IO, Iterator, Optional
+
+import pandas as pd
+from dune_client.client import DuneClient
+from dune_client.models import ResultMetadata
+
+# Number of rows per page of results
+PAGE_SIZE = 100_000
+# Pandas dtypes of the Dune column types CSV inference could get wrong
+DUNE_DTYPES = {
+    "tinyint": "Int64",
+    "smallint": "Int64",
+    "integer": "Int64",
+    "bigint": "Int64",
+    "real": "float64",
+    "double": "float64",
+    "boolean": "boolean",
+    "varchar": "string",
+    "varbinary": "string",
+}
+
+
+def column_dtypes(metadata: Optional[ResultMetadata]) -> dict[str, str]:
+    """Pandas dtypes of the columns (of known type) described by `metadata`"""
+    if metadata is None:
+        return {}
+    return {
+        name: DUNE_DTYPES[column_type]
+        for name, column_type in zip(metadata.column_names, metadata.column_types)
+        if column_type in DUNE_DTYPES
+    }
+
+
+def read_csv(data: IO[bytes], dtypes: Optional[dict[str, str]] = None) -> pd.DataFrame:
+    """
+    Parses a CSV export of Dune results (with header row). The C parser is used
+    since the pyarrow one reads 0x prefixed strings (e.g. addresses) as integers.
+    An export without any columns is read as an empty frame.
+    """
+    try:
+        return pd.read_csv(data, dtype=dtypes)
+    except pd.errors.EmptyDataError:
+        return pd.DataFrame()
+
+
+def execution_pages(
+    dune: DuneClient,
+    job_id: str,
+    metadata: Optional[ResultMetadata] = None,
+    page_size: int = PAGE_SIZE,
+) -> Iterator[pd.DataFrame]:
+    """
+    Rows of the completed execution `job_id` in pages of (at most) `page_size`,
+    read from its CSV export. `metadata` (from the status of the execution) types
+    the columns. While a page is consumed the next one is downloaded (and parsed)
+    in the background, so at most two pages are held at a time.
+    There is always at least one (possibly empty) page, carrying the columns.
+    """
+    dtypes = column_dtypes(metadata)
+
+    def fetch(offset: int) -> tuple[pd.DataFrame, Optional[int]]:
+        page = dune.get_execution_results_csv(job_id, limit=page_size, offset=offset)
+        return read_csv(page.data, dtypes), page.next_offset
+
+    with ThreadPoolExecutor(max_workers=1) as prefetch:
+        pending: Optional[Future[tuple[pd.DataFrame, Optional[int]]]]
+        pending = prefetch.submit(fetch, 0)
+        while pending is not None:
+            frame, next_offset = pending.result()
+            pending = None
+            if next_offset is not None:
+                pending = prefetch.submit(fetch, int(next_offset))
+            yield frame
+
+
+def execution_frame(
+    dune: DuneClient,
+    job_id: str,
+    metadata: Optional[ResultMetadata] = None,
+    page_size: int = PAGE_SIZE,
+) -> pd.DataFrame:
+    """All rows of the completed execution `job_id` (see execution_pages)"""
+    pages = list(execution_pages(dune, job_id, metadata, page_size))
+    if len(pages) == 1:
+        return pages[0]
+    return pd.concat(pages, ignore_index=True)
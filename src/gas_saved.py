@@ -2,9 +2,9 @@ import click
 import pandas as pd
 from dotenv import load_dotenv
 from eth_typing.encoding import HexStr
-from web3 import Web3
 from web3.types import TxReceipt
 
+from src.clients import web3_client
 from src.constants import ETH_RPC
 from src.db.pg_client import pg_engine
 
@@ -34,9 +34,9 @@ def main(batch_tx_hash: str) -> int:
     # pylint:disable=line-too-long
     # Ref: https://github.com/cowprotocol/services/blob/fd5f7cf47a6afdff89b310b60b869dfc577ac7a7/crates/shared/src/price_estimation/gas.rs#L37
     df_quotes["gas_amount"] = df_quotes["gas_amount"].apply(lambda x: x - 106391)
-    load_dotenv()
-    w3 = Web3(Web3.HTTPProvider(ETH_RPC))
-    tx: TxReceipt = w3.eth.get_transaction_receipt(HexStr(batch_tx_hash))
+    tx: TxReceipt = web3_client(ETH_RPC).eth.get_transaction_receipt(
+        HexStr(batch_tx_hash)
+    )
     gas_used = tx["gasUsed"]
     print(
         f"Trades executed individually would have cost {df_quotes['gas_amount'].sum():.0f} gas."
@@ -52,6 +52,7 @@ def main(batch_tx_hash: str) -> int:
 
 
 if __name__ == "__main__":
+    load_dotenv()
     # TODO - figure out how to get this linted with the click decorator!
     # pylint:disable=no-value-for-parameter
     main()
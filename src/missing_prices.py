@@ -1,38 +1,64 @@
 from __future__ import annotations
 
+import argparse
 import os
+import time
 from dataclasses import dataclass
-from typing import Any
+from datetime import timedelta
+from typing import Any, Mapping, Optional
 
-import requests
 from dotenv import load_dotenv
-from dune_client.client import DuneClient
 from dune_client.query import QueryBase as Query
-from dune_client.types import Address
 from marshmallow import fields
 
-from src.utils import TokenSchema, CoinSchema, CoinsSchema, Token, EthereumAddress, Coin
+from src.address import Address
+from src.address_index import AddressIndex
+from src.clients import dune_executor, rate_limiter
+from src.constants import PROJECT_ROOT
+from src.dune_cache import ResultCache, fetch_query_results, frame_records
+from src.dune_executor import DuneExecutor
+from src.snapshot import SnapshotStore
+from src.utils import (
+    TokenSchema,
+    CoinSchema,
+    CoinsSchema,
+    Token,
+    EthereumAddress,
+    Coin,
+    LazyCoins,
+)
 
 DuneTokenPriceRow = tuple[str, str, str, Address, int]
+COIN_INDEX_PATH = str(PROJECT_ROOT / "out" / "coin-paprika.idx")
 
 
-def load_coins() -> dict[Address, Coin]:
+def coin_paprika_snapshots(
+    max_age: timedelta = timedelta(hours=24), offline: bool = False
+) -> SnapshotStore:
+    """SnapshotStore of Coin Paprika responses (sharing its rate limit)"""
+    return SnapshotStore(
+        max_age=max_age, offline=offline, limiter=rate_limiter("coinpaprika")
+    )
+
+
+def fetch_coin_entries(
+    snapshots: Optional[SnapshotStore] = None,
+) -> dict[str, dict[str, Any]]:
     """
-    Loads and returns coin dictionaries from Coin Paprika via their API.
+    Fetches raw coin entries from Coin Paprika via their API, keyed by address.
     Excludes, inactive, new and non "token" types
     """
-    entries = requests.get(
-        url="https://api.coinpaprika.com/v1/contracts/eth-ethereum", timeout=10
-    ).json()
+    snapshots = snapshots or coin_paprika_snapshots()
+    entries = snapshots.get_json(
+        "https://api.coinpaprika.com/v1/contracts/eth-ethereum", timeout=10
+    )
     contract_dict = {}
     for entry in entries:
         if entry["type"] == "ERC20" and entry["active"]:
             # only include ethereum tokens
             contract_dict[entry["id"]] = entry["address"]
 
-    entries = requests.get(
-        url="https://api.coinpaprika.com/v1/coins", timeout=10
-    ).json()
+    entries = snapshots.get_json("https://api.coinpaprika.com/v1/coins", timeout=10)
     coin_dict = {}
     missed = 0
     for entry in entries:
@@ -40,18 +66,42 @@ def load_coins() -> dict[Address, Coin]:
             # only include ethereum tokens
             try:
                 entry["address"] = contract_dict[entry["id"]].lower()
-                try:
-                    # coin_dict[Address(entry["address"])] = entry
-                    coin_dict[entry["address"]] = entry
-                except ValueError:
-                    print(f"{entry['address']} is not a valid ethereum address")
-                    continue
+                coin_dict[entry["address"]] = entry
             except KeyError:
                 missed += 1
 
     print(f"Excluded address for {missed} entries out of {len(entries)}")
+    return coin_dict
+
+
+def load_coins(
+    snapshots: Optional[SnapshotStore] = None, index_path: Optional[str] = None
+) -> Mapping[Address, Coin]:
+    """
+    Loads and returns coins from Coin Paprika via their API.
+    Coins are validated lazily, i.e. only when they are looked up.
+    With `index_path` the coins are served from a memory-mapped AddressIndex,
+    which is only rebuilt once it is older than the snapshots' max age.
+    """
+    if index_path is None:
+        return LazyCoins(fetch_coin_entries(snapshots))
+
+    snapshots = snapshots or coin_paprika_snapshots()
+    if not os.path.exists(index_path) or (
+        not snapshots.offline
+        and time.time() - os.path.getmtime(index_path)
+        > snapshots.max_age.total_seconds()
+    ):
+        AddressIndex.build(index_path, fetch_coin_entries(snapshots))
+    return LazyCoins(AddressIndex(index_path))
+
+
+def load_coins_eagerly(
+    snapshots: Optional[SnapshotStore] = None,
+) -> dict[Address, Coin]:
+    """Same as load_coins, but deserializes all coins upfront"""
     return CoinsSchema(keys=EthereumAddress, values=fields.Nested(CoinSchema)).load(
-        coin_dict
+        fetch_coin_entries(snapshots)
     )
 
 
@@ -65,7 +115,7 @@ def write_results(results: list[DuneTokenPriceRow], path: str, filename: str) ->
         print(f"Results written to {filename}")
 
 
-@dataclass
+@dataclass(slots=True)
 class CoinPaprikaToken:
     """Representation of a Coin Paprika Token"""
 
@@ -105,24 +155,34 @@ class CoinPaprikaToken:
         }
 
 
-def load_tokens(dune: DuneClient) -> list[Token]:
-    """Loads Tokens with missing prices from Dune"""
-    results = dune.refresh(Query(query_id=2359395, name="Tokens with Missing Prices"))
-    return [TokenSchema().load(r) for r in results.get_rows()]
+def load_tokens(
+    executor: DuneExecutor, cache: Optional[ResultCache] = None
+) -> list[Token]:
+    """
+    Loads Tokens with missing prices from Dune
+    (reusing results from `cache` or Dune's latest execution when fresh enough)
+    """
+    results = fetch_query_results(
+        executor, Query(query_id=2359395, name="Tokens with Missing Prices"), cache
+    )
+    return [TokenSchema().load(r) for r in frame_records(results)]
 
 
-def run_missing_prices() -> None:
+def run_missing_prices(
+    snapshots: Optional[SnapshotStore] = None,
+    dune_cache: Optional[ResultCache] = None,
+) -> None:
     """Script's Main Entry Point"""
     print("Getting Coin Paprika token list")
-    coins = load_coins()
+    coins = load_coins(snapshots, index_path=COIN_INDEX_PATH)
     print(f"Loaded {len(coins)} coins from Coin Paprika")
 
-    tokens = load_tokens(DuneClient(api_key=os.environ["DUNE_API_KEY"]))
+    tokens = load_tokens(dune_executor(), dune_cache)
     print(f"Fetched {len(tokens)} traded tokens from Dune without prices")
     found, res = 0, []
     for token in tokens:
-        if token.address in coins:
-            paprika_data = coins[token.address]
+        paprika_data = coins.get(token.address)
+        if paprika_data is not None:
             dune_row = (
                 paprika_data.id,
                 "ethereum",
@@ -138,4 +198,30 @@ def run_missing_prices() -> None:
 
 if __name__ == "__main__":
     load_dotenv()
-    run_missing_prices()
+    parser = argparse.ArgumentParser("Missing Prices")
+    parser.add_argument(
+        "--max-age",
+        type=float,
+        default=24,
+        help="Hours after which Coin Paprika snapshots are revalidated",
+    )
+    parser.add_argument(
+        "--offline",
+        action="store_true",
+        help="Use the last Coin Paprika snapshots without any requests",
+    )
+    parser.add_argument(
+        "--dune-max-age",
+        type=float,
+        help="Reuse Dune results (cached in out/dune-cache, or Dune's latest "
+        "execution) from within this many hours",
+    )
+    args = parser.parse_args()
+    run_missing_prices(
+        coin_paprika_snapshots(timedelta(hours=args.max_age), args.offline),
+        (
+            None
+            if args.dune_max_age is None
+            else ResultCache(max_age=timedelta(hours=args.dune_max_age))
+        ),
+    )
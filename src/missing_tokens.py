@@ -1,18 +1,31 @@
+import argparse
+import csv
 import fileinput
 import os
-
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
+from datetime import timedelta
 from typing import Optional
 
 import web3.exceptions
 from dotenv import load_dotenv
 from dune_client.client import DuneClient
 from dune_client.query import QueryBase as DuneQuery
-from dune_client.types import QueryParameter, Address
-
-from web3 import Web3
+from dune_client.types import QueryParameter
+from eth_abi import decode
+from eth_abi.exceptions import DecodingError
+from sqlalchemy import Engine, text
 
+from src.address import Address
+from src.clients import dune_client, dune_executor
 from src.constants import ETH_RPC, GNOSIS_RPC
+from src.db.pg_client import pg_engine
+from src.dune_cache import NEVER_STALE_HOURS, ResultCache, fetch_query_results
+from src.dune_executor import DuneExecutor
+from src.dune_results import execution_frame
+from src.multicall import Call, CallResult, encode_call, multicall
+from src.spellbook import insert_token_rows, load_spellbook_tokens, token_file
+from src.token_cache import CachedToken, TokenCache
 
 
 class Network(Enum):
@@ -23,6 +36,9 @@ class Network(Enum):
     MAINNET = "mainnet"
     GNOSIS = "gnosis"
 
+    def __str__(self) -> str:
+        return str(self.value)
+
     def as_dune_v2_repr(self) -> str:
         """Returns Dune V1 Network String (as compatible with Dune V2 Engine)"""
         return {Network.MAINNET: "ethereum", Network.GNOSIS: "gnosis"}[self]
@@ -43,42 +59,30 @@ class Network(Enum):
         return {Network.MAINNET: 1, Network.GNOSIS: 100}[self]
 
 
-ERC20_ABI = [
-    {
-        "constant": True,
-        "inputs": [],
-        "name": "decimals",
-        "outputs": [{"name": "", "type": "uint8"}],
-        "payable": False,
-        "stateMutability": "view",
-        "type": "function",
-    },
-    {
-        "constant": True,
-        "inputs": [],
-        "name": "symbol",
-        "outputs": [{"name": "", "type": "string"}],
-        "payable": False,
-        "stateMutability": "view",
-        "type": "function",
-    },
-]
+# Only tokens traded since DATE_FROM at least POPULARITY times are considered
+DATE_FROM = "2023-01-01 00:00:00"
+POPULARITY = 250
+
+ETH_SENTINEL = "0xEeeeeEeeeEeEeeEeEeEeeEEEeeeeEeeeeeeeEEeE"
+ETH_ADDRESS = Address(ETH_SENTINEL)
+SYMBOL_CALL = encode_call("symbol()")
+DECIMALS_CALL = encode_call("decimals()")
+# Failures which are remembered (negative cache entries) by the TokenCache
+CACHEABLE_ERRORS: dict[str, type[web3.exceptions.Web3Exception]] = {
+    "BadFunctionCallOutput": web3.exceptions.BadFunctionCallOutput,
+    "ContractLogicError": web3.exceptions.ContractLogicError,
+}
 
 
 class TokenDetails:  # pylint:disable=too-few-public-methods
     """EVM token Details (including address, symbol, decimals)"""
 
-    def __init__(self, address: Address, w3: Web3):
-        self.address = Web3.to_checksum_address(address.address)
-        if self.address == Web3.to_checksum_address(
-            "0xEeeeeEeeeEeEeeEeEeEeeEEEeeeeEeeeeeeeEEeE"
-        ):
-            self.symbol = "ETH"
-            self.decimals = 18
-        else:
-            token_contract = w3.eth.contract(address=self.address, abi=ERC20_ABI)
-            self.symbol = token_contract.caller.symbol()
-            self.decimals = token_contract.caller.decimals()
+    __slots__ = ("address", "symbol", "decimals")
+
+    def __init__(self, address: Address, symbol: str, decimals: int):
+        self.address = address.checksum
+        self.symbol = symbol
+        self.decimals = decimals
 
     def as_dune_string(self) -> str:
         """
@@ -90,21 +94,112 @@ class TokenDetails:  # pylint:disable=too-few-public-methods
         return f", ({str(self.address).lower()}, '{self.symbol}', {self.decimals})"
 
 
-def fetch_missing_tokens(dune: DuneClient, network: Network) -> list[Address]:
-    """Uses Official DuneAPI and to fetch Missing Tokens"""
-    query = DuneQuery(
+def _decode_token_details(
+    token: Address, symbol: CallResult, decimals: CallResult
+) -> TokenDetails:
+    """
+    Builds TokenDetails from the raw symbol() and decimals() return data.
+    Raises the same web3 exceptions a direct contract call would have raised.
+    """
+    if not (symbol.success and decimals.success):
+        raise web3.exceptions.ContractLogicError(f"execution reverted on {token}")
+    try:
+        (symbol_str,) = decode(["string"], symbol.data)
+        (decimals_int,) = decode(["uint8"], decimals.data)
+    except (DecodingError, UnicodeDecodeError) as err:
+        raise web3.exceptions.BadFunctionCallOutput(
+            f"Could not decode contract function call to {token}"
+        ) from err
+    return TokenDetails(address=token, symbol=symbol_str, decimals=decimals_int)
+
+
+def resolve_token_details(
+    tokens: list[Address], node_url: str, cache: Optional[TokenCache] = None
+) -> tuple[dict[Address, TokenDetails], dict[Address, web3.exceptions.Web3Exception]]:
+    """
+    Fetches symbol and decimals for all `tokens` in a handful of batched eth_calls.
+    Tokens with an unexpired (positive or negative) entry in `cache` are not fetched.
+    Returns the resolved TokenDetails along with the per-token failures.
+    Only reverts and undecodable return data are failures (and cached as such):
+    RPC and transport errors (RpcError, requests exceptions) are raised, leaving
+    the cache untouched.
+    """
+    token_details: dict[Address, TokenDetails] = {}
+    failures: dict[Address, web3.exceptions.Web3Exception] = {}
+    cached = cache.lookup(tokens) if cache else {}
+    contracts = []
+    for token in tokens:
+        if token is ETH_ADDRESS:
+            token_details[token] = TokenDetails(
+                address=token, symbol="ETH", decimals=18
+            )
+        elif token in cached:
+            entry = cached[token]
+            if entry.error:
+                failures[token] = CACHEABLE_ERRORS[entry.error](
+                    f"{entry.error} on {token} (cached)"
+                )
+            else:
+                assert entry.symbol is not None and entry.decimals is not None
+                token_details[token] = TokenDetails(
+                    address=token, symbol=entry.symbol, decimals=entry.decimals
+                )
+        else:
+            contracts.append(token)
+
+    calls = []
+    for token in contracts:
+        calls.append(Call(token.address, SYMBOL_CALL))
+        calls.append(Call(token.address, DECIMALS_CALL))
+    results = multicall(node_url, calls)
+    fetched: dict[Address, CachedToken] = {}
+    for i, token in enumerate(contracts):
+        try:
+            details = _decode_token_details(
+                token, symbol=results[2 * i], decimals=results[2 * i + 1]
+            )
+            token_details[token] = details
+            fetched[token] = CachedToken(details.symbol, details.decimals)
+        except tuple(CACHEABLE_ERRORS.values()) as err:
+            failures[token] = err
+            fetched[token] = CachedToken(None, None, error=type(err).__name__)
+    if cache:
+        cache.store(fetched)
+    return token_details, failures
+
+
+def missing_tokens_query(network: Network) -> DuneQuery:
+    """Parameterized Dune query returning the missing tokens on `network`"""
+    return DuneQuery(
         name="V3: Missing Tokens on {{Blockchain}}",
         query_id=3645484,
         params=[
             QueryParameter.enum_type("Blockchain", network.as_dune_v2_repr()),
-            QueryParameter.date_type("DateFrom", "2023-01-01 00:00:00"),
-            QueryParameter.number_type("Popularity", 250),
+            QueryParameter.date_type("DateFrom", DATE_FROM),
+            QueryParameter.number_type("Popularity", POPULARITY),
         ],
     )
+
+
+def fetch_missing_tokens(
+    executor: DuneExecutor, network: Network, cache: Optional[ResultCache] = None
+) -> list[Address]:
+    """
+    Uses Official DuneAPI and to fetch Missing Tokens
+    (reusing results from `cache` or Dune's latest execution when fresh enough)
+    """
+    query = missing_tokens_query(network)
     print(f"Fetching missing tokens for {network} from {query.url()}")
-    v2_missing = dune.run_query(query, ping_frequency=10)
+    v2_missing = fetch_query_results(executor, query, cache)
+
+    return [Address(token) for token in v2_missing["token"]]
 
-    return [Address(row["token"]) for row in v2_missing.get_rows()]
+
+def await_missing_tokens(executor: DuneExecutor, job_id: str) -> list[Address]:
+    """Waits for the (already submitted) missing tokens execution `job_id`"""
+    status = executor.await_execution(job_id)
+    results = execution_frame(executor.dune, job_id, status.result_metadata)
+    return [Address(token) for token in results["token"]]
 
 
 def replace_line(old_line: str, new_line: str, file_loc: str) -> None:
@@ -116,55 +211,249 @@ def replace_line(old_line: str, new_line: str, file_loc: str) -> None:
             print(line.rstrip("\n"))
 
 
-def run_missing_tokens(chain: Network, insert_loc: Optional[str] = None) -> None:
+def resolve_missing_tokens(
+    chain: Network, missing_tokens: list[Address]
+) -> list[TokenDetails]:
+    """Fetches details of `missing_tokens`, skipping (and reporting) failures."""
+    print(f"Found {len(missing_tokens)} missing tokens on {chain}. Fetching details...")
+    with TokenCache(chain.chain_id) as cache:
+        token_details, failures = resolve_token_details(
+            missing_tokens, chain.node_url(), cache
+        )
+    for token, err in failures.items():
+        print(f"{type(err).__name__} on {token} - skipping.")
+    return [token_details[t] for t in missing_tokens if t not in failures]
+
+
+def write_missing_tokens(
+    token_details: list[TokenDetails], insert_loc: Optional[str] = None
+) -> None:
+    """Inserts tokens into the spellbook file at insert_loc (or prints them)"""
+    rows = [t.as_dune_string() for t in token_details]
+    if insert_loc:
+        print(f"Writing Tokens to File {insert_loc}")
+        report = insert_token_rows(insert_loc, rows)
+        print(
+            f"Inserted {report.inserted} tokens, "
+            f"skipped {report.duplicates} already listed."
+        )
+    else:
+        results = "\n    ".join(rows)
+        print(f"Missing Tokens:\n\n{results}\n")
+
+
+def run_missing_tokens(
+    chain: Network,
+    insert_loc: Optional[str] = None,
+    cache: Optional[ResultCache] = None,
+) -> None:
     """Script's main entry point, runs for given network."""
-    w3 = Web3(Web3.HTTPProvider(chain.node_url()))
-    client = DuneClient(os.environ["DUNE_API_KEY"])
-    missing_tokens = fetch_missing_tokens(client, chain)
+    missing_tokens = fetch_missing_tokens(dune_executor(), chain, cache)
 
     if missing_tokens:
-        print(f"Found {len(missing_tokens)} missing tokens. Fetching details...\n")
-        token_details: dict[Address, TokenDetails] = {}
-        ignored = set()
-        for token in missing_tokens:
-            try:
-                # TODO batch the eth_calls used to construct the token contracts.
-                token_details[token] = TokenDetails(address=token, w3=w3)
-            except web3.exceptions.BadFunctionCallOutput:
-                ignored.add(token)
-                print(f"BadFunctionCallOutput on {token} - skipping.")
-            except web3.exceptions.ContractLogicError:
-                ignored.add(token)
-                print(f"ContractLogicError on {token} - skipping.")
-
-        results = "\n    ".join(
-            token_details[t].as_dune_string()
-            for t in missing_tokens
-            if t not in ignored
-        )
-        if insert_loc:
-            print(f"Writing Tokens to File {insert_loc}")
-            old_line = ") AS temp_table (contract_address, symbol, decimals)\n"
-            new_line = "    " + results + "\n" + old_line
-            replace_line(old_line, new_line, insert_loc)
+        write_missing_tokens(resolve_missing_tokens(chain, missing_tokens), insert_loc)
+    else:
+        print(f"No missing tokens detected on {chain}. Have a good day!")
+
+
+def run_missing_tokens_concurrently(insert_locs: dict[Network, Optional[str]]) -> None:
+    """
+    Runs for all networks in `insert_locs` at once: the Dune executions are all
+    submitted up front and each chain's tokens are resolved in its own thread.
+    Files are written sequentially (in the order of `insert_locs`) at the end.
+    """
+    executor = dune_executor()
+    jobs = {}
+    for chain in insert_locs:
+        query = missing_tokens_query(chain)
+        print(f"Fetching missing tokens for {chain} from {query.url()}")
+        jobs[chain] = executor.submit(query)
+
+    def process(chain: Network) -> list[TokenDetails]:
+        missing_tokens = await_missing_tokens(executor, jobs[chain])
+        if not missing_tokens:
+            return []
+        return resolve_missing_tokens(chain, missing_tokens)
+
+    with ThreadPoolExecutor(max_workers=len(jobs)) as pool:
+        resolved = dict(zip(jobs, pool.map(process, jobs)))
+
+    for chain, token_details in resolved.items():
+        if token_details:
+            print(f"Execute on {chain.as_dune_v2_repr()}")
+            write_missing_tokens(token_details, insert_locs[chain])
         else:
-            print(f"Missing Tokens:\n\n{results}\n")
+            print(f"No missing tokens detected on {chain}. Have a good day!")
+
+
+def traded_tokens_from_csv(csv_path: str, network: Network) -> list[Address]:
+    """
+    Reads traded tokens from the `token` column of a CSV file.
+    If the file has a `blockchain` column only rows for `network` are used.
+    """
+    with open(csv_path, "r", encoding="utf-8") as file:
+        return [
+            Address(row["token"])
+            for row in csv.DictReader(file)
+            if row.get("blockchain", network.as_dune_v2_repr())
+            == network.as_dune_v2_repr()
+        ]
+
+
+def traded_tokens_from_dune(
+    dune: DuneClient, query_id: int, network: Network
+) -> list[Address]:
+    """
+    Reads traded tokens from the latest existing result of a saved Dune query
+    (without triggering a new execution). Rows are filtered as for CSV files.
+    """
+    return [
+        Address(row["token"])
+        for row in dune.get_latest_result(
+            query_id, max_age_hours=NEVER_STALE_HOURS
+        ).get_rows()
+        if row.get("blockchain", network.as_dune_v2_repr()) == network.as_dune_v2_repr()
+    ]
+
+
+def traded_tokens_from_orderbook(engine: Engine, popularity: int) -> list[Address]:
+    """
+    Reads all tokens with at least `popularity` trades since DATE_FROM from the
+    orderbook database behind `engine` (which determines the network).
+    """
+    query = text("""
+        SELECT concat('0x', encode(token, 'hex')) AS token
+        FROM (
+            SELECT sell_token AS token FROM orders JOIN trades ON uid = order_uid
+            WHERE creation_timestamp >= :date_from
+            UNION ALL
+            SELECT buy_token AS token FROM orders JOIN trades ON uid = order_uid
+            WHERE creation_timestamp >= :date_from
+        ) AS traded
+        GROUP BY token
+        HAVING count(*) >= :popularity
+        ORDER BY count(*) DESC
+        """)
+    with engine.connect() as conn:
+        rows = conn.execute(query, {"date_from": DATE_FROM, "popularity": popularity})
+        return [Address(row.token) for row in rows]
+
+
+def run_missing_tokens_locally(
+    chain: Network,
+    traded_tokens: list[Address],
+    spellbook_path: str,
+    insert_loc: Optional[str] = None,
+) -> None:
+    """
+    Alternative to run_missing_tokens which diffs `traded_tokens` against the local
+    spellbook checkout instead of executing the missing tokens query on Dune.
+    """
+    known = load_spellbook_tokens(spellbook_path, chain.as_dune_v2_repr())
+    print(f"Loaded {len(known)} {chain} tokens from spellbook")
+    missing_tokens = [t for t in dict.fromkeys(traded_tokens) if t.address not in known]
+
+    if missing_tokens:
+        write_missing_tokens(resolve_missing_tokens(chain, missing_tokens), insert_loc)
     else:
         print(f"No missing tokens detected on {chain}. Have a good day!")
 
 
+def load_traded_tokens(args: argparse.Namespace, chain: Network) -> list[Address]:
+    """Loads traded tokens for local mode from the source given in `args`"""
+    if args.traded_tokens_csv:
+        return traded_tokens_from_csv(args.traded_tokens_csv, chain)
+    if args.traded_tokens_query:
+        return traded_tokens_from_dune(dune_client(), args.traded_tokens_query, chain)
+    return traded_tokens_from_orderbook(pg_engine(), POPULARITY)
+
+
 if __name__ == "__main__":
     load_dotenv()
-    spellbook_path = os.environ.get("SPELLBOOK_PATH")
-    for blockchain in list(Network):
-        chain_name = blockchain.as_dune_v2_repr()
-        print(f"Execute on {chain_name}")
-        token_file = f"tokens/models/tokens/{chain_name}/tokens_{chain_name}_erc20.sql"
-        spellbook_file = (
-            os.path.join(spellbook_path, token_file) if spellbook_path else None
-        )
-
-        run_missing_tokens(
-            chain=blockchain,
-            insert_loc=spellbook_file,
+    parser = argparse.ArgumentParser("Missing Tokens")
+    parser.add_argument(
+        "--concurrent",
+        action="store_true",
+        help="Run all networks at once instead of one after the other",
+    )
+    parser.add_argument(
+        "--chain",
+        type=Network,
+        choices=list(Network),
+        action="append",
+        help="Network(s) to run on (defaults to all)",
+    )
+    local = parser.add_argument_group(
+        "local mode",
+        "Diff traded tokens against the spellbook checkout at SPELLBOOK_PATH "
+        "instead of executing the missing tokens query on Dune",
+    )
+    source = local.add_mutually_exclusive_group()
+    source.add_argument(
+        "--traded-tokens-csv", help="CSV file with a `token` column (and `blockchain`)"
+    )
+    source.add_argument(
+        "--traded-tokens-query",
+        type=int,
+        help="Saved Dune query whose latest result has a `token` column",
+    )
+    source.add_argument(
+        "--orderbook",
+        action="store_true",
+        help="Orderbook DB given by the ORDERBOOK_* variables (use with --chain)",
+    )
+    parser.add_argument(
+        "--max-age",
+        type=float,
+        help="Reuse missing tokens results (cached in out/dune-cache, or Dune's "
+        "latest execution) from within this many hours",
+    )
+    cli_args = parser.parse_args()
+    local_mode = bool(
+        cli_args.traded_tokens_csv or cli_args.traded_tokens_query or cli_args.orderbook
+    )
+    if cli_args.max_age is not None and cli_args.concurrent:
+        parser.error("--max-age is not supported with --concurrent")
+    if local_mode and cli_args.concurrent:
+        parser.error("--concurrent is not supported in local mode")
+    if local_mode and cli_args.max_age is not None:
+        parser.error("--max-age is not supported in local mode")
+    if cli_args.orderbook and len(cli_args.chain or []) != 1:
+        # The orderbook DB (given by the environment) only covers a single network
+        parser.error("--orderbook requires exactly one --chain")
+    result_cache = (
+        None
+        if cli_args.max_age is None
+        else ResultCache(max_age=timedelta(hours=cli_args.max_age))
+    )
+    spellbook_root = os.environ.get("SPELLBOOK_PATH")
+    chains = cli_args.chain or list(Network)
+    spellbook_files = {
+        chain: (
+            token_file(spellbook_root, chain.as_dune_v2_repr())
+            if spellbook_root
+            else None
         )
+        for chain in chains
+    }
+    if local_mode:
+        if not spellbook_root:
+            parser.error("local mode requires SPELLBOOK_PATH")
+        for blockchain in chains:
+            print(f"Execute on {blockchain.as_dune_v2_repr()}")
+            run_missing_tokens_locally(
+                chain=blockchain,
+                traded_tokens=load_traded_tokens(cli_args, blockchain),
+                spellbook_path=spellbook_root,
+                insert_loc=spellbook_files[blockchain],
+            )
+    elif cli_args.concurrent:
+        run_missing_tokens_concurrently(spellbook_files)
+    else:
+        for blockchain in chains:
+            print(f"Execute on {blockchain.as_dune_v2_repr()}")
+            run_missing_tokens(
+                chain=blockchain,
+                insert_loc=spellbook_files[blockchain],
+                cache=result_cache,
+            )
@@ -0,0 +1,193 @@
+"""
+Batched read-only contract calls.
+
+Calls are aggregated through the Multicall3 contract (deployed at the same address
+on every chain we support) via `tryAggregate`, so that a revert in one call does not
+fail the others. Whenever Multicall3 is unavailable on a node we fall back to a
+JSON-RPC batch of plain `eth_call`s, which still costs a single HTTP round trip.
+Requests to the same node host share the "rpc" rate limit.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Any, Optional
+from urllib.parse import urlparse
+
+import requests
+from eth_abi import decode, encode
+from eth_abi.exceptions import DecodingError
+from eth_utils import function_signature_to_4byte_selector
+
+from src.clients import http_session, rate_limiter
+from src.utils import partition_array
+
+# https://github.com/mds1/multicall#deployments
+MULTICALL3_ADDRESS = "0xcA11bde05977b3631167028862bE2a173976CA11"
+TRY_AGGREGATE_SELECTOR = function_signature_to_4byte_selector(
+    "tryAggregate(bool,(address,bytes)[])"
+)
+# Number of calls packed into one Multicall3 eth_call (keeps us below node gas caps)
+MULTICALL_BATCH_SIZE = 500
+# Number of eth_calls packed into one JSON-RPC batch (most providers cap at 100-1000)
+RPC_BATCH_SIZE = 100
+RPC_TIMEOUT = 30
+
+
+class MulticallUnavailable(Exception):
+    """Raised when the node can not (or will not) execute a Multicall3 aggregate"""
+
+
+class RpcError(Exception):
+    """Raised on JSON-RPC errors other than reverts (e.g. rate limits, timeouts)"""
+
+
+def _is_revert(error: Any) -> bool:
+    """Whether the JSON-RPC `error` reports a reverted call (rather than a failure)"""
+    if not isinstance(error, dict):
+        return False
+    message = str(error.get("message", "")).lower()
+    return error.get("code") == 3 or "revert" in message
+
+
+@dataclass(frozen=True)
+class Call:
+    """A single read-only contract call (target is a lower case or checksum address)"""
+
+    target: str
+    data: bytes
+
+
+@dataclass(frozen=True)
+class CallResult:
+    """Outcome of a single Call: success is False when the call reverted"""
+
+    success: bool
+    data: bytes
+
+
+def encode_call(signature: str, args: Optional[list[Any]] = None) -> bytes:
+    """
+    ABI encodes a function call from its signature, e.g.
+    >>> encode_call("decimals()").hex()
+    '313ce567'
+    """
+    selector = function_signature_to_4byte_selector(signature)
+    arg_types = signature[signature.index("(") + 1 : -1]
+    if not arg_types:
+        return selector
+    return selector + encode(arg_types.split(","), args or [])
+
+
+def _post(
+    node_url: str, payload: Any, session: Optional[requests.Session] = None
+) -> Any:
+    session = session or http_session(node_url)
+    rate_limiter("rpc", urlparse(node_url).netloc).acquire()
+    response = session.post(node_url, json=payload, timeout=RPC_TIMEOUT)
+    response.raise_for_status()
+    return response.json()
+
+
+def _eth_call_request(call: Call, request_id: int) -> dict[str, Any]:
+    return {
+        "jsonrpc": "2.0",
+        "id": request_id,
+        "method": "eth_call",
+        "params": [
+            {"to": call.target, "data": "0x" + call.data.hex()},
+            "latest",
+        ],
+    }
+
+
+def try_aggregate(
+    node_url: str,
+    calls: list[Call],
+    batch_size: int = MULTICALL_BATCH_SIZE,
+    session: Optional[requests.Session] = None,
+) -> list[CallResult]:
+    """
+    Executes `calls` via Multicall3.tryAggregate, `batch_size` calls per eth_call.
+    Raises MulticallUnavailable if the aggregate itself could not be executed,
+    and RpcError if the node failed to answer.
+    """
+    results: list[CallResult] = []
+    for chunk in partition_array(calls, batch_size):
+        data = TRY_AGGREGATE_SELECTOR + encode(
+            ["bool", "(address,bytes)[]"],
+            [False, [(c.target, c.data) for c in chunk]],
+        )
+        response = _post(
+            node_url,
+            _eth_call_request(Call(MULTICALL3_ADDRESS, data), request_id=1),
+            session,
+        )
+        if "error" in response:
+            if _is_revert(response["error"]):
+                raise MulticallUnavailable(response["error"])
+            raise RpcError(f"{node_url}: {response['error']}")
+        try:
+            (decoded,) = decode(
+                ["(bool,bytes)[]"], bytes.fromhex(response["result"][2:])
+            )
+        except DecodingError as err:
+            # Empty return data: Multicall3 is not deployed on this chain.
+            raise MulticallUnavailable(response["result"]) from err
+        if len(decoded) != len(chunk):
+            raise MulticallUnavailable(f"expected {len(chunk)} results")
+        results.extend(CallResult(success, data) for success, data in decoded)
+    return results
+
+
+def batch_eth_call(
+    node_url: str,
+    calls: list[Call],
+    batch_size: int = RPC_BATCH_SIZE,
+    session: Optional[requests.Session] = None,
+) -> list[CallResult]:
+    """
+    Executes `calls` as JSON-RPC batches of plain eth_calls, `batch_size` per POST.
+    Reverted calls are unsuccessful results, any other error raises RpcError.
+    """
+    results: list[CallResult] = []
+    for chunk in partition_array(calls, batch_size):
+        response = _post(
+            node_url,
+            [_eth_call_request(call, i) for i, call in enumerate(chunk)],
+            session,
+        )
+        if not isinstance(response, list):
+            # e.g. a single error object for the whole batch
+            raise RpcError(f"{node_url}: unexpected batch response {response}")
+        # Batch responses may come back in any order.
+        by_id = {item.get("id"): item for item in response}
+        for i in range(len(chunk)):
+            item = by_id.get(i)
+            if item is None:
+                raise RpcError(f"{node_url}: no response to eth_call {i}")
+            if "result" in item:
+                results.append(CallResult(True, bytes.fromhex(item["result"][2:])))
+            elif _is_revert(item.get("error")):
+                results.append(CallResult(False, b""))
+            else:
+                raise RpcError(f"{node_url}: {item.get('error')}")
+    return results
+
+
+def multicall(
+    node_url: str,
+    calls: list[Call],
+    session: Optional[requests.Session] = None,
+) -> list[CallResult]:
+    """
+    Executes all `calls` in as few round trips as possible.
+    Results are returned in the same order as `calls`.
+    """
+    if not calls:
+        return []
+    try:
+        return try_aggregate(node_url, calls, session=session)
+    except MulticallUnavailable as err:
+        print(f"Multicall3 unavailable ({err}) - falling back to JSON-RPC batch.")
+        return batch_eth_call(node_url, calls, session=session)
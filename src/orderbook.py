@@ -1,9 +1,12 @@
 # type: ignore
+from __future__ import annotations
+
+import argparse
 import time
+from datetime import timedelta
+from typing import TYPE_CHECKING, Optional
 
 import pandas as pd
-from duneapi.api import DuneAPI
-from duneapi.types import DuneQuery, Network
 from pandas import DataFrame
 from sqlalchemy import (
     Table,
@@ -19,7 +22,12 @@ from sqlalchemy import (
 
 from sqlalchemy.engine import CursorResult
 
+from src.clients import legacy_dune_client
 from src.db.pg_client import pg_engine
+from src.dune_cache import ResultCache, fetch_legacy_results
+
+if TYPE_CHECKING:
+    from duneapi.api import DuneAPI
 
 # pylint:disable=missing-function-docstring
 pd.options.display.max_colwidth = None
@@ -147,7 +155,13 @@ def sql_alchemy_advanced(db: engine):
 
 
 @timeit
-def query_dune(dune: DuneAPI, raw_query: str) -> DataFrame:
+def query_dune(
+    dune: DuneAPI, raw_query: str, cache: Optional[ResultCache] = None
+) -> DataFrame:
+    # duneapi configures logging from ./logging.conf as soon as it is imported.
+    # pylint:disable=import-outside-toplevel
+    from duneapi.types import DuneQuery, Network
+
     query = DuneQuery.from_environment(
         raw_sql=raw_query,
         name="",
@@ -155,7 +169,7 @@ def query_dune(dune: DuneAPI, raw_query: str) -> DataFrame:
         parameters=[],
     )
     print("Querying Dune")
-    results = pd.DataFrame(dune.fetch(query))
+    results = fetch_legacy_results(dune, query, cache)
     print(f"Got {len(results)} results")
     return results
 
@@ -168,7 +182,7 @@ def query_orderbook(db: engine, raw_query: str) -> DataFrame:
     return results
 
 
-def order_fill_time(db: engine, dune: DuneAPI):
+def order_fill_time(db: engine, dune: DuneAPI, cache: Optional[ResultCache] = None):
     print("Pandas: Advanced")
     orderbook_query = """
     select encode(uid, 'hex') as uid, date_trunc('second', creation_timestamp) as creation_timestamp 
@@ -186,7 +200,7 @@ def order_fill_time(db: engine, dune: DuneAPI):
     select encode(order_uid, 'hex') as order_uid, block_time from gnosis_protocol_v2."trades"
     -- where block_time > now() - interval '3 months'
     """
-    settlement_df = query_dune(dune, dune_query)
+    settlement_df = query_dune(dune, dune_query, cache)
 
     joined_df = pd.merge(
         creation_df, settlement_df, how="inner", left_on="uid", right_on="order_uid"
@@ -208,10 +222,25 @@ def order_fill_time(db: engine, dune: DuneAPI):
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser("Orderbook")
+    parser.add_argument(
+        "--max-age",
+        type=float,
+        help="Reuse Dune results cached (in out/dune-cache) within this many hours",
+    )
+    cli_args = parser.parse_args()
     db_engine = pg_engine()
     # sql_alchemy_basic(db_engine)
     # pandas_query(db_engine)
     # sql_alchemy_advanced(db_engine)
 
-    dune_connection = DuneAPI.new_from_environment()
-    order_fill_time(db_engine, dune_connection)
+    dune_connection = legacy_dune_client()
+    order_fill_time(
+        db_engine,
+        dune_connection,
+        (
+            None
+            if cli_args.max_age is None
+            else ResultCache(max_age=timedelta(hours=cli_args.max_age))
+        ),
+    )
@@ -0,0 +1,114 @@
+"""
+Thread-safe token bucket for throttling requests to an upstream.
+
+Tokens are added at `rate` per second up to `capacity`. A caller that finds the
+bucket empty reserves its token anyway (driving the balance negative) and sleeps
+until that token would have been added, so concurrent callers queue up in order
+instead of spinning. Every bucket keeps track of the time its callers waited.
+
+Upstreams shared by several scripts have a named bucket each (see
+clients.rate_limiter), at the rate of DEFAULT_RATE_LIMITS unless overridden by
+the RATE_LIMIT_<NAME> environment variable (in requests per second).
+"""
+
+from __future__ import annotations
+
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable
+
+# Default (requests per second, burst) by upstream
+DEFAULT_RATE_LIMITS = {
+    "dune": (2.0, 5.0),
+    "rpc": (20.0, 20.0),
+    "subgraph": (10.0, 10.0),
+    "coinpaprika": (2.0, 5.0),
+}
+
+
+@dataclass
+class WaitStats:
+    """Totals over all acquisitions of a TokenBucket"""
+
+    acquisitions: int = 0
+    throttled: int = 0
+    seconds: float = 0.0
+    max_seconds: float = 0.0
+
+    def record(self, seconds: float) -> None:
+        """Records a single acquisition which waited `seconds`"""
+        self.acquisitions += 1
+        if seconds > 0:
+            self.throttled += 1
+        self.seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+
+    def __str__(self) -> str:
+        return (
+            f"{self.acquisitions} acquisitions ({self.throttled} throttled), "
+            f"waited {self.seconds:.2f}s in total, max {self.max_seconds:.2f}s"
+        )
+
+
+def configured_rate(name: str) -> tuple[float, float]:
+    """
+    Rate (per second) and capacity of the bucket of upstream `name`. A configured
+    rate also bounds the burst (to a second's worth of requests, at least one).
+    >>> configured_rate("dune")
+    (2.0, 5.0)
+    """
+    rate, capacity = DEFAULT_RATE_LIMITS[name]
+    configured = os.environ.get(f"RATE_LIMIT_{name.upper()}")
+    if not configured:
+        return rate, capacity
+    rate = float(configured)
+    return rate, max(1.0, min(capacity, rate))
+
+
+class TokenBucket:
+    """Allows `rate` acquisitions per second on average, in bursts of `capacity`"""
+
+    def __init__(
+        self,
+        rate: float,
+        capacity: float = 1.0,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        if rate <= 0:
+            raise ValueError(f"rate must be positive, got {rate}")
+        self.rate = rate
+        self.capacity = capacity
+        self._clock = clock
+        self._sleep = sleep
+        self._tokens = capacity
+        self._updated = clock()
+        self._lock = threading.Lock()
+        self._stats = WaitStats()
+
+    def _reserve(self, tokens: float) -> float:
+        """Takes `tokens` from the bucket and returns how long to wait for them"""
+        with self._lock:
+            now = self._clock()
+            elapsed = now - self._updated
+            self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+            self._updated = now
+            self._tokens -= tokens
+            wait = max(0.0, -self._tokens / self.rate)
+            self._stats.record(wait)
+            return wait
+
+    def acquire(self, tokens: float = 1.0) -> float:
+        """Blocks until `tokens` are available and returns the seconds waited"""
+        wait = self._reserve(tokens)
+        if wait > 0:
+            self._sleep(wait)
+        return wait
+
+    @property
+    def stats(self) -> WaitStats:
+        """Copy of the totals over all acquisitions so far"""
+        with self._lock:
+            return WaitStats(**vars(self._stats))
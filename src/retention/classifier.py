@@ -0,0 +1,130 @@
+"""
+Local retention classification (see queries/retention-on-date.sql).
+
+The daily trading activity of all traders (queries/retention-activity.sql) is held
+as integer arrays of (day, trader index) sorted by day. Classifying every trader on
+a date then only touches the activity within its window (found by binary search),
+so retention over hundreds of dates takes seconds instead of one Dune execution
+per date.
+"""
+
+from __future__ import annotations
+
+import datetime
+from typing import Iterable
+
+import numpy as np
+import pandas as pd
+
+# In the order of their codes returned by RetentionActivity.classify
+CATEGORIES = ("retained", "hybrid", "lost", "gone")
+# Code of traders which are not classified at all (no CoW trade before the window)
+UNCLASSIFIED = -1
+
+
+def epoch_day(day: datetime.datetime | datetime.date) -> int:
+    """
+    Number of days since 1970-01-01 of (the date of) `day`
+    >>> epoch_day(datetime.datetime(1970, 1, 2, 12))
+    1
+    """
+    return int(np.datetime64(day, "D").astype(np.int64))
+
+
+class RetentionActivity:
+    """Daily trading activity (on CoW and other dexes) of all CoW traders"""
+
+    def __init__(
+        self,
+        traders: np.ndarray,
+        first_day: np.ndarray,
+        cow: tuple[np.ndarray, np.ndarray],
+        other: tuple[np.ndarray, np.ndarray],
+    ):
+        """
+        `first_day[i]` is the day (since 1970) of the first CoW trade of `traders[i]`,
+        while `cow` and `other` are the (days, trader indices), sorted by day, of
+        every day (rounded up) a trader traded on CoW or other dexes.
+        """
+        self.traders = traders
+        self.first_day = first_day
+        self.cow = cow
+        self.other = other
+
+    @classmethod
+    def from_frame(cls, frame: pd.DataFrame) -> RetentionActivity:
+        """Builds from the (trader, source, day) rows of retention-activity.sql"""
+        codes, traders = pd.factorize(frame["trader"].str.lower())
+        dates = pd.to_datetime(frame["day"]).to_numpy().astype("datetime64[D]")
+        days = dates.astype(np.int64)
+        source = frame["source"].to_numpy()
+
+        def by_day(mask: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+            order = np.argsort(days[mask], kind="stable")
+            return days[mask][order], codes[mask][order]
+
+        first_day = np.full(len(traders), np.iinfo(np.int64).max, dtype=np.int64)
+        is_first = source == "first"
+        np.minimum.at(first_day, codes[is_first], days[is_first])
+        return cls(
+            traders=np.asarray(traders, dtype=object),
+            first_day=first_day,
+            cow=by_day(source == "cow"),
+            other=by_day(source == "other"),
+        )
+
+    @classmethod
+    def from_records(cls, records: Iterable[dict[str, str]]) -> RetentionActivity:
+        """Builds from the (trader, source, day) records of retention-activity.sql"""
+        return cls.from_frame(
+            pd.DataFrame.from_records(records, columns=["trader", "source", "day"])
+        )
+
+    def _traded(
+        self, activity: tuple[np.ndarray, np.ndarray], start: int, end: int
+    ) -> np.ndarray:
+        """Whether each trader has `activity` on a day in (start, end]"""
+        days, traders = activity
+        first, last = np.searchsorted(days, [start, end], side="right")
+        traded = np.zeros(len(self.traders), dtype=bool)
+        traded[traders[first:last]] = True
+        return traded
+
+    def classify(self, day: datetime.datetime, num_days: int = 30) -> np.ndarray:
+        """
+        Retention category code (index into CATEGORIES) of every trader on `day`
+        over the last `num_days`, UNCLASSIFIED for traders without a CoW trade
+        before the window.
+        """
+        end = epoch_day(day)
+        start = end - num_days
+        cow_recent = self._traded(self.cow, start, end)
+        other_recent = self._traded(self.other, start, end)
+        codes = np.select(
+            [
+                cow_recent & ~other_recent,
+                cow_recent & other_recent,
+                ~cow_recent & other_recent,
+            ],
+            [0, 1, 2],
+            default=3,
+        ).astype(np.int8)
+        codes[self.first_day >= start] = UNCLASSIFIED
+        return codes
+
+    def wallets(
+        self, day: datetime.datetime, category: str, num_days: int = 30
+    ) -> set[str]:
+        """(Lower case) wallets of the `category` traders on `day`"""
+        codes = self.classify(day, num_days)
+        return set(self.traders[codes == CATEGORIES.index(category)])
+
+    def retention_curves(
+        self, days: list[datetime.datetime], num_days: int = 30
+    ) -> pd.DataFrame:
+        """Number of traders per category (columns) on each of `days` (index)"""
+        counts = [
+            np.bincount(codes[codes != UNCLASSIFIED], minlength=len(CATEGORIES))
+            for codes in (self.classify(day, num_days) for day in days)
+        ]
+        return pd.DataFrame(counts, index=pd.DatetimeIndex(days), columns=CATEGORIES)
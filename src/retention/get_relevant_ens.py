@@ -1,15 +1,31 @@
+from __future__ import annotations
+
 import argparse
 import datetime
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
+from typing import TYPE_CHECKING, Callable, Optional
 
 from dotenv import load_dotenv
-from duneapi.api import DuneAPI
-from duneapi.types import DuneQuery, Network, QueryParameter
 from duneapi.util import open_query
+from src.clients import legacy_dune_client, rate_limiter
+from src.retention.classifier import RetentionActivity
 from src.subgraph.ens_data import get_wallet_ens_data, WalletNameMap
+from src.subgraph.ens_store import EnsStore
+from src.subgraph.fetch import subgraph_client
 from src.utils import write_to_json, valid_date
 
+if TYPE_CHECKING:
+    from duneapi.api import DuneAPI
+    from duneapi.types import DuneQuery, DuneRecord, QueryParameter
+
 SUBGRAPH_URL = "https://api.thegraph.com/subgraphs/name/ensdomains/ens"
+# Number of days (before the date) over which a trader counts as recent
+NUM_DAYS = 30
+# Number of Dune executions awaited at the same time
+MAX_PENDING_EXECUTIONS = 16
 
 
 class RetentionCategory(Enum):
@@ -24,32 +40,172 @@ class RetentionCategory(Enum):
         return str(self.value)
 
 
-def fetch_retained_users(
-    dune: DuneAPI, category: RetentionCategory, day: datetime.datetime
-) -> WalletNameMap:
+# A single (day, category) of a retention sweep
+SweepKey = tuple[datetime.datetime, RetentionCategory]
+# Looks up the ENS data of a set of wallets
+EnsLookup = Callable[[set[str]], WalletNameMap]
+
+
+def retention_parameters(
+    category: RetentionCategory, day: datetime.datetime
+) -> list[QueryParameter]:
+    """Parameters of retention-on-date.sql for `category` users on `day`"""
+    # duneapi configures logging from ./logging.conf as soon as it is imported.
+    # pylint:disable=import-outside-toplevel
+    from duneapi.types import QueryParameter
+
+    return [
+        QueryParameter.date_type("DateFor", day),
+        QueryParameter.enum_type(
+            "TraderType", str(category), [str(c) for c in RetentionCategory]
+        ),
+        QueryParameter.number_type("NumDays", NUM_DAYS),
+    ]
+
+
+def mainnet_query(
+    raw_sql: str, name: str, parameters: Optional[list[QueryParameter]] = None
+) -> DuneQuery:
+    """Legacy Dune query (with the environment's query id) of `raw_sql` on mainnet"""
+    # duneapi configures logging from ./logging.conf as soon as it is imported.
+    # pylint:disable=import-outside-toplevel
+    from duneapi.types import DuneQuery, Network
+
+    return DuneQuery.from_environment(
+        raw_sql=raw_sql, name=name, network=Network.MAINNET, parameters=parameters
+    )
+
+
+def fetch_uploaded(dune: DuneAPI, query: DuneQuery) -> list[DuneRecord]:
     """
-    Fetches ETH spent on CIP-9 Fee subsidies
-    https://snapshot.org/#/cow.eth/proposal/0x4bb9b614bdc4354856c4d0002ad0845b73b5290e5799013192cbc6491e6eea0e
+    Same as DuneAPI.fetch (logging in again and retrying on failures), but for a
+    query which has already been uploaded
     """
-    print(f"Fetching wallets for {category} users on {day.date()}...")
-    query = DuneQuery.from_environment(
-        raw_sql=open_query("./queries/retention-on-date.sql"),
-        name=f"{category} users",
-        network=Network.MAINNET,
-        parameters=[
-            QueryParameter.date_type("DateFor", day),
-            QueryParameter.enum_type(
-                "TraderType", str(category), [str(c) for c in RetentionCategory]
-            ),
-            QueryParameter.number_type("NumDays", 30),
-        ],
+    for _ in range(dune.max_retries):
+        try:
+            return dune.execute_and_await_results(query)
+        except RuntimeError as err:
+            print(f"{query.name} failed with {err}. Logging in and trying again")
+            dune.login()
+            dune.refresh_auth_token()
+    raise RuntimeError(f"Maximum retries ({dune.max_retries}) exceeded")
+
+
+def fetch_retained_wallets(
+    dune: DuneAPI, keys: list[SweepKey]
+) -> dict[SweepKey, set[str]]:
+    """
+    Fetches the (lower case) wallets of every (day, category) in `keys`.
+    All executions share the same query, so it is uploaded (with its parameter
+    definitions) once and then executed with the parameters of every key,
+    MAX_PENDING_EXECUTIONS at a time. Sessions of the legacy client are not
+    thread-safe, so every worker logs in with a client of its own.
+    """
+    raw_sql = open_query("./queries/retention-on-date.sql")
+    # The parameters of the upload only serve as definitions (and defaults)
+    first_day, first_category = keys[0]
+    dune.initiate_query(
+        mainnet_query(
+            raw_sql,
+            "retention on date",
+            retention_parameters(first_category, first_day),
+        )
     )
-    wallets = set(rec["trader"].lower() for rec in dune.fetch(query))
-    print(f"Got {len(wallets)} results")
-    ens_map = get_wallet_ens_data(wallets)
+    clients = threading.local()
+
+    def fetch(key: SweepKey) -> set[str]:
+        day, category = key
+        if not hasattr(clients, "dune"):
+            clients.dune = type(dune)(
+                dune.username, dune.password, dune.max_retries, dune.ping_frequency
+            )
+            clients.dune.login()
+        print(f"Fetching wallets for {category} users on {day.date()}...")
+        query = mainnet_query(
+            raw_sql, f"{category} users", retention_parameters(category, day)
+        )
+        return set(rec["trader"].lower() for rec in fetch_uploaded(clients.dune, query))
+
+    with ThreadPoolExecutor(max_workers=MAX_PENDING_EXECUTIONS) as pool:
+        return dict(zip(keys, pool.map(fetch, keys)))
+
+
+def fetch_retention_activity(dune: DuneAPI) -> RetentionActivity:
+    """Fetches the daily trading activity of all CoW traders"""
+    print("Fetching trading activity of all traders...")
+    query = mainnet_query(
+        open_query("./queries/retention-activity.sql"), "retention activity"
+    )
+    return RetentionActivity.from_records(dune.fetch(query))
+
+
+def classify_retained_wallets(
+    activity: RetentionActivity, keys: list[SweepKey]
+) -> dict[SweepKey, set[str]]:
+    """Same as fetch_retained_wallets, but classified locally from `activity`"""
+    return {
+        (day, category): activity.wallets(day, str(category), NUM_DAYS)
+        for day, category in keys
+    }
+
+
+def fetch_retention_sweep(
+    dune: DuneAPI,
+    days: list[datetime.datetime],
+    categories: list[RetentionCategory],
+    ens_lookup: EnsLookup = get_wallet_ens_data,
+    local: bool = False,
+) -> dict[SweepKey, WalletNameMap]:
+    """
+    Fetches the ENS data of users of every category on every day.
+    The union of all wallets is looked up once and then split by (day, category).
+    With `local`, the users are classified locally instead of by one Dune execution
+    per (day, category).
+    """
+    keys = [(day, category) for day in days for category in categories]
+    if local:
+        wallets = classify_retained_wallets(fetch_retention_activity(dune), keys)
+    else:
+        wallets = fetch_retained_wallets(dune, keys)
+    all_wallets: set[str] = set().union(*wallets.values())
+    print(f"Got {len(all_wallets)} distinct wallets over {len(keys)} executions")
+    ens_map = ens_lookup(all_wallets)
     print(f"Matched {len(ens_map)} wallets to names")
+    return {
+        key: {w: names for w, names in ens_map.items() if w in key_wallets}
+        for key, key_wallets in wallets.items()
+    }
 
-    return ens_map
+
+def fetch_retained_users(
+    dune: DuneAPI,
+    category: RetentionCategory,
+    day: datetime.datetime,
+    ens_lookup: EnsLookup = get_wallet_ens_data,
+) -> WalletNameMap:
+    """
+    Fetches ENS data of the `category` users on `day`
+    (see queries/retention-on-date.sql)
+    """
+    sweep = fetch_retention_sweep(dune, [day], [category], ens_lookup)
+    return sweep[(day, category)]
+
+
+def sweep_days(
+    start: datetime.datetime, end: datetime.datetime, step_days: int
+) -> list[datetime.datetime]:
+    """
+    Every `step_days`th day from `start` up to (and including) `end`
+    >>> jan = functools.partial(datetime.datetime, 2022, 1)
+    >>> [d.day for d in sweep_days(jan(1), jan(15), step_days=7)]
+    [1, 8, 15]
+    """
+    days = []
+    cur_day = start
+    while cur_day <= end:
+        days.append(cur_day)
+        cur_day += datetime.timedelta(days=step_days)
+    return days
 
 
 if __name__ == "__main__":
@@ -62,22 +218,65 @@ if __name__ == "__main__":
         required=True,
         type=valid_date,
     )
+    parser.add_argument(
+        "--end",
+        help="Sweep from --day up to this date (inclusive) - format YYYY-MM-DD",
+        type=valid_date,
+    )
+    parser.add_argument(
+        "--step-days",
+        type=int,
+        default=7,
+        help="Number of days between the dates of a sweep (default weekly)",
+    )
     parser.add_argument(
         "-c",
         "--category",
         type=RetentionCategory,
         choices=list(RetentionCategory),
-        help=f"Retention category to query from. One of {list(RetentionCategory)}",
+        nargs="+",
+        default=list(RetentionCategory),
+        help=f"Retention categories to query from. Any of {list(RetentionCategory)}",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=4,
+        help="Number of wallet partitions resolved in parallel",
+    )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=None,
+        help="Maximum number of ENS subgraph requests per second (default unlimited)",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Keep ENS data in out/ens-store.sqlite and only fetch what changed since",
+    )
+    parser.add_argument(
+        "--local",
+        action="store_true",
+        help="Classify users locally from their trading activity (one Dune execution)",
     )
     args = parser.parse_args()
 
-    start = args.day
-    cur_day = start
-    results = fetch_retained_users(
-        dune=DuneAPI.new_from_environment(),
-        day=cur_day,
-        category=args.category,
-    )
-    write_to_json(
-        results, path="./out", filename=f"text-{args.category}-week-{start.date()}"
+    lookup = EnsStore().wallet_ens_data if args.incremental else get_wallet_ens_data
+    sweep_results = fetch_retention_sweep(
+        dune=legacy_dune_client(),
+        days=sweep_days(args.day, args.end or args.day, args.step_days),
+        categories=args.category,
+        ens_lookup=functools.partial(
+            lookup, concurrency=args.concurrency, rate=args.rate
+        ),
+        local=args.local,
     )
+    print(f"ENS subgraph: {subgraph_client(SUBGRAPH_URL).stats}")
+    print(f"Subgraph rate limit: {rate_limiter('subgraph').stats}")
+    for (sweep_day, sweep_category), sweep_ens_map in sweep_results.items():
+        write_to_json(
+            sweep_ens_map,
+            path="./out",
+            filename=f"text-{sweep_category}-week-{sweep_day.date()}",
+        )
@@ -0,0 +1,96 @@
+"""
+Local snapshots of (large, slowly changing) JSON API responses.
+
+Snapshots younger than `max_age` are served without any request. Older ones are
+revalidated with a conditional GET (If-None-Match / If-Modified-Since) so unchanged
+payloads are not downloaded again. In offline mode only local snapshots are used.
+Requests (but not snapshot hits) can be throttled by a shared TokenBucket.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import tempfile
+import time
+from datetime import timedelta
+from pathlib import Path
+from typing import Any, Optional
+from urllib.parse import urlparse
+
+import requests
+
+from src.clients import http_session
+from src.constants import PROJECT_ROOT
+from src.rate_limit import TokenBucket
+
+SNAPSHOT_DIR = PROJECT_ROOT / "out" / "snapshots"
+
+
+class SnapshotStore:  # pylint:disable=too-few-public-methods
+    """Directory of JSON snapshots keyed by request URL"""
+
+    def __init__(
+        self,
+        directory: Path | str = SNAPSHOT_DIR,
+        max_age: timedelta = timedelta(hours=24),
+        offline: bool = False,
+        session: Optional[requests.Session] = None,
+        limiter: Optional[TokenBucket] = None,
+    ):
+        self.directory = Path(directory)
+        self.max_age = max_age
+        self.offline = offline
+        self.session = session
+        self.limiter = limiter
+
+    def _paths(self, url: str) -> tuple[Path, Path]:
+        key = hashlib.sha256(url.encode()).hexdigest()[:16]
+        return self.directory / f"{key}.json", self.directory / f"{key}.meta.json"
+
+    def _write(self, path: Path, content: bytes) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=self.directory, delete=False) as file:
+            file.write(content)
+        os.replace(file.name, path)
+
+    def get_json(self, url: str, timeout: int = 10) -> Any:
+        """Returns the JSON at `url`, from the local snapshot whenever possible"""
+        body_path, meta_path = self._paths(url)
+        meta: dict[str, Any] = {}
+        if body_path.exists() and meta_path.exists():
+            meta = json.loads(meta_path.read_text(encoding="utf-8"))
+            age = time.time() - meta["fetched_at"]
+            if self.offline or age < self.max_age.total_seconds():
+                return json.loads(body_path.read_bytes())
+        elif self.offline:
+            raise FileNotFoundError(f"No snapshot of {url} in {self.directory}")
+
+        headers = {}
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+        try:
+            session = self.session or http_session(urlparse(url).netloc)
+            if self.limiter:
+                self.limiter.acquire()
+            response = session.get(url, headers=headers, timeout=timeout)
+            response.raise_for_status()
+        except requests.RequestException as err:
+            if not meta:
+                raise
+            print(f"Failed to revalidate {url} ({err}) - using stale snapshot.")
+            return json.loads(body_path.read_bytes())
+
+        if response.status_code != 304:
+            self._write(body_path, response.content)
+            meta = {
+                "url": url,
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+            }
+        meta["fetched_at"] = time.time()
+        self._write(meta_path, json.dumps(meta).encode())
+        return json.loads(body_path.read_bytes())
@@ -0,0 +1,111 @@
+"""
+Reading and writing the spellbook ERC20 token lists, e.g.
+https://github.com/duneanalytics/spellbook/blob/main/tokens/models/tokens/ethereum/tokens_ethereum_erc20.sql
+"""
+
+from __future__ import annotations
+
+import glob
+import os
+import re
+import shutil
+import tempfile
+from dataclasses import dataclass
+
+VALUES_END = ") AS temp_table (contract_address, symbol, decimals)"
+# Matches the contract address of a row like `, (0xabc..., 'SYM', 18)`
+ROW_ADDRESS = re.compile(r"^\s*,?\s*\(\s*'?(0x[0-9a-fA-F]{40})'?\s*,")
+
+
+@dataclass
+class InsertReport:
+    """Outcome of inserting rows into a spellbook token file"""
+
+    inserted: int
+    duplicates: int
+
+
+def row_address(line: str) -> str | None:
+    """
+    Lower case token address of a VALUES row (None if line is not a row)
+    >>> row_address("    , (0xfcc5c47be19d06bf83eb04298b026f81069ff65b, 'yCRV', 18)")
+    '0xfcc5c47be19d06bf83eb04298b026f81069ff65b'
+    """
+    match = ROW_ADDRESS.match(line)
+    return match.group(1).lower() if match else None
+
+
+def load_token_addresses(file_loc: str) -> set[str]:
+    """Lower case addresses of all tokens listed in the VALUES block of file_loc"""
+    addresses = set()
+    with open(file_loc, "r", encoding="utf-8") as file:
+        for line in file:
+            if line.startswith(VALUES_END):
+                break
+            address = row_address(line)
+            if address:
+                addresses.add(address)
+    return addresses
+
+
+def token_file(spellbook_path: str, chain_name: str) -> str:
+    """Location of the chain's main ERC20 token list within the spellbook repo"""
+    return os.path.join(
+        spellbook_path,
+        f"tokens/models/tokens/{chain_name}/tokens_{chain_name}_erc20.sql",
+    )
+
+
+def load_spellbook_tokens(spellbook_path: str, chain_name: str) -> set[str]:
+    """Lower case addresses of all tokens in the chain's spellbook ERC20 files"""
+    addresses = set()
+    pattern = os.path.join(
+        spellbook_path, f"tokens/models/tokens/{chain_name}/*erc20*.sql"
+    )
+    for file_loc in sorted(glob.glob(pattern)):
+        addresses |= load_token_addresses(file_loc)
+    return addresses
+
+
+def insert_token_rows(file_loc: str, rows: list[str]) -> InsertReport:
+    """
+    Appends `rows` to the end of the VALUES block of the spellbook file at file_loc,
+    skipping those whose address is already listed (or repeated within `rows`).
+    The file is streamed once into a temporary copy which then atomically
+    replaces the original.
+    """
+    seen: set[str] = set()
+    duplicates = inserted = 0
+    directory = os.path.dirname(os.path.abspath(file_loc))
+    with tempfile.NamedTemporaryFile(
+        "w", dir=directory, encoding="utf-8", delete=False
+    ) as out:
+        try:
+            with open(file_loc, "r", encoding="utf-8") as file:
+                found_end = False
+                for line in file:
+                    if not found_end and line.startswith(VALUES_END):
+                        found_end = True
+                        for row in rows:
+                            address = row_address(row)
+                            if address is None:
+                                raise ValueError(f"Not a token row: {row}")
+                            if address in seen:
+                                duplicates += 1
+                                continue
+                            seen.add(address)
+                            out.write(f"    {row.strip()}\n")
+                            inserted += 1
+                    elif not found_end:
+                        address = row_address(line)
+                        if address:
+                            seen.add(address)
+                    out.write(line)
+            if not found_end:
+                raise ValueError(f"Could not find `{VALUES_END}` in {file_loc}")
+        except BaseException:
+            os.remove(out.name)
+            raise
+    shutil.copymode(file_loc, out.name)
+    os.replace(out.name, file_loc)
+    return InsertReport(inserted=inserted, duplicates=duplicates)
@@ -1,16 +1,36 @@
+import functools
 import json
-import os
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from typing import Optional, Any
 
-from dotenv import load_dotenv
+import requests
+from eth_abi import decode
+from eth_abi.exceptions import DecodingError
 from web3 import Web3
+from web3.contract import Contract
 
+from src.clients import web3_client
 from src.constants import PUBLIC_RESOLVER_ABI, ETH_RPC
-from src.subgraph.fetch import execute_subgraph_query
+from src.multicall import Call, encode_call, multicall
+from src.rate_limit import TokenBucket
+from src.subgraph.fetch import (
+    AdaptiveBatchSize,
+    RequestStats,
+    SubgraphError,
+    execute_subgraph_query,
+    subgraph_client,
+)
 from src.utils import partition_array
 
 SUBGRAPH_URL = "https://api.thegraph.com/subgraphs/name/ensdomains/ens"
+# Maximum number of entities The Graph returns per query
+PAGE_SIZE = 1000
+# Number of wallets looked up per partition
+PARTITION_SIZE = 500
+
+TEXT_SIGNATURE = "text(bytes32,string)"
 
 RELEVANT_FIELDS = {
     "email",
@@ -22,88 +42,380 @@ RELEVANT_FIELDS = {
     "org.telegram",
 }
 
-load_dotenv()
-w3 = Web3(Web3.HTTPProvider(ETH_RPC))
 
+# (resolver, node, key) of an ENS text record
+TextRecord = tuple[str, str, str]
 
-def read_ens_text(resolver: str, node: str, key: str) -> str:
-    resolver_contract = w3.eth.contract(
+
+@functools.lru_cache(maxsize=1024)
+def resolver_contract(resolver: str) -> Contract:
+    """Public resolver contract at `resolver` (one instance per address)"""
+    return web3_client(ETH_RPC).eth.contract(
         address=Web3.to_checksum_address(resolver), abi=PUBLIC_RESOLVER_ABI
     )
 
-    text: str = resolver_contract.caller.text(node, key)
+
+def read_ens_text(resolver: str, node: str, key: str) -> str:
+    text: str = resolver_contract(resolver).caller.text(node, key)
     return text
 
 
-def resolve_query(
-    wallet_list: list[str], skip: int, block: Optional[int] = None
+def read_ens_texts(
+    records: list[TextRecord], node_url: Optional[str] = None
+) -> list[Optional[str]]:
+    """
+    Reads all text `records` in batched (Multicall3) eth_calls.
+    Returns the texts in the order of `records`, None for records that could not
+    be read (e.g. reverted on a non-standard resolver, or not valid UTF-8).
+    """
+    calls = [
+        Call(resolver, encode_call(TEXT_SIGNATURE, [bytes.fromhex(node[2:]), key]))
+        for resolver, node, key in records
+    ]
+    texts: list[Optional[str]] = []
+    for result in multicall(node_url or ETH_RPC, calls):
+        try:
+            texts.append(decode(["string"], result.data)[0] if result.success else None)
+        except (DecodingError, UnicodeDecodeError):
+            texts.append(None)
+    return texts
+
+
+DOMAIN_FIELDS = """
+fragment DomainFields on Domain {
+  name
+  id
+  resolvedAddress {
+    id
+  }
+  resolver {
+    address
+    texts
+  }
+}
+"""
+
+
+@dataclass
+class PartitionCursor:
+    """Position of the next page of domains of a partition (of wallets or domain ids)"""
+
+    index: int
+    wallets: list[str]
+    last_id: str = ""
+
+
+@dataclass(frozen=True)
+class DomainQuery:
+    """
+    Selects the domains whose `key` field matches a partition's values (and which
+    changed at or after block `changed_since`, if set), as of `block`.
+    Relevant text records of the selected domains are read if `read_texts`.
+    """
+
+    block: Optional[int] = None
+    key: str = "resolvedAddress_in"
+    changed_since: Optional[int] = None
+    read_texts: bool = True
+
+
+def domains_field(  # pylint:disable=too-many-arguments
+    wallet_list: list[str],
+    last_id: str = "",
+    block: Optional[int] = None,
+    *,
+    alias: Optional[str] = None,
+    key: str = "resolvedAddress_in",
+    changed_since: Optional[int] = None,
 ) -> str:
     """
-    Constructs and query to fetch ens names for a list of ethereum addresses
+    The (up to PAGE_SIZE) domains resolving to any of `wallet_list` (or whose `key`
+    matches any of them), ordered by id following `last_id`, as an (optionally
+    aliased) query field.
     """
     assert all(w == w.lower() for w in wallet_list), "Addresses must be lower case!"
     block_constraint = f"block: {{number: {block}}}" if block else ""
+    change_constraint = (
+        f"_change_block: {{number_gte: {changed_since}}}," if changed_since else ""
+    )
+    prefix = f"{alias}: " if alias else ""
     return f"""
-    {{
-      domains(
+      {prefix}domains(
+        first: {PAGE_SIZE},
+        orderBy: id,
+        orderDirection: asc,
         where: {{
-            resolvedAddress_in: {json.dumps(wallet_list)}
+            {key}: {json.dumps(wallet_list)},
+            {change_constraint}
+            id_gt: {json.dumps(last_id)}
         }},
-        skip: {skip},
         {block_constraint}
       ) {{
-        name
-        id
-        resolvedAddress {{
-          id
-        }}
-        resolver {{
-            address
-            texts
-        }}
-      }}
-    }}
+        ...DomainFields
+      }}"""
+
+
+def resolve_query(
+    wallet_list: list[str], last_id: str = "", block: Optional[int] = None
+) -> str:
+    """
+    Constructs and query to fetch ens names for a list of ethereum addresses.
+    Returns the (up to PAGE_SIZE) domains ordered by id following `last_id`.
     """
+    return f"{{{domains_field(wallet_list, last_id, block)}\n}}{DOMAIN_FIELDS}"
+
+
+def resolve_batch_query(
+    cursors: list[PartitionCursor], domain_query: DomainQuery = DomainQuery()
+) -> str:
+    """
+    Packs the next page of every cursor into a single query.
+    The page of cursors[i] is returned under the alias `p{i}`.
+    """
+    fields = "".join(
+        domains_field(
+            cursor.wallets,
+            cursor.last_id,
+            domain_query.block,
+            alias=f"p{i}",
+            key=domain_query.key,
+            changed_since=domain_query.changed_since,
+        )
+        for i, cursor in enumerate(cursors)
+    )
+    return f"{{{fields}\n}}{DOMAIN_FIELDS}"
 
 
 WalletNameMap = dict[str, list[dict[str, dict[Any, Any]]]]
 
 
+def latest_block() -> int:
+    """Latest block indexed by the ENS subgraph"""
+    result_json = execute_subgraph_query(
+        subgraph_url=SUBGRAPH_URL, query="{ _meta { block { number } } }"
+    )
+    number: int = result_json["data"]["_meta"]["block"]["number"]
+    return number
+
+
 def get_wallet_ens_data(
-    wallet_set: set[str], block: Optional[int] = None
+    wallet_set: set[str],
+    block: Optional[int] = None,
+    concurrency: int = 1,
+    rate: Optional[float] = None,
+    batch_size: Optional[AdaptiveBatchSize] = None,
 ) -> WalletNameMap:
-    results: WalletNameMap = {}
-    partition = partition_array(list(wallet_set), 500)
-    for part in partition:
-        results.update(get_names_for_wallets_small(set(part), block))
-    return results
+    """
+    Fetches ENS names (and relevant text records) of all wallets in `wallet_set`.
+    The pages of several partitions are packed into each subgraph request
+    (see AdaptiveBatchSize). Requests are made by up to `concurrency` threads,
+    at most `rate` per second (if given). Results are merged in partition order,
+    so the output does not depend on which request finishes first.
+    """
+    # All partitions are read at the same block for a consistent snapshot.
+    block = block or latest_block()
+    domains = fetch_domains(
+        wallet_set,
+        DomainQuery(block),
+        concurrency,
+        TokenBucket(rate) if rate else None,
+        batch_size,
+    )
+    return wallet_names(domains)
 
 
-def get_result_page(wallets: list[str], skip: int, block: Optional[int] = None) -> Any:
-    result_json = execute_subgraph_query(
-        subgraph_url="https://api.thegraph.com/subgraphs/name/ensdomains/ens",
-        query=resolve_query(list(wallets), skip, block),
+def fetch_domains(
+    values: set[str],
+    domain_query: DomainQuery,
+    concurrency: int = 1,
+    limiter: Optional[TokenBucket] = None,
+    batch_size: Optional[AdaptiveBatchSize] = None,
+) -> list[dict[str, Any]]:
+    """
+    Fetches all domains matching `domain_query` for the (sorted) `values`,
+    reading the text records of domains with relevant ones (into `text_values`)
+    unless disabled.
+    Domains are returned partition by partition, each ordered by id.
+    """
+    partitions = partition_array(sorted(values), PARTITION_SIZE)
+    domains = fetch_partition_domains(
+        partitions,
+        domain_query,
+        concurrency,
+        limiter,
+        batch_size or AdaptiveBatchSize(),
     )
-    return result_json["data"]["domains"]
+    return [rec for part_domains in domains for rec in part_domains]
+
+
+def fetch_partition_domains(
+    partitions: list[list[str]],
+    domain_query: DomainQuery,
+    concurrency: int,
+    limiter: Optional[TokenBucket],
+    batch_size: AdaptiveBatchSize,
+) -> list[list[dict[str, Any]]]:
+    """
+    Fetches all pages of every partition, packing `batch_size` pages per request.
+    Each round requests the next page of all partitions that have more.
+    """
+    domains: list[list[dict[str, Any]]] = [[] for _ in partitions]
+    pending = [PartitionCursor(i, part) for i, part in enumerate(partitions)]
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        while pending:
+            batches = partition_array(pending, batch_size.size)
+            futures = [
+                pool.submit(fetch_batch, batch, domain_query, limiter)
+                for batch in batches
+            ]
+            pending = []
+            for batch, future in zip(batches, futures):
+                try:
+                    pages, stats = future.result()
+                except SubgraphError:
+                    if len(batch) == 1:
+                        raise
+                    batch_size.shrink()
+                    pending.extend(batch)
+                    continue
+                batch_size.update(stats, len(batch))
+                pending.extend(advance(batch, pages, domains))
+            pending.sort(key=lambda cursor: cursor.index)
+    return domains
+
+
+def advance(
+    cursors: list[PartitionCursor],
+    pages: list[list[dict[str, Any]]],
+    domains: list[list[dict[str, Any]]],
+) -> list[PartitionCursor]:
+    """
+    Adds each cursor's page to its partition's `domains`.
+    Returns the cursors (moved past their page) of partitions with more pages.
+    """
+    more = []
+    for cursor, page in zip(cursors, pages):
+        domains[cursor.index].extend(page)
+        if len(page) == PAGE_SIZE:
+            cursor.last_id = page[-1]["id"]
+            more.append(cursor)
+    return more
+
+
+def fetch_batch(
+    cursors: list[PartitionCursor],
+    domain_query: DomainQuery = DomainQuery(),
+    limiter: Optional[TokenBucket] = None,
+) -> tuple[list[list[dict[str, Any]]], RequestStats]:
+    """
+    Fetches the next page of each cursor in one request and reads the relevant
+    text records on each page. Returns the pages and the request's stats.
+    Raises SubgraphError when the subgraph rejects the request (e.g. as too large)
+    while failures to read text records are raised as they are.
+    """
+    if limiter:
+        limiter.acquire()
+    try:
+        result_json, stats = subgraph_client(SUBGRAPH_URL).execute_timed(
+            resolve_batch_query(cursors, domain_query)
+        )
+    except requests.HTTPError as err:
+        raise SubgraphError(f"{SUBGRAPH_URL}: {err}") from err
+    pages = [result_json["data"][f"p{i}"] for i in range(len(cursors))]
+    if domain_query.read_texts:
+        for page in pages:
+            read_page_texts(page)
+    return pages, stats
+
+
+def has_relevant_texts(rec: dict[str, Any]) -> bool:
+    """Whether the domain `rec` has any of the RELEVANT_FIELDS text records"""
+    # Domains may have no resolver set at all.
+    return bool(
+        rec["resolver"] is not None
+        and rec["resolver"]["texts"]
+        and not set(rec["resolver"]["texts"]).isdisjoint(RELEVANT_FIELDS)
+    )
+
+
+def read_page_texts(page: list[dict[str, Any]]) -> None:
+    """
+    Reads all text records of the domains with relevant ones on a result page
+    (in one batch) into their `text_values`. Records that could not be read are
+    left out.
+    """
+    relevant = [rec for rec in page if has_relevant_texts(rec)]
+    records = [
+        (rec["resolver"]["address"], rec["id"], key)
+        for rec in relevant
+        for key in rec["resolver"]["texts"]
+    ]
+    values = iter(read_ens_texts(records))
+    for rec in relevant:
+        rec["text_values"] = {}
+        for key in rec["resolver"]["texts"]:
+            value = next(values)
+            if value is not None:
+                rec["text_values"][key] = value
+
+
+def wallet_names(domains: list[dict[str, Any]]) -> WalletNameMap:
+    """Names (with relevant text records) by wallet of the domains in `domains`"""
+    results: WalletNameMap = defaultdict(list)
+    for rec in domains:
+        if "text_values" not in rec or rec["resolvedAddress"] is None:
+            continue
+        results[rec["resolvedAddress"]["id"]].append(
+            {rec["name"]: {"id": rec["id"], "texts": rec["text_values"]}}
+        )
+    return dict(results)
+
+
+def text_changes(
+    resolver_ids: set[str], changed_since: int, block: Optional[int] = None
+) -> set[str]:
+    """
+    Ids of the resolvers (`<resolver address>-<node>`) among `resolver_ids`
+    that emitted a TextChanged event at or after block `changed_since`.
+    """
+    block_constraint = f"block: {{number: {block}}}" if block else ""
+    changed: set[str] = set()
+    for part in partition_array(sorted(resolver_ids), PARTITION_SIZE):
+        last_id = ""
+        while True:
+            result_json = execute_subgraph_query(
+                subgraph_url=SUBGRAPH_URL,
+                query=f"""
+                {{
+                  textChangeds(
+                    first: {PAGE_SIZE},
+                    orderBy: id,
+                    orderDirection: asc,
+                    where: {{
+                        resolver_in: {json.dumps(part)},
+                        blockNumber_gte: {changed_since},
+                        id_gt: {json.dumps(last_id)}
+                    }},
+                    {block_constraint}
+                  ) {{
+                    id
+                    resolver {{
+                      id
+                    }}
+                  }}
+                }}
+                """,
+            )
+            events = result_json["data"]["textChangeds"]
+            changed.update(event["resolver"]["id"] for event in events)
+            if len(events) < PAGE_SIZE:
+                break
+            last_id = events[-1]["id"]
+    return changed
 
 
 def get_names_for_wallets_small(
     wallet_set: set[str], block: Optional[int] = None
 ) -> WalletNameMap:
-    wallets = list(wallet_set)
-    results = defaultdict(list)
-    skip = 0
-    result_dict = get_result_page(wallets, skip, block)
-    while len(result_dict) > 0:
-        for rec in result_dict:
-            wallet, name = rec["resolvedAddress"]["id"], rec["name"]
-            texts, ens_id = rec["resolver"]["texts"], rec["id"]
-            resolver = rec["resolver"]["address"]
-            if texts and not set(texts).isdisjoint(RELEVANT_FIELDS):
-                rich_text = {}
-                for text in texts:
-                    rich_text[text] = read_ens_text(resolver, ens_id, text)
-                results[wallet].append({name: {"id": ens_id, "texts": rich_text}})
-        skip += 100
-        result_dict = get_result_page(wallets, skip)
-    return results
+    """ENS names of a small set of wallets (see get_wallet_ens_data)"""
+    return get_wallet_ens_data(wallet_set, block)
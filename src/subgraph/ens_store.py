@@ -0,0 +1,203 @@
+"""
+Persistent, incrementally updated store of wallet ENS data.
+
+Every wallet is stored with the block its domains were last read at (its
+watermark). Wallets seen for the first time are fetched in full. For known wallets
+only the domains changed since their watermark are fetched again (by The Graph's
+`_change_block` filter), along with the domains whose resolver emitted a
+TextChanged event since then. Text records are only re-read for those domains.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import sqlite3
+from collections import defaultdict
+from pathlib import Path
+from typing import Any, Optional
+
+from src.constants import PROJECT_ROOT
+from src.rate_limit import TokenBucket
+from src.subgraph.ens_data import (
+    DomainQuery,
+    WalletNameMap,
+    fetch_domains,
+    latest_block,
+    read_page_texts,
+    text_changes,
+)
+from src.utils import partition_array
+
+ENS_STORE_PATH = PROJECT_ROOT / "out" / "ens-store.sqlite"
+# Maximum number of SQLite query parameters per statement
+SQL_CHUNK = 500
+
+
+class EnsStore:
+    """SQLite backed store of the ENS domains (and text records) of wallets"""
+
+    def __init__(self, path: Path | str = ENS_STORE_PATH):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path, timeout=30)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS wallets (
+                wallet TEXT PRIMARY KEY,
+                block INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS domains (
+                id TEXT PRIMARY KEY,
+                wallet TEXT,
+                name TEXT,
+                resolver TEXT,
+                texts TEXT,
+                block INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS domains_wallet ON domains (wallet);
+            """)
+        self.conn.commit()
+
+    def watermarks(self, wallets: set[str]) -> dict[str, int]:
+        """Block each of the (known) `wallets` was last read at"""
+        found: dict[str, int] = {}
+        for part in partition_array(sorted(wallets), SQL_CHUNK):
+            found.update(
+                self.conn.execute(
+                    "SELECT wallet, block FROM wallets "
+                    f"WHERE wallet IN ({','.join('?' * len(part))})",
+                    part,
+                ).fetchall()
+            )
+        return found
+
+    def resolvers(self, wallets: set[str]) -> dict[str, Optional[str]]:
+        """Resolver address by domain id of all stored domains of `wallets`"""
+        found: dict[str, Optional[str]] = {}
+        for part in partition_array(sorted(wallets), SQL_CHUNK):
+            found.update(
+                self.conn.execute(
+                    "SELECT id, resolver FROM domains "
+                    f"WHERE wallet IN ({','.join('?' * len(part))})",
+                    part,
+                ).fetchall()
+            )
+        return found
+
+    def save(
+        self, domains: list[dict[str, Any]], wallets: set[str], block: int
+    ) -> None:
+        """Stores `domains` (as read at `block`) and moves the watermark of `wallets`"""
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO domains (id, wallet, name, resolver, texts, block) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            [
+                (
+                    rec["id"],
+                    rec["resolvedAddress"] and rec["resolvedAddress"]["id"],
+                    rec["name"],
+                    rec["resolver"] and rec["resolver"]["address"],
+                    json.dumps(rec["text_values"]) if "text_values" in rec else None,
+                    block,
+                )
+                for rec in domains
+            ],
+        )
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO wallets (wallet, block) VALUES (?, ?)",
+            [(wallet, block) for wallet in wallets],
+        )
+        self.conn.commit()
+
+    def names(self, wallets: set[str]) -> WalletNameMap:
+        """Stored names (with relevant text records) of `wallets`, by wallet and id"""
+        results: WalletNameMap = defaultdict(list)
+        for part in partition_array(sorted(wallets), SQL_CHUNK):
+            rows = self.conn.execute(
+                "SELECT wallet, id, name, texts FROM domains "
+                f"WHERE wallet IN ({','.join('?' * len(part))}) "
+                "AND texts IS NOT NULL ORDER BY wallet, id",
+                part,
+            )
+            for wallet, domain_id, name, texts in rows:
+                results[wallet].append(
+                    {name: {"id": domain_id, "texts": json.loads(texts)}}
+                )
+        return dict(results)
+
+    def changes(
+        self,
+        wallets: set[str],
+        since: int,
+        block: int,
+        limiter: Optional[TokenBucket] = None,
+    ) -> list[dict[str, Any]]:
+        """
+        Domains of `wallets` (which were read at block `since`) that changed
+        up to `block`, with their text records read anew.
+        """
+        known = self.resolvers(wallets)
+        # Domains moved away from, or to, one of the wallets (or changed otherwise)
+        changed = fetch_domains(
+            set(known),
+            DomainQuery(block, "id_in", since + 1, read_texts=False),
+            limiter=limiter,
+        ) + fetch_domains(
+            wallets,
+            DomainQuery(block, changed_since=since + 1, read_texts=False),
+            limiter=limiter,
+        )
+        fetched = {rec["id"]: rec for rec in changed}
+        # Text records changes do not touch the domain, only the resolver.
+        resolver_ids = {
+            f"{resolver}-{domain_id}": domain_id
+            for domain_id, resolver in known.items()
+            if resolver and domain_id not in fetched
+        }
+        stale = {
+            resolver_ids[resolver_id]
+            for resolver_id in text_changes(set(resolver_ids), since + 1, block)
+        }
+        if stale:
+            for rec in fetch_domains(
+                stale, DomainQuery(block, "id_in", read_texts=False), limiter=limiter
+            ):
+                fetched[rec["id"]] = rec
+        domains = list(fetched.values())
+        read_page_texts(domains)
+        return domains
+
+    def wallet_ens_data(
+        self,
+        wallet_set: set[str],
+        block: Optional[int] = None,
+        concurrency: int = 1,
+        rate: Optional[float] = None,
+    ) -> WalletNameMap:
+        """
+        Brings the stored ENS data of `wallet_set` up to `block` (default latest)
+        and returns it (see ens_data.get_wallet_ens_data).
+        """
+        block = block or latest_block()
+        limiter = TokenBucket(rate) if rate else None
+        watermarks = self.watermarks(wallet_set)
+        new = wallet_set - watermarks.keys()
+        if new:
+            print(f"Fetching ENS data of {len(new)} new wallets")
+            domains = fetch_domains(new, DomainQuery(block), concurrency, limiter)
+            self.save(domains, new, block)
+        by_watermark: dict[int, set[str]] = defaultdict(set)
+        for wallet, since in watermarks.items():
+            if since < block:
+                by_watermark[since].add(wallet)
+        for since, wallets in sorted(by_watermark.items()):
+            domains = self.changes(wallets, since, block, limiter)
+            print(
+                f"{len(domains)} ENS domains changed between blocks {since} and "
+                f"{block} for {len(wallets)} wallets"
+            )
+            self.save(domains, wallets, block)
+        return self.names(wallet_set)
+
+    def close(self) -> None:
+        """Closes the underlying database connection"""
+        self.conn.close()
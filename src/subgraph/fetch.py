@@ -1,7 +1,174 @@
-from typing import Any
+import random
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Optional
 
 import requests
 
+from src.clients import http_session, rate_limiter, registered
+from src.rate_limit import TokenBucket
+
+# HTTP status codes on which a request is retried
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class SubgraphError(Exception):
+    """Raised when a subgraph query keeps failing after all retries"""
+
+
+@dataclass
+class RequestStats:
+    """Totals over all requests made by a SubgraphClient"""
+
+    requests: int = 0
+    retries: int = 0
+    bytes: int = 0
+    seconds: float = 0.0
+    max_seconds: float = 0.0
+
+    def record(self, num_bytes: int, seconds: float) -> None:
+        """Records a single request"""
+        self.requests += 1
+        self.bytes += num_bytes
+        self.seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+
+    def merge(self, other: "RequestStats") -> None:
+        """Adds the totals of `other` to these"""
+        self.requests += other.requests
+        self.retries += other.retries
+        self.bytes += other.bytes
+        self.seconds += other.seconds
+        self.max_seconds = max(self.max_seconds, other.max_seconds)
+
+    def __str__(self) -> str:
+        average = self.seconds / self.requests if self.requests else 0.0
+        return (
+            f"{self.requests} requests ({self.retries} retries), "
+            f"{self.bytes / 2**20:.2f} MiB, "
+            f"latency avg {average:.2f}s max {self.max_seconds:.2f}s"
+        )
+
+
+class SubgraphClient:  # pylint:disable=too-few-public-methods
+    """
+    GraphQL client for a single subgraph: keeps connections alive, asks for
+    compressed responses and retries (with jittered exponential backoff) on
+    connection errors, timeouts, 429/5xx responses and GraphQL `errors`.
+    Every request (including retries) first takes a token from `limiter`.
+    """
+
+    def __init__(  # pylint:disable=too-many-arguments
+        self,
+        url: str,
+        timeout: float = 30,
+        max_retries: int = 5,
+        backoff: float = 1.0,
+        session: Optional[requests.Session] = None,
+        limiter: Optional[TokenBucket] = None,
+    ):
+        self.url = url
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.session = session or http_session(url)
+        self.limiter = limiter
+        self.stats = RequestStats()
+        self._stats_lock = threading.Lock()
+
+    def execute(self, query: str, variables: Optional[dict[str, Any]] = None) -> Any:
+        """Executes `query` and returns the parsed response (with `data`)"""
+        result, _ = self.execute_timed(query, variables)
+        return result
+
+    def execute_timed(
+        self, query: str, variables: Optional[dict[str, Any]] = None
+    ) -> tuple[Any, RequestStats]:
+        """Like `execute`, but also returns the stats of this query alone"""
+        stats = RequestStats()
+        try:
+            return self._execute(query, variables, stats), stats
+        finally:
+            with self._stats_lock:
+                self.stats.merge(stats)
+
+    def _execute(
+        self, query: str, variables: Optional[dict[str, Any]], stats: RequestStats
+    ) -> Any:
+        error: Any = None
+        for attempt in range(self.max_retries + 1):
+            if attempt > 0:
+                stats.retries += 1
+                time.sleep(self.backoff * 2 ** (attempt - 1) * random.uniform(0.5, 1.5))
+            if self.limiter:
+                self.limiter.acquire()
+            start = time.perf_counter()
+            try:
+                response = self.session.post(
+                    url=self.url,
+                    json={"query": query, "variables": variables},
+                    headers={"Accept-Encoding": "gzip"},
+                    timeout=self.timeout,
+                )
+            except (requests.ConnectionError, requests.Timeout) as err:
+                stats.record(0, time.perf_counter() - start)
+                error = err
+                continue
+            stats.record(len(response.content), time.perf_counter() - start)
+            if response.status_code in RETRY_STATUS:
+                error = f"HTTP {response.status_code}"
+                continue
+            response.raise_for_status()
+            result = response.json()
+            if result.get("errors"):
+                error = result["errors"]
+                continue
+            return result
+        raise SubgraphError(
+            f"{self.url} failed after {self.max_retries + 1} attempts: {error}"
+        )
+
+
+class AdaptiveBatchSize:
+    """
+    Number of queries to pack into one request, adapted to the responses seen:
+    grows by one after every fast and small response and halves as soon as a
+    response gets close to the endpoint's size or time limits (or fails).
+    """
+
+    def __init__(
+        self,
+        initial: int = 4,
+        maximum: int = 32,
+        max_bytes: int = 8 * 2**20,
+        max_seconds: float = 10.0,
+    ):
+        self.size = min(initial, maximum)
+        self.maximum = maximum
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+
+    def shrink(self) -> None:
+        """Halves the batch size (down to 1)"""
+        self.size = max(1, self.size // 2)
+
+    def update(self, stats: RequestStats, batch_size: int) -> None:
+        """Adapts the size to the `stats` of a request that packed `batch_size` queries"""
+        if stats.bytes > self.max_bytes or stats.max_seconds > self.max_seconds:
+            self.shrink()
+        elif batch_size >= self.size:
+            # Only grow when the full batch size was actually exercised.
+            self.size = min(self.maximum, self.size + 1)
+
+
+@registered
+def subgraph_client(subgraph_url: str, timeout: float = 30) -> SubgraphClient:
+    """Shared SubgraphClient for `subgraph_url` (sharing the subgraph rate limit)"""
+    return SubgraphClient(
+        subgraph_url, timeout=timeout, limiter=rate_limiter("subgraph")
+    )
+
 
 def execute_subgraph_query(subgraph_url: str, query: str) -> Any:
     """
@@ -10,5 +177,4 @@ def execute_subgraph_query(subgraph_url: str, query: str) -> Any:
     :param query: Graph QL Query
     :return: results of the query.
     """
-    response = requests.post(url=subgraph_url, json={"query": query, "variables": None})
-    return response.json()
+    return subgraph_client(subgraph_url).execute(query)
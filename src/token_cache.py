@@ -0,0 +1,107 @@
+"""
+Persistent ERC20 metadata cache.
+
+Token symbol and decimals practically never change, so once resolved they are kept
+in a local SQLite database keyed by (chain_id, address). Tokens whose metadata could
+not be read are remembered as well (negative entries), with a shorter expiry, so that
+known-broken contracts are not queried again on every run.
+"""
+
+from __future__ import annotations
+
+import os
+import sqlite3
+import time
+from dataclasses import dataclass
+from datetime import timedelta
+from pathlib import Path
+from typing import Optional
+
+from src.address import Address
+from src.constants import PROJECT_ROOT
+
+TOKEN_CACHE_PATH = PROJECT_ROOT / "out" / "token-cache.sqlite"
+
+
+@dataclass(frozen=True)
+class CachedToken:
+    """
+    Cached token metadata. When `error` is set this is a negative entry
+    recording why the token metadata could not be fetched.
+    """
+
+    symbol: Optional[str]
+    decimals: Optional[int]
+    error: Optional[str] = None
+
+
+class TokenCache:
+    """SQLite backed cache of token metadata for a single chain"""
+
+    def __init__(
+        self,
+        chain_id: int,
+        path: Path | str = TOKEN_CACHE_PATH,
+        ttl: timedelta = timedelta(days=90),
+        negative_ttl: timedelta = timedelta(days=14),
+    ):
+        self.chain_id = chain_id
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path, timeout=30)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS tokens (
+                chain_id INTEGER NOT NULL,
+                address TEXT NOT NULL,
+                symbol TEXT,
+                decimals INTEGER,
+                error TEXT,
+                fetched_at REAL NOT NULL,
+                PRIMARY KEY (chain_id, address)
+            )
+            """)
+        self.conn.commit()
+
+    def lookup(self, tokens: list[Address]) -> dict[Address, CachedToken]:
+        """Returns all unexpired cache entries for `tokens`"""
+        now = time.time()
+        found: dict[Address, CachedToken] = {}
+        for token in tokens:
+            row = self.conn.execute(
+                "SELECT symbol, decimals, error, fetched_at FROM tokens "
+                "WHERE chain_id = ? AND address = ?",
+                (self.chain_id, token.address),
+            ).fetchone()
+            if row is None:
+                continue
+            symbol, decimals, error, fetched_at = row
+            ttl = self.negative_ttl if error else self.ttl
+            if now - fetched_at < ttl.total_seconds():
+                found[token] = CachedToken(symbol, decimals, error)
+        return found
+
+    def store(self, entries: dict[Address, CachedToken]) -> None:
+        """Inserts (or revalidates) `entries`"""
+        now = time.time()
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO tokens "
+            "(chain_id, address, symbol, decimals, error, fetched_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            [
+                (self.chain_id, t.address, e.symbol, e.decimals, e.error, now)
+                for t, e in entries.items()
+            ],
+        )
+        self.conn.commit()
+
+    def close(self) -> None:
+        """Closes the underlying database connection"""
+        self.conn.close()
+
+    def __enter__(self) -> TokenCache:
+        return self
+
+    def __exit__(self, *_args: object) -> None:
+        self.close()
@@ -3,12 +3,13 @@ import json
 import os
 from datetime import datetime
 from enum import Enum
-from typing import Any
+from typing import Any, Iterator, Mapping
 from dataclasses import dataclass
 
-from dune_client.types import Address
 from marshmallow import fields, Schema, post_load, ValidationError
 
+from src.address import Address
+
 
 def partition_array(arr: list[Any], size: int) -> list[list[Any]]:
     """Partitions `arr` into slices of `size` (except possibly the last)
@@ -65,7 +66,7 @@ class EthereumAddress(fields.Field):
             raise ValidationError("Not a valid address") from error
 
 
-@dataclass
+@dataclass(slots=True)
 class Token:
     """Dataclass for holding Token data"""
 
@@ -75,7 +76,7 @@ class Token:
     popularity: int
 
 
-@dataclass
+@dataclass(slots=True)
 class Coin:
     """Dataclass for holding Coin data"""
 
@@ -142,9 +143,43 @@ class CoinsSchema(fields.Dict):
         """Serializes data"""
         return self.serialize("", obj, accessor=self._get_obj)
 
-    def load(self, data: dict[Address, Any]):
+    def load(self, data: dict[str, Any]):
         """Loads data into mapping"""
         try:
             return self.deserialize(data)
         except ValidationError as e:
             return e.valid_data
+
+
+class LazyCoins(Mapping[Address, Coin]):
+    """
+    Read-only mapping of address to Coin built from raw Coin Paprika entries
+    (keyed by lower case address). Entries are only validated and turned into Coin
+    instances once they are looked up; entries failing validation are treated as
+    missing.
+    """
+
+    def __init__(self, entries: Mapping[str, dict[str, Any]]):
+        self._entries = entries
+        self._coins: dict[str, Coin | None] = {}
+        self._schema = CoinSchema()
+
+    def __getitem__(self, address: Address) -> Coin:
+        key = address.address
+        if key not in self._coins:
+            coin = self._schema.load(self._entries[key])
+            self._coins[key] = coin if isinstance(coin, Coin) else None
+        coin = self._coins[key]
+        if coin is None:
+            raise KeyError(address)
+        return coin
+
+    def __iter__(self) -> Iterator[Address]:
+        for key in self._entries:
+            try:
+                yield Address(key)
+            except ValueError:
+                continue
+
+    def __len__(self) -> int:
+        return len(self._entries)
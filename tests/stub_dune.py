@@ -0,0 +1,193 @@
+"""Stand-in for the Dune API (executions, status polling and paged results)."""
+
+import csv
+import io
+import json
+import re
+from datetime import datetime, timezone
+from typing import Any, Optional
+from urllib.parse import parse_qs, urlsplit
+
+from dune_client.client import DuneClient
+
+from tests.stub_http import Response, StubServer, json_response
+
+NOW = datetime(2024, 1, 1, tzinfo=timezone.utc).isoformat()
+
+
+class StubDune(StubServer):
+    """
+    Serves the rows of `results` (by query id) as executions which complete after
+    `polls` status requests. Pages hold at most `page_size` rows. Every API call is
+    recorded in `calls` as (method, route) with the API prefix stripped.
+    """
+
+    def __init__(
+        self,
+        results: dict[int, list[dict[str, Any]]],
+        polls: int = 2,
+        page_size: int = 1000,
+        failing: frozenset[int] = frozenset(),
+    ):
+        super().__init__()
+        self.results = results
+        self.polls = polls
+        self.page_size = page_size
+        self.failing = failing
+        # End time of the latest result of saved queries (None if never executed)
+        self.latest_ended_at: Optional[str] = NOW
+        self.calls: list[tuple[str, str]] = []
+        # Parameters of every execution, by execution id
+        self.executions: dict[str, tuple[int, dict[str, Any]]] = {}
+        self.status_polls: dict[str, int] = {}
+
+    def client(self) -> DuneClient:
+        """Official client pointed at this stub"""
+        return DuneClient("test-key", base_url=self.url)
+
+    def execution_count(self, query_id: int) -> int:
+        return sum(1 for q, _ in self.executions.values() if q == query_id)
+
+    def respond(
+        self, method: str, path: str, headers: dict[str, str], body: bytes
+    ) -> Response:
+        url = urlsplit(path)
+        route = url.path.removeprefix("/api/v1")
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+        with self.lock:
+            self.calls.append((method, route))
+        if match := re.fullmatch(r"/query/(\d+)/execute", route):
+            return self._execute(int(match[1]), json.loads(body or b"{}"))
+        if match := re.fullmatch(r"/execution/([\w-]+)/status", route):
+            return self._status(match[1])
+        if match := re.fullmatch(r"/execution/([\w-]+)/results(/csv)?", route):
+            return self._results(match[1], params, csv_format=bool(match[2]))
+        if match := re.fullmatch(r"/query/(\d+)/results", route):
+            return self._latest(int(match[1]), params)
+        return json_response({"error": f"no route {route}"}, status=404)
+
+    def _execute(self, query_id: int, body: dict[str, Any]) -> Response:
+        with self.lock:
+            execution_id = f"{query_id}-{len(self.executions)}"
+            self.executions[execution_id] = (query_id, body.get("query_parameters"))
+            self.status_polls[execution_id] = 0
+        return json_response(
+            {"execution_id": execution_id, "state": "QUERY_STATE_PENDING"}
+        )
+
+    def _state(self, execution_id: str) -> str:
+        query_id, _ = self.executions[execution_id]
+        if self.status_polls[execution_id] < self.polls:
+            return "QUERY_STATE_EXECUTING"
+        if query_id in self.failing:
+            return "QUERY_STATE_FAILED"
+        return "QUERY_STATE_COMPLETED"
+
+    def _status(self, execution_id: str) -> Response:
+        with self.lock:
+            self.status_polls[execution_id] += 1
+            state = self._state(execution_id)
+        body: dict[str, Any] = {
+            "execution_id": execution_id,
+            "query_id": self.executions[execution_id][0],
+            "state": state,
+            "submitted_at": NOW,
+        }
+        if state == "QUERY_STATE_FAILED":
+            body["error"] = {"type": "stub", "message": "execution failed"}
+        if state == "QUERY_STATE_COMPLETED":
+            body["result_metadata"] = self._metadata(execution_id)
+        return json_response(body)
+
+    def _metadata(self, execution_id: str) -> dict[str, Any]:
+        rows = self.results[self.executions[execution_id][0]]
+        columns = list(rows[0]) if rows else []
+        return {
+            "column_names": columns,
+            "column_types": [_column_type(rows[0][c]) for c in columns],
+            "row_count": len(rows),
+            "total_row_count": len(rows),
+            "result_set_bytes": len(json.dumps(rows)),
+            "datapoint_count": len(rows) * len(columns),
+            "pending_time_millis": 0,
+            "execution_time_millis": 10,
+        }
+
+    def _page(
+        self, execution_id: str, params: dict[str, str]
+    ) -> tuple[list[dict[str, Any]], Optional[int]]:
+        rows = self.results[self.executions[execution_id][0]]
+        offset = int(params.get("offset", 0))
+        limit = min(int(params.get("limit", self.page_size)), self.page_size)
+        end = offset + limit
+        next_offset = end if end < len(rows) else None
+        return rows[offset:end], next_offset
+
+    def _next_uri(self, execution_id: str, suffix: str, next_offset: int) -> str:
+        return (
+            f"{self.url}/api/v1/execution/{execution_id}/results{suffix}"
+            f"?offset={next_offset}&limit={self.page_size}"
+        )
+
+    def _results(
+        self, execution_id: str, params: dict[str, str], csv_format: bool
+    ) -> Response:
+        rows, next_offset = self._page(execution_id, params)
+        if csv_format:
+            return self._csv_results(execution_id, rows, next_offset)
+        body: dict[str, Any] = {
+            "execution_id": execution_id,
+            "query_id": self.executions[execution_id][0],
+            "state": "QUERY_STATE_COMPLETED",
+            "submitted_at": NOW,
+            "execution_ended_at": (
+                self.latest_ended_at if execution_id.endswith("-latest") else NOW
+            ),
+            "result": {"rows": rows, "metadata": self._metadata(execution_id)},
+        }
+        if next_offset is not None:
+            body["next_offset"] = next_offset
+            body["next_uri"] = self._next_uri(execution_id, "", next_offset)
+        return json_response(body)
+
+    def _csv_results(
+        self,
+        execution_id: str,
+        rows: list[dict[str, Any]],
+        next_offset: Optional[int],
+    ) -> Response:
+        all_rows = self.results[self.executions[execution_id][0]]
+        out = io.StringIO()
+        writer = csv.DictWriter(out, fieldnames=list(all_rows[0]) if all_rows else [])
+        writer.writeheader()
+        writer.writerows(rows)
+        headers = {"Content-Type": "text/csv"}
+        if next_offset is not None:
+            headers["x-dune-next-offset"] = str(next_offset)
+            headers["x-dune-next-uri"] = self._next_uri(
+                execution_id, "/csv", next_offset
+            )
+        return 200, headers, out.getvalue().encode()
+
+    def _latest(self, query_id: int, params: dict[str, str]) -> Response:
+        """Latest result of a saved query: served as a (completed) execution"""
+        if self.latest_ended_at is None:
+            return json_response(
+                {"error": f"No execution found for query {query_id}"}, status=404
+            )
+        with self.lock:
+            execution_id = f"{query_id}-latest"
+            if execution_id not in self.executions:
+                self.executions[execution_id] = (query_id, {})
+                self.status_polls[execution_id] = self.polls
+        return self._results(execution_id, params, csv_format=False)
+
+
+def _column_type(value: Any) -> str:
+    if isinstance(value, bool):
+        return "boolean"
+    if isinstance(value, int):
+        return "bigint"
+    if isinstance(value, float):
+        return "double"
+    return "varchar"
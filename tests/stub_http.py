@@ -0,0 +1,74 @@
+"""Minimal threaded HTTP server for standing in for upstream APIs in tests."""
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any
+
+Response = tuple[int, dict[str, str], bytes]
+
+
+def json_response(body: Any, status: int = 200) -> Response:
+    return status, {"Content-Type": "application/json"}, json.dumps(body).encode()
+
+
+class StubServer:
+    """
+    Serves every request through `respond` (to be overridden) on a local port
+    and counts the HTTP round trips made against it.
+    """
+
+    def __init__(self):
+        self.http_requests = 0
+        stub = self
+
+        class _Handler(BaseHTTPRequestHandler):
+            def _handle(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length)
+                with stub.lock:
+                    stub.http_requests += 1
+                status, headers, payload = stub.respond(
+                    self.command, self.path, dict(self.headers), body
+                )
+                self.send_response(status)
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            do_GET = _handle
+            do_POST = _handle
+
+            def log_message(self, *_args):
+                pass
+
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        self.thread = threading.Thread(
+            target=self.server.serve_forever, args=(0.01,), daemon=True
+        )
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_port}"
+
+    def respond(
+        self, method: str, path: str, headers: dict[str, str], body: bytes
+    ) -> Response:
+        raise NotImplementedError
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *_args) -> None:
+        self.stop()
@@ -0,0 +1,120 @@
+"""
+In-process stand-in for the legacy Dune service (as used through duneapi.DuneAPI).
+
+Importing duneapi configures logging from ./logging.conf, so this module imports
+it from a temporary directory holding a minimal configuration.
+"""
+
+import os
+import tempfile
+import threading
+from typing import Any, Callable
+
+LOGGING_CONF = """
+[loggers]
+keys=root
+
+[handlers]
+keys=
+
+[formatters]
+keys=
+
+[logger_root]
+handlers=
+"""
+
+
+def import_duneapi() -> None:
+    """Imports duneapi (once) without a logging.conf in the working directory"""
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        with open(os.path.join(tmp, "logging.conf"), "w", encoding="utf-8") as file:
+            file.write(LOGGING_CONF)
+        os.chdir(tmp)
+        try:
+            # pylint:disable=import-outside-toplevel,unused-import
+            import duneapi.api
+        finally:
+            os.chdir(cwd)
+
+
+import_duneapi()
+
+# Rows returned by an execution with the given parameter values (by key)
+RowsHandler = Callable[[dict[str, Any]], list[dict[str, str]]]
+
+
+class StubLegacyDune:
+    """
+    Records uploads, logins and executions of all clients made by `client`.
+    The first `failures` executions raise (like an expired session does).
+    """
+
+    def __init__(self, rows: RowsHandler, failures: int = 0):
+        self.rows = rows
+        self.failures = failures
+        self.lock = threading.Lock()
+        self.uploads: list[Any] = []
+        self.logins = 0
+        # (client, parameter values) of every execution
+        self.executions: list[tuple[int, dict[str, Any]]] = []
+
+    def client(self) -> "StubLegacyClient":
+        """New client of this service (with DuneAPI's constructor)"""
+        bound = type("BoundStubLegacyClient", (StubLegacyClient,), {"service": self})
+        client: StubLegacyClient = bound("user", "password")
+        return client
+
+    def clients(self) -> set[int]:
+        """(Ids of) the clients which executed queries"""
+        return {client for client, _ in self.executions}
+
+
+class StubLegacyClient:
+    """Client of a StubLegacyDune: a DuneAPI which must not be shared by threads"""
+
+    service: StubLegacyDune
+
+    def __init__(
+        self,
+        username: str,
+        password: str,
+        max_retries: int = 2,
+        ping_frequency: int = 5,
+    ):
+        self.username = username
+        self.password = password
+        self.max_retries = max_retries
+        self.ping_frequency = ping_frequency
+        self._busy = threading.Lock()
+
+    def login(self) -> None:
+        with self.service.lock:
+            self.service.logins += 1
+
+    def refresh_auth_token(self) -> None:
+        pass
+
+    def initiate_query(self, query: Any) -> bool:
+        with self.service.lock:
+            self.service.uploads.append(query)
+        return True
+
+    def execute_and_await_results(self, query: Any) -> list[dict[str, str]]:
+        if not self._busy.acquire(blocking=False):
+            raise AssertionError("client used by several threads at once")
+        try:
+            values = {p.key: p.value for p in query.parameters}
+            with self.service.lock:
+                self.service.executions.append((id(self), values))
+                if self.service.failures > 0:
+                    self.service.failures -= 1
+                    raise RuntimeError("session expired")
+            return self.service.rows(values)
+        finally:
+            self._busy.release()
+
+    def fetch(self, query: Any) -> list[dict[str, str]]:
+        self.initiate_query(query)
+        return self.execute_and_await_results(query)
@@ -0,0 +1,95 @@
+"""
+Local stand-in for an Ethereum JSON-RPC node serving canned eth_call results.
+Counts the HTTP round trips made against it.
+"""
+
+import json
+from typing import Any, Callable, Optional
+
+from eth_abi import decode, encode
+from eth_utils import function_signature_to_4byte_selector
+
+from src.multicall import MULTICALL3_ADDRESS, TRY_AGGREGATE_SELECTOR
+from tests.stub_http import Response, StubServer, json_response
+
+# Maps (lower case target, calldata) -> return data or None for a revert.
+CallHandler = Callable[[str, bytes], Optional[bytes]]
+
+TEXT_SELECTOR = function_signature_to_4byte_selector("text(bytes32,string)")
+
+
+def text_records(_target: str, data: bytes) -> Optional[bytes]:
+    """
+    ENS resolver: `<key>:<last 4 hex digits of node>`, reverting on avatar and
+    returning bytes which are not UTF-8 for invalid
+    """
+    assert data[:4] == TEXT_SELECTOR
+    node, key = decode(["bytes32", "string"], data[4:])
+    if key == "avatar":
+        return None
+    if key == "invalid":
+        return encode(["bytes"], [b"\xff"])
+    return encode(["string"], [f"{key}:{node.hex()[-4:]}"])
+
+
+class StubRpc(StubServer):
+    """
+    JSON-RPC server (of chain 1) answering (batches of) eth_call via `handler`.
+    With `error` every request fails with that JSON-RPC error instead (batches
+    with a single error object, as providers do when rate limiting).
+    """
+
+    def __init__(
+        self,
+        handler: CallHandler,
+        multicall_deployed: bool = True,
+        error: Optional[dict[str, Any]] = None,
+    ):
+        super().__init__()
+        self.handler = handler
+        self.multicall_deployed = multicall_deployed
+        self.error = error
+        self.eth_calls = 0
+
+    def respond(
+        self, method: str, path: str, headers: dict[str, str], body: bytes
+    ) -> Response:
+        request = json.loads(body)
+        if self.error:
+            request_id = None if isinstance(request, list) else request["id"]
+            return json_response(
+                {"jsonrpc": "2.0", "id": request_id, "error": self.error}
+            )
+        if isinstance(request, list):
+            return json_response([self.answer(req) for req in request])
+        return json_response(self.answer(request))
+
+    def answer(self, request: dict[str, Any]) -> dict[str, Any]:
+        """Answers a single JSON-RPC eth_call (or eth_chainId) request"""
+        if request["method"] == "eth_chainId":
+            return {"jsonrpc": "2.0", "id": request["id"], "result": "0x1"}
+        assert request["method"] == "eth_call"
+        target = request["params"][0]["to"].lower()
+        data = bytes.fromhex(request["params"][0]["data"][2:])
+        reply = {"jsonrpc": "2.0", "id": request["id"]}
+        if target == MULTICALL3_ADDRESS.lower():
+            if not self.multicall_deployed:
+                return reply | {"result": "0x"}
+            assert data[:4] == TRY_AGGREGATE_SELECTOR
+            _, calls = decode(["bool", "(address,bytes)[]"], data[4:])
+            results = []
+            for call_target, call_data in calls:
+                result = self.call(call_target.lower(), call_data)
+                results.append((result is not None, result or b""))
+            return reply | {
+                "result": "0x" + encode(["(bool,bytes)[]"], [results]).hex()
+            }
+        result = self.call(target, data)
+        if result is None:
+            return reply | {"error": {"code": 3, "message": "execution reverted"}}
+        return reply | {"result": "0x" + result.hex()}
+
+    def call(self, target: str, data: bytes) -> Optional[bytes]:
+        with self.lock:
+            self.eth_calls += 1
+        return self.handler(target, data)
@@ -0,0 +1,96 @@
+"""Local stand in for the ENS subgraph, serving `domains` pages from a fixed list."""
+
+import json
+import re
+
+from tests.stub_http import StubServer, json_response
+
+LATEST_BLOCK = 17_000_000
+
+
+def domain(i: int, wallet: str) -> dict:
+    """Domain `i` resolving to `wallet` (without a resolver)"""
+    return {
+        "id": f"0x{i:064x}",
+        "name": f"name{i}.eth",
+        "resolvedAddress": {"id": wallet},
+        "resolver": None,
+    }
+
+
+def matches(rec: dict, key: str, values: set) -> bool:
+    """Whether `rec` satisfies the `<key>: [values]` filter"""
+    if key == "id_in":
+        return rec["id"] in values
+    return rec["resolvedAddress"] is not None and rec["resolvedAddress"]["id"] in values
+
+
+class StubEnsSubgraph(StubServer):
+    """
+    Answers `_meta`, `textChangeds` and (possibly aliased) `domains` queries, as
+    built by ens_data, from `domains` (which changed at block `_changed`, if set)
+    and `text_changes`. Records the block, cursor and `_change_block` filter of every
+    domains field and the number of fields in each request.
+    """
+
+    def __init__(self, domains, text_changes=()):
+        super().__init__()
+        self.domains = sorted(domains, key=lambda d: d["id"])
+        self.text_changes = list(text_changes)
+        self.latest_block = LATEST_BLOCK
+        self.blocks = []
+        self.cursors = []
+        self.changed_since = []
+        self.batch_sizes = []
+        self.fail_batches_over = None
+
+    def _page(self, query: str) -> list:
+        first = int(re.search(r"first: (\d+)", query).group(1))
+        key, values = re.search(r"(\w+_in): (\[.*?\])", query).groups()
+        values = set(json.loads(values))
+        last_id = json.loads(re.search(r"id_gt: (\".*?\")", query).group(1))
+        block = re.search(r"block: {number: (\d+)}", query)
+        since = re.search(r"_change_block: {number_gte: (\d+)}", query)
+        since = int(since.group(1)) if since else 0
+        with self.lock:
+            self.blocks.append(int(block.group(1)) if block else None)
+            self.cursors.append(last_id)
+            self.changed_since.append(since)
+        page = [
+            {k: v for k, v in d.items() if k != "_changed"}
+            for d in self.domains
+            if matches(d, key, values)
+            and d["id"] > last_id
+            and d.get("_changed", 0) >= since
+        ]
+        return page[:first]
+
+    def _text_changes(self, query: str) -> list:
+        resolvers = set(
+            json.loads(re.search(r"resolver_in: (\[.*?\])", query).group(1))
+        )
+        since = int(re.search(r"blockNumber_gte: (\d+)", query).group(1))
+        return [
+            {"id": event["id"], "resolver": event["resolver"]}
+            for event in self.text_changes
+            if event["resolver"]["id"] in resolvers and event["blockNumber"] >= since
+        ]
+
+    def respond(self, method, path, headers, body):
+        query = json.loads(body)["query"]
+        if "_meta" in query:
+            return json_response(
+                {"data": {"_meta": {"block": {"number": self.latest_block}}}}
+            )
+        if "textChangeds" in query:
+            events = self._text_changes(query)
+            return json_response({"data": {"textChangeds": events}})
+        # Splits into [prefix, alias, field, alias, field, ...]
+        parts = re.split(r"(?:(\w+): )?domains\(", query)
+        fields = list(zip(parts[1::2], parts[2::2]))
+        with self.lock:
+            self.batch_sizes.append(len(fields))
+        if self.fail_batches_over and len(fields) > self.fail_batches_over:
+            return json_response({}, status=413)
+        data = {alias or "domains": self._page(field) for alias, field in fields}
+        return json_response({"data": data})
@@ -0,0 +1,40 @@
+import unittest
+
+from src.address import Address
+
+USDC = "0xA0b86991c6218b36c1d19D4a2e9Eb0cE3606eB48"
+
+
+class TestAddress(unittest.TestCase):
+    def test_interning(self):
+        address = Address(USDC)
+        self.assertIs(Address(USDC.lower()), address)
+        self.assertIs(Address("\\x" + USDC[2:].lower()), address)
+        self.assertIs(Address(bytes.fromhex(USDC[2:])), address)
+        self.assertIs(Address(address), address)
+
+    def test_representations(self):
+        address = Address(USDC)
+        self.assertEqual(address.address, USDC.lower())
+        self.assertEqual(str(address), USDC.lower())
+        self.assertEqual(address.checksum, USDC)
+        self.assertEqual(address.raw, bytes.fromhex(USDC[2:]))
+        self.assertFalse(hasattr(address, "__dict__"))
+
+    def test_ordering_and_equality(self):
+        self.assertLess(Address.zero(), Address.from_int(1))
+        self.assertEqual(
+            sorted([Address.from_int(3), Address.from_int(1)]),
+            [Address.from_int(1), Address.from_int(3)],
+        )
+        self.assertNotEqual(Address.zero(), str(Address.zero()))
+        self.assertEqual(len({Address(USDC), Address(USDC.lower())}), 1)
+
+    def test_invalid(self):
+        for invalid in ["0x123", USDC + "0", "0x" + "g" * 40, b"\x00" * 19]:
+            with self.assertRaises(ValueError):
+                Address(invalid)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,65 @@
+import os
+import tempfile
+import unittest
+
+from src.address import Address
+from src.address_index import AddressIndex
+from src.utils import LazyCoins
+
+
+class TestAddressIndex(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "coins.idx")
+        self.entries = {
+            str(Address.from_int(i)): {
+                "id": f"coin-{i}",
+                "name": f"Coin {i}",
+                "symbol": f"C{i}",
+                "rank": i,
+                "is_new": False,
+                "is_active": True,
+                "type": "token",
+                "address": str(Address.from_int(i)),
+            }
+            for i in range(1000, 0, -7)
+        }
+        AddressIndex.build(self.path, self.entries | {"0xnot-an-address": {}})
+
+    def tearDown(self) -> None:
+        self.tmp.cleanup()
+
+    def test_lookup(self):
+        index = AddressIndex(self.path)
+        self.assertEqual(len(index), len(self.entries))
+        self.assertEqual(dict(index), self.entries)
+        self.assertEqual(list(index), sorted(self.entries))
+        for address, entry in self.entries.items():
+            self.assertIn(address, index)
+            self.assertEqual(index[address], entry)
+        self.assertNotIn(str(Address.from_int(2)), index)
+        self.assertNotIn(str(Address.zero()), index)
+        self.assertNotIn("0xnot-an-address", index)
+        with self.assertRaises(KeyError):
+            _ = index[str(Address.from_int(2000))]
+        index.close()
+
+    def test_empty_index(self):
+        AddressIndex.build(self.path, {})
+        index = AddressIndex(self.path)
+        self.assertEqual(len(index), 0)
+        self.assertNotIn(str(Address.zero()), index)
+        index.close()
+
+    def test_lazy_coins_from_index(self):
+        index = AddressIndex(self.path)
+        coins = LazyCoins(index)
+        coin = coins[Address.from_int(1000)]
+        self.assertEqual((coin.id, coin.address), ("coin-1000", Address.from_int(1000)))
+        self.assertIsNone(coins.get(Address.from_int(2)))
+        self.assertEqual(len(coins), len(self.entries))
+        index.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,92 @@
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+
+from src.clients import http_session, registered, reset_clients
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Modules whose import must neither read the environment nor ./logging.conf
+SCRIPT_MODULES = [
+    "src.clients",
+    "src.cip3_eth_spent",
+    "src.orderbook",
+    "src.retention.get_relevant_ens",
+]
+
+
+class TestClientRegistry(unittest.TestCase):
+    def tearDown(self) -> None:
+        reset_clients()
+
+    def test_clients_are_shared(self):
+        self.assertIs(http_session("a"), http_session("a"))
+        self.assertIsNot(http_session("a"), http_session("b"))
+
+        session = http_session("a")
+        reset_clients()
+        self.assertIsNot(http_session("a"), session)
+
+    def test_created_once_across_threads(self):
+        created = []
+
+        @registered
+        def client() -> object:
+            created.append(1)
+            return object()
+
+        threads = [threading.Thread(target=client) for _ in range(16)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(created), 1)
+
+    def test_slow_creation_only_blocks_its_callers(self):
+        started, proceed = threading.Event(), threading.Event()
+
+        @registered
+        def slow_client() -> object:
+            started.set()
+            proceed.wait(timeout=5)
+            return object()
+
+        clients = []
+        threads = [
+            threading.Thread(target=lambda: clients.append(slow_client()))
+            for _ in range(2)
+        ]
+        threads[0].start()
+        self.assertTrue(started.wait(timeout=5))
+        threads[1].start()
+        # Other clients are created while slow_client is, ...
+        self.assertIs(http_session("a"), http_session("a"))
+        # ... while callers of slow_client wait for it.
+        threads[1].join(timeout=0.1)
+        self.assertTrue(threads[1].is_alive())
+
+        proceed.set()
+        for thread in threads:
+            thread.join()
+        self.assertIs(clients[0], clients[1])
+
+    def test_import_has_no_side_effects(self):
+        # Another working directory (without logging.conf or .env), no credentials
+        env = {"PATH": os.environ.get("PATH", ""), "PYTHONPATH": PROJECT_ROOT}
+        with tempfile.TemporaryDirectory() as tmp:
+            for module in SCRIPT_MODULES:
+                process = subprocess.run(
+                    [sys.executable, "-c", f"import {module}"],
+                    cwd=tmp,
+                    env=env,
+                    capture_output=True,
+                    text=True,
+                    check=False,
+                )
+                self.assertEqual(process.returncode, 0, f"{module}: {process.stderr}")
+
+
+if __name__ == "__main__":
+    unittest.main()
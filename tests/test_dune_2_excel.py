@@ -0,0 +1,171 @@
+import os
+import re
+import tempfile
+import unittest
+import zipfile
+from datetime import datetime
+from pathlib import Path
+from unittest import mock
+
+import pandas as pd
+from dune_client.models import QueryFailedError
+from xlsxwriter import Workbook
+
+from src.dune_2_excel import fetch_results, frame_rows, store_results, write_sheets
+from src.dune_cache import ResultCache, frame_records
+from src.dune_executor import DuneExecutor
+from tests.stub_dune import StubDune
+
+RESULTS = {
+    101: [{"day": f"2024-01-{d:02d}", "volume": d * 1.5} for d in range(1, 26)],
+    102: [{"token": "0xabc", "trades": 7}],
+    103: [{"solver": f"s{i}", "batches": i} for i in range(12)],
+}
+
+
+class TestFetchResults(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self) -> None:
+        self.tmp.cleanup()
+
+    def executor(self, stub: StubDune) -> DuneExecutor:
+        return DuneExecutor(
+            stub.client(),
+            os.path.join(self.tmp.name, "executor.sqlite"),
+            min_delay=0.01,
+        )
+
+    def fetch(self, stub: StubDune, queries: list[str], cache=None, page_size=10):
+        """Fetched results (with all pages read) by query id"""
+        results = fetch_results(
+            queries,
+            datetime(2024, 1, 1),
+            cache=cache,
+            page_size=page_size,
+            executor=self.executor(stub),
+        )
+        return {
+            query_id: pd.concat(list(pages), ignore_index=True)
+            for query_id, pages in results.items()
+        }
+
+    def test_submits_all_before_polling(self):
+        with StubDune(RESULTS, polls=3) as stub:
+            results = self.fetch(stub, ["101", "102", "103"])
+
+        self.assertEqual(list(results), [101, 102, 103])
+        for query_id, frame in results.items():
+            self.assertEqual(frame_records(frame), RESULTS[query_id])
+        executes = [i for i, (method, _) in enumerate(stub.calls) if method == "POST"]
+        self.assertEqual(executes, [0, 1, 2])
+        for _, params in stub.executions.values():
+            self.assertEqual(params, {"StartTime": "2024-01-01 00:00:00"})
+
+    def test_cached_results_are_not_executed(self):
+        with tempfile.TemporaryDirectory() as tmp, StubDune(RESULTS, polls=1) as stub:
+            cache = ResultCache(tmp)
+            self.fetch(stub, ["101", "102"], cache)
+            results = self.fetch(stub, ["103", "101", "102"], cache)
+
+        self.assertEqual(list(results), [103, 101, 102])
+        self.assertEqual(frame_records(results[101]), RESULTS[101])
+        self.assertEqual([stub.execution_count(q) for q in RESULTS], [1, 1, 1])
+
+    def test_failed_execution_raises(self):
+        with StubDune(RESULTS, polls=1, failing=frozenset({102})) as stub:
+            with self.assertRaises(QueryFailedError):
+                self.fetch(stub, ["101", "102"])
+
+    def test_pages_are_streamed_into_workbook(self):
+        with tempfile.TemporaryDirectory() as tmp, StubDune(RESULTS) as stub:
+            os.mkdir(os.path.join(tmp, "out"))
+            results = fetch_results(
+                ["101", "103"],
+                datetime(2024, 1, 1),
+                page_size=4,
+                executor=self.executor(stub),
+            )
+            downloads = len(stub.calls)
+            with mock.patch("src.dune_2_excel.PROJECT_ROOT", Path(tmp)):
+                store_results(results, datetime(2024, 1, 1))
+            sheets = read_sheets(os.path.join(tmp, "out", "101_103_2024-01-01.xlsx"))
+
+        pages = [route for _, route in stub.calls[downloads:]]
+        self.assertEqual(len(pages), 7 + 3)
+        self.assertTrue(all(route.endswith("/results/csv") for route in pages))
+        self.assertEqual(len(sheets["101"]), 26)
+        self.assertEqual(sheets["103"][1], [("inlineStr", "s0"), ("n", "0")])
+
+
+def read_sheets(path: str) -> dict[str, list[list[tuple[str, str]]]]:
+    """(cell type, value) of every cell of every worksheet, by sheet name"""
+    with zipfile.ZipFile(path) as xlsx:
+        names = re.findall(
+            r'<sheet name="([^"]+)"', xlsx.read("xl/workbook.xml").decode()
+        )
+        sheets = {}
+        for i, name in enumerate(names, start=1):
+            xml = xlsx.read(f"xl/worksheets/sheet{i}.xml").decode()
+            sheets[name] = [
+                [
+                    (cell_type or "n", value)
+                    for cell_type, value in re.findall(
+                        r'<c r="\w+"(?: s="\d+")?(?: t="(\w+)")?>(?:<is>)?<[tv]>([^<]*)<',
+                        row,
+                    )
+                ]
+                for row in re.findall(r"<row [^>]*>(.*?)</row>", xml)
+            ]
+        return sheets
+
+
+class TestWriteSheets(unittest.TestCase):
+    def write(self, rows, max_rows=4):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "report.xlsx")
+            with Workbook(path, {"constant_memory": True}) as workbook:
+                count = write_sheets(
+                    workbook, "101", ["day", "volume"], iter(rows), max_rows
+                )
+            return count, read_sheets(path)
+
+    def test_rolls_over_full_sheets(self):
+        rows = [(f"2024-01-{d:02d}", d) for d in range(1, 11)]
+        count, sheets = self.write(rows)
+
+        self.assertEqual(count, 4)
+        self.assertEqual(list(sheets), ["101", "101_2", "101_3", "101_4"])
+        header = [("inlineStr", "day"), ("inlineStr", "volume")]
+        for sheet in sheets.values():
+            self.assertEqual(sheet[0], header)
+        self.assertEqual([len(s) - 1 for s in sheets.values()], [3, 3, 3, 1])
+        data = [row for sheet in sheets.values() for row in sheet[1:]]
+        self.assertEqual(
+            data, [[("inlineStr", day), ("n", str(volume))] for day, volume in rows]
+        )
+
+    def test_keeps_value_types(self):
+        frame = pd.DataFrame(
+            {"day": [None, "x", "y"], "volume": [1.5, None, 2], "paid": [1, 2, 3]}
+        )
+        self.assertEqual(
+            list(frame_rows(frame, chunk_size=2)),
+            [(None, 1.5, 1), ("x", None, 2), ("y", 2.0, 3)],
+        )
+        _, sheets = self.write([(None, 1.5), ("x", True)])
+        self.assertEqual(
+            sheets["101"][1:],
+            [[("n", "1.5")], [("inlineStr", "x"), ("b", "1")]],
+        )
+
+    def test_empty_result_has_header(self):
+        count, sheets = self.write([])
+        self.assertEqual(count, 1)
+        self.assertEqual(list(sheets), ["101"])
+        self.assertEqual(len(sheets["101"]), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,144 @@
+import os
+import tempfile
+import time
+import unittest
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+
+import pandas as pd
+from dune_client.query import QueryBase
+from dune_client.types import QueryParameter
+
+from src.dune_cache import (
+    ResultCache,
+    fetch_query_results,
+    frame_records,
+    result_key,
+)
+from src.dune_executor import DuneExecutor
+from tests.stub_dune import StubDune
+
+ROWS = [
+    {"token": "0x01", "decimals": 18, "price": 1.5, "listed": True},
+    {"token": "0x02", "decimals": None, "price": None, "listed": False},
+]
+QUERY = QueryBase(
+    query_id=7, params=[QueryParameter.text_type("Blockchain", "ethereum")]
+)
+
+
+class TestResultCache(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache = ResultCache(self.tmp.name, max_age=timedelta(hours=1))
+
+    def tearDown(self) -> None:
+        self.tmp.cleanup()
+
+    def test_key_ignores_parameter_order(self):
+        self.assertEqual(
+            result_key(1, {"a": 1, "b": "x"}), result_key(1, {"b": "x", "a": 1})
+        )
+        self.assertNotEqual(result_key(1, {"a": 1}), result_key(1, {"a": 2}))
+        self.assertNotEqual(result_key(1, {}), result_key("1", {}))
+
+    def test_round_trip_keeps_columns(self):
+        frame = pd.DataFrame.from_records(ROWS)
+        self.cache.put("select 1", {}, frame)
+
+        cached = self.cache.get("select 1", {})
+        pd.testing.assert_frame_equal(cached, frame)
+        self.assertEqual(
+            frame_records(cached), ROWS[:1] + [ROWS[1] | {"decimals": None}]
+        )
+        self.assertIsNone(self.cache.get("select 1", {"other": 1}))
+
+    def test_expired_results_are_reloaded(self):
+        loads = []
+
+        def load():
+            loads.append(1)
+            return pd.DataFrame({"x": [len(loads)]})
+
+        self.cache.fetch(1, {}, load)
+        self.assertEqual(self.cache.fetch(1, {}, load)["x"].tolist(), [1])
+        with mock.patch("time.time", return_value=time.time() + 2 * 3600):
+            self.assertEqual(self.cache.fetch(1, {}, load)["x"].tolist(), [2])
+        self.assertEqual(len(loads), 2)
+
+    def test_pages_are_stored_once_consumed(self):
+        frame = pd.DataFrame.from_records(ROWS * 3)
+        pages = self.cache.put_pages(1, {}, (frame[i : i + 2] for i in range(0, 6, 2)))
+        next(pages)
+        self.assertIsNone(self.cache.pages(1, {}, page_size=4))
+        list(pages)
+
+        cached = list(self.cache.pages(1, {}, page_size=4))
+        self.assertEqual([len(page) for page in cached], [4, 2])
+        pd.testing.assert_frame_equal(pd.concat(cached, ignore_index=True), frame)
+
+        self.cache.put(2, {}, frame[:0])
+        (empty,) = self.cache.pages(2, {}, page_size=4)
+        self.assertEqual(list(empty.columns), list(frame.columns))
+
+    def test_mixed_columns_are_not_cached(self):
+        self.cache.put(1, {}, pd.DataFrame({"x": [1, "a"]}))
+        self.assertIsNone(self.cache.get(1, {}))
+        self.assertEqual(os.listdir(self.tmp.name), [])
+
+
+class TestFetchQueryResults(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self) -> None:
+        self.tmp.cleanup()
+
+    def executor(self, stub: StubDune) -> DuneExecutor:
+        return DuneExecutor(
+            stub.client(), os.path.join(self.tmp.name, "executor.sqlite"), min_delay=0
+        )
+
+    def test_without_cache_executes(self):
+        with StubDune({7: ROWS}, polls=0) as stub:
+            frame = fetch_query_results(self.executor(stub), QUERY)
+        self.assertEqual(frame_records(frame)[0], ROWS[0])
+        self.assertEqual(stub.execution_count(7), 1)
+        self.assertEqual(stub.executions["7-0"][1], {"Blockchain": "ethereum"})
+
+    def test_reuses_latest_and_cached_results(self):
+        cache = ResultCache(self.tmp.name, max_age=timedelta(hours=2))
+        with StubDune({7: ROWS}) as stub:
+            stub.latest_ended_at = datetime.now(timezone.utc).isoformat()
+            first = fetch_query_results(self.executor(stub), QUERY, cache)
+            calls = len(stub.calls)
+            second = fetch_query_results(self.executor(stub), QUERY, cache)
+
+        self.assertEqual(stub.execution_count(7), 1)  # the latest result only
+        self.assertIn("7-latest", stub.executions)
+        self.assertEqual(len(stub.calls), calls)
+        pd.testing.assert_frame_equal(first, second)
+        self.assertEqual(first["token"].tolist(), ["0x01", "0x02"])
+
+    def test_stale_latest_result_is_executed(self):
+        cache = ResultCache(self.tmp.name, max_age=timedelta(hours=2))
+        with StubDune({7: ROWS}, polls=1) as stub:
+            frame = fetch_query_results(self.executor(stub), QUERY, cache)
+
+        self.assertEqual(stub.execution_count(7), 2)  # the latest result and a new one
+        self.assertEqual(stub.executions["7-1"][1], {"Blockchain": "ethereum"})
+        self.assertEqual(frame_records(frame)[0], ROWS[0])
+
+    def test_missing_latest_result_is_executed(self):
+        cache = ResultCache(self.tmp.name, max_age=timedelta(hours=2))
+        with StubDune({7: ROWS}, polls=1) as stub:
+            stub.latest_ended_at = None
+            frame = fetch_query_results(self.executor(stub), QUERY, cache)
+
+        self.assertEqual(list(stub.executions), ["7-0"])
+        self.assertEqual(stub.executions["7-0"][1], {"Blockchain": "ethereum"})
+        self.assertEqual(frame_records(frame)[0], ROWS[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
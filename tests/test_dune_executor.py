@@ -0,0 +1,172 @@
+import os
+import tempfile
+import threading
+import unittest
+
+from dune_client.models import ExecutionState, QueryFailedError
+from dune_client.query import QueryBase
+from dune_client.types import QueryParameter
+
+from src.dune_executor import DuneExecutor
+from src.rate_limit import TokenBucket
+from tests.stub_dune import StubDune
+
+ROWS = [{"token": "0x01", "decimals": 18}]
+
+
+def query(blockchain: str = "ethereum") -> QueryBase:
+    return QueryBase(
+        query_id=7, params=[QueryParameter.text_type("Blockchain", blockchain)]
+    )
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class GatedLimiter(TokenBucket):
+    """Limiter holding every acquisition until `opened` (and failing if `fail`)"""
+
+    def __init__(self, fail: bool = False):
+        super().__init__(rate=1)
+        self.fail = fail
+        self.waiting = threading.Event()
+        self.opened = threading.Event()
+
+    def acquire(self, tokens: float = 1.0) -> float:
+        self.waiting.set()
+        assert self.opened.wait(timeout=5)
+        if self.fail:
+            raise RuntimeError("rate limited")
+        return 0.0
+
+
+class TestDuneExecutor(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "executor.sqlite")
+
+    def tearDown(self) -> None:
+        self.tmp.cleanup()
+
+    def executor(self, stub: StubDune, **kwargs) -> DuneExecutor:
+        kwargs.setdefault("min_delay", 0.01)
+        kwargs.setdefault("max_delay", 0.05)
+        return DuneExecutor(stub.client(), self.path, **kwargs)
+
+    def test_reports_states(self):
+        states = []
+        with StubDune({7: ROWS}, polls=2) as stub:
+            status = self.executor(stub).run(query(), states.append)
+
+        self.assertEqual(status.state, ExecutionState.COMPLETED)
+        self.assertEqual(states, [ExecutionState.EXECUTING, ExecutionState.COMPLETED])
+        self.assertEqual(status.result_metadata.column_names, list(ROWS[0]))
+
+    def test_failed_execution_raises(self):
+        with StubDune({7: ROWS}, polls=0, failing=frozenset({7})) as stub:
+            with self.assertRaises(QueryFailedError):
+                self.executor(stub).run(query())
+
+    def test_identical_executions_are_joined(self):
+        with StubDune({7: ROWS}) as stub:
+            # Executors sharing a state file, as in separate processes
+            first, second = self.executor(stub), self.executor(stub)
+            job_id = first.submit(query())
+            self.assertEqual(second.submit(query()), job_id)
+            self.assertNotEqual(second.submit(query("gnosis")), job_id)
+
+            second.await_execution(job_id)
+            self.assertNotEqual(first.submit(query()), job_id)
+
+        self.assertEqual(stub.execution_count(7), 3)
+
+    def test_state_is_not_locked_while_submitting(self):
+        limiter = GatedLimiter()
+        with StubDune({7: ROWS}) as stub:
+            first = self.executor(stub, limiter=limiter)
+            second = self.executor(stub)
+            results: dict[str, str] = {}
+
+            def submit(name, executor, blockchain):
+                results[name] = executor.submit(query(blockchain))
+
+            submitting = threading.Thread(
+                target=submit, args=("first", first, "ethereum")
+            )
+            submitting.start()
+            self.assertTrue(limiter.waiting.wait(timeout=5))
+            # Other queries are submitted while the first one awaits its token
+            other = threading.Thread(target=submit, args=("other", second, "gnosis"))
+            other.start()
+            other.join(timeout=5)
+            self.assertFalse(other.is_alive())
+            # ... and the same query waits for the first one's execution id
+            joining = threading.Thread(target=submit, args=("join", second, "ethereum"))
+            joining.start()
+            joining.join(timeout=0.2)
+            self.assertTrue(joining.is_alive())
+
+            limiter.opened.set()
+            submitting.join()
+            joining.join()
+
+        self.assertEqual(results["join"], results["first"])
+        self.assertEqual(stub.execution_count(7), 2)
+
+    def test_failed_submission_drops_its_claim(self):
+        limiter = GatedLimiter(fail=True)
+        limiter.opened.set()
+        with StubDune({7: ROWS}) as stub:
+            with self.assertRaises(RuntimeError):
+                self.executor(stub, limiter=limiter).submit(query())
+            job_id = self.executor(stub).submit(query())
+
+        self.assertEqual(list(stub.executions), [job_id])
+
+    def test_threads_share_status_requests(self):
+        with StubDune({7: ROWS}, polls=3) as stub:
+            executor = self.executor(stub)
+            job_id = executor.submit(query())
+            threads = [
+                threading.Thread(target=executor.await_execution, args=(job_id,))
+                for _ in range(8)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(stub.status_polls[job_id], 3)
+
+    def test_polling_is_tuned_by_runtimes(self):
+        clock = FakeClock()
+        with StubDune({7: ROWS}, polls=10) as stub:
+            executor = self.executor(
+                stub, min_delay=1, max_delay=30, clock=clock, sleep=clock.sleep
+            )
+            self.assertIsNone(executor.expected_runtime(7))
+            executor.run(query())
+            first = clock.sleeps
+            self.assertAlmostEqual(executor.expected_runtime(7), sum(first))
+
+            clock.sleeps = []
+            executor.run(query())
+
+        # Backing off from the minimum delay at first, from the usual runtime later
+        self.assertEqual(first[:5], [1] * 5)
+        self.assertGreater(first[-1], first[-2])
+        self.assertAlmostEqual(clock.sleeps[0], 0.2 * sum(first))
+
+
+if __name__ == "__main__":
+    unittest.main()
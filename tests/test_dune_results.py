@@ -0,0 +1,65 @@
+import unittest
+
+import pandas as pd
+from dune_client.query import QueryBase
+
+from src.dune_cache import frame_records
+from src.dune_results import execution_frame, execution_pages
+from tests.stub_dune import StubDune
+
+ROWS = [
+    {"token": "0x01", "symbol": "007", "decimals": 18, "price": 1.5, "listed": True},
+    {"token": "0xabc", "symbol": "B", "decimals": None, "price": 2.0, "listed": False},
+    {"token": "0x1e5", "symbol": "C", "decimals": 6, "price": None, "listed": True},
+]
+
+
+class TestExecutionFrame(unittest.TestCase):
+    def test_pages_are_read_into_typed_columns(self):
+        with StubDune({7: ROWS}, polls=0, page_size=2) as stub:
+            dune = stub.client()
+            job_id = dune.execute_query(QueryBase(7)).execution_id
+            status = dune.get_execution_status(job_id)
+            frame = execution_frame(dune, job_id, status.result_metadata)
+
+        self.assertEqual(
+            [c for _, c in stub.calls if c.endswith("/csv")],
+            ["/execution/7-0/results/csv"] * 2,
+        )
+        self.assertEqual(
+            frame.dtypes.astype(str).tolist(),
+            ["string", "string", "Int64", "float64", "boolean"],
+        )
+        self.assertEqual(frame_records(frame), ROWS)
+
+    def test_untyped_columns_are_inferred(self):
+        with StubDune({7: ROWS}, polls=0) as stub:
+            dune = stub.client()
+            job_id = dune.execute_query(QueryBase(7)).execution_id
+            frame = execution_frame(dune, job_id)
+
+        self.assertEqual(frame["token"].tolist(), ["0x01", "0xabc", "0x1e5"])
+        self.assertEqual(frame["symbol"].tolist(), ["007", "B", "C"])
+
+    def test_pages_are_fetched_lazily(self):
+        with StubDune({7: ROWS, 8: []}, polls=0) as stub:
+            dune = stub.client()
+            job_id = dune.execute_query(QueryBase(7)).execution_id
+            status = dune.get_execution_status(job_id)
+            pages = execution_pages(dune, job_id, status.result_metadata, page_size=1)
+            first = next(pages)
+            downloads = [c for _, c in stub.calls if c.endswith("/csv")]
+            rest = list(pages)
+            empty = list(
+                execution_pages(dune, dune.execute_query(QueryBase(8)).execution_id)
+            )
+
+        self.assertLessEqual(len(downloads), 2)
+        self.assertEqual([len(p) for p in [first] + rest], [1, 1, 1])
+        self.assertEqual(frame_records(pd.concat([first] + rest)), ROWS)
+        self.assertEqual(len(empty), 1)
+        self.assertTrue(empty[0].empty)
+
+
+if __name__ == "__main__":
+    unittest.main()
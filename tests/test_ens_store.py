@@ -0,0 +1,113 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from src.clients import reset_clients
+from src.subgraph import ens_data
+from src.subgraph.ens_store import EnsStore
+from tests.stub_rpc import StubRpc, text_records
+from tests.stub_subgraph import StubEnsSubgraph, domain
+
+RESOLVER = "0x" + "2" * 40
+ALICE, BOB, CAROL = ("0x" + c * 40 for c in "abc")
+
+
+def with_texts(rec, *texts):
+    return rec | {"resolver": {"address": RESOLVER, "texts": list(texts)}}
+
+
+def names_and_texts(names):
+    return [
+        (name, record["texts"]) for entry in names for name, record in entry.items()
+    ]
+
+
+class TestEnsStore(unittest.TestCase):
+    def setUp(self):
+        reset_clients()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "ens.sqlite")
+
+    def tearDown(self):
+        reset_clients()
+        self.tmp.cleanup()
+
+    def test_incremental_updates(self):
+        domains = [
+            with_texts(domain(0, ALICE), "url"),
+            with_texts(domain(1, ALICE), "avatar"),
+            domain(2, BOB),
+            with_texts(domain(3, CAROL), "url"),
+        ]
+        with StubEnsSubgraph(domains) as subgraph, StubRpc(
+            text_records
+        ) as rpc, mock.patch.object(
+            ens_data, "SUBGRAPH_URL", subgraph.url
+        ), mock.patch.object(
+            ens_data, "ETH_RPC", rpc.url
+        ):
+            store = EnsStore(self.path)
+            first = store.wallet_ens_data({ALICE, BOB}, block=100)
+            self.assertEqual(
+                names_and_texts(first[ALICE]), [("name0.eth", {"url": "url:0000"})]
+            )
+            self.assertEqual(rpc.eth_calls, 1)
+
+            # A new relevant text record on name1 only touches its resolver,
+            # while name2 moves from Bob to Alice (and gets a resolver).
+            domains[1]["resolver"]["texts"].append("com.twitter")
+            subgraph.text_changes.append(
+                {
+                    "id": "150-1",
+                    "resolver": {"id": f"{RESOLVER}-{domains[1]['id']}"},
+                    "blockNumber": 150,
+                }
+            )
+            domains[2].update(with_texts(domains[2], "url"), _changed=120)
+            domains[2]["resolvedAddress"] = {"id": ALICE}
+            subgraph.changed_since.clear()
+
+            second = store.wallet_ens_data({ALICE, BOB, CAROL}, block=200)
+            store.close()
+        self.assertEqual(
+            names_and_texts(second[ALICE]),
+            [
+                ("name0.eth", {"url": "url:0000"}),
+                ("name1.eth", {"com.twitter": "com.twitter:0001"}),
+                ("name2.eth", {"url": "url:0002"}),
+            ],
+        )
+        self.assertNotIn(BOB, second)
+        self.assertEqual(
+            names_and_texts(second[CAROL]), [("name3.eth", {"url": "url:0003"})]
+        )
+        # Only the texts of the changed (name1, name2) and new (name3) domains are
+        # read again: avatar and com.twitter of name1, url of name2 and name3.
+        self.assertEqual(rpc.eth_calls, 1 + 4)
+        # Carol is fetched in full, Alice and Bob only since their watermark
+        # (along with name1, whose texts changed).
+        self.assertEqual(sorted(subgraph.changed_since), [0, 0, 101, 101])
+        self.assertTrue(all(block == 200 for block in subgraph.blocks[-4:]))
+
+    def test_up_to_date_wallets_are_not_fetched(self):
+        domains = [with_texts(domain(0, ALICE), "url")]
+        with StubEnsSubgraph(domains) as subgraph, StubRpc(
+            text_records
+        ) as rpc, mock.patch.object(
+            ens_data, "SUBGRAPH_URL", subgraph.url
+        ), mock.patch.object(
+            ens_data, "ETH_RPC", rpc.url
+        ):
+            store = EnsStore(self.path)
+            first = store.wallet_ens_data({ALICE}, block=100)
+            requests = subgraph.http_requests
+            self.assertEqual(store.wallet_ens_data({ALICE}, block=100), first)
+            store.close()
+            # The store persists across instances.
+            self.assertEqual(EnsStore(self.path).names({ALICE}), first)
+        self.assertEqual(subgraph.http_requests, requests)
+
+
+if __name__ == "__main__":
+    unittest.main()
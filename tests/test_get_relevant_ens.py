@@ -0,0 +1,100 @@
+import datetime
+import os
+import unittest
+from unittest import mock
+
+from tests.stub_legacy_dune import StubLegacyDune
+from src.retention.get_relevant_ens import (
+    RetentionCategory,
+    fetch_retention_sweep,
+)
+
+DAYS = [datetime.datetime(2022, 5, 1), datetime.datetime(2022, 5, 8)]
+CATEGORIES = [RetentionCategory.LOST, RetentionCategory.RETAINED]
+
+
+def trader_rows(values):
+    """One trader per (day, category) and one common to all of them"""
+    own = f"0xAB-{values['TraderType']}-{values['DateFor'].date()}"
+    return [{"trader": own}, {"trader": "0xCOMMON"}]
+
+
+@mock.patch.dict(os.environ, {"DUNE_QUERY_ID": "1"})
+class TestRetentionSweep(unittest.TestCase):
+    def setUp(self) -> None:
+        self.lookups: list[set[str]] = []
+
+    def ens_lookup(self, wallets):
+        self.lookups.append(set(wallets))
+        return {w: [f"{w}.eth"] for w in wallets}
+
+    def test_one_execution_per_day_and_category(self):
+        service = StubLegacyDune(trader_rows)
+        sweep = fetch_retention_sweep(
+            service.client(), DAYS, CATEGORIES, self.ens_lookup
+        )
+
+        # Uploaded once, with the definitions of all parameters
+        self.assertEqual(len(service.uploads), 1)
+        self.assertEqual(
+            [p.key for p in service.uploads[0].parameters],
+            ["DateFor", "TraderType", "NumDays"],
+        )
+        executed = sorted(
+            (str(values["DateFor"].date()), values["TraderType"])
+            for _, values in service.executions
+        )
+        self.assertEqual(
+            executed,
+            [
+                ("2022-05-01", "lost"),
+                ("2022-05-01", "retained"),
+                ("2022-05-08", "lost"),
+                ("2022-05-08", "retained"),
+            ],
+        )
+        # The union of all wallets is looked up once
+        self.assertEqual(len(self.lookups), 1)
+        self.assertEqual(len(self.lookups[0]), 5)
+        self.assertIn("0xcommon", self.lookups[0])
+        # ... and split by (day, category)
+        key = (DAYS[1], RetentionCategory.LOST)
+        self.assertEqual(
+            sweep[key],
+            {
+                "0xab-lost-2022-05-08": ["0xab-lost-2022-05-08.eth"],
+                "0xcommon": ["0xcommon.eth"],
+            },
+        )
+        self.assertEqual(set(sweep), {(d, c) for d in DAYS for c in CATEGORIES})
+
+    def test_workers_use_clients_of_their_own(self):
+        service = StubLegacyDune(trader_rows)
+        dune = service.client()
+        fetch_retention_sweep(dune, DAYS, CATEGORIES, self.ens_lookup)
+
+        clients = service.clients()
+        self.assertNotIn(id(dune), clients)
+        self.assertEqual(service.logins, len(clients))
+
+    def test_failed_executions_are_retried(self):
+        service = StubLegacyDune(trader_rows, failures=1)
+        sweep = fetch_retention_sweep(
+            service.client(), DAYS[:1], CATEGORIES[:1], self.ens_lookup
+        )
+
+        self.assertEqual(len(service.executions), 2)
+        # Once by the worker and once more after the failure
+        self.assertEqual(service.logins, 2)
+        self.assertEqual(len(sweep[(DAYS[0], CATEGORIES[0])]), 2)
+
+    def test_too_many_failures_raise(self):
+        service = StubLegacyDune(trader_rows, failures=2)
+        with self.assertRaises(RuntimeError):
+            fetch_retention_sweep(
+                service.client(), DAYS[:1], CATEGORIES[:1], self.ens_lookup
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,7 +1,62 @@
+import contextlib
+import functools
+import io
 import os
+import sqlite3
+import tempfile
+import threading
 import unittest
+from datetime import timedelta
+from unittest import mock
 
-from src.missing_tokens import replace_line
+from eth_abi import encode
+
+from src.address import Address
+from src.dune_executor import DuneExecutor
+from src.missing_tokens import (
+    DECIMALS_CALL,
+    ETH_SENTINEL,
+    SYMBOL_CALL,
+    Network,
+    TokenDetails,
+    replace_line,
+    resolve_token_details,
+    run_missing_tokens_concurrently,
+    run_missing_tokens_locally,
+    traded_tokens_from_csv,
+    traded_tokens_from_dune,
+)
+from src.multicall import Call, RpcError, batch_eth_call, multicall
+from src.spellbook import load_token_addresses, token_file
+from src.token_cache import CachedToken, TokenCache
+from tests.stub_dune import StubDune
+from tests.stub_rpc import StubRpc
+
+TOKENS = {Address.from_int(i).address: (f"TKN{i}", i % 19) for i in range(1, 41)}
+REVERTING = Address.from_int(1001)
+NOT_A_TOKEN = Address.from_int(1002)
+# Token whose symbol is not valid UTF-8
+NOT_UTF8 = Address.from_int(1003)
+
+
+def erc20_handler(target, data):
+    if target == REVERTING.address:
+        return None
+    if target == NOT_UTF8.address:
+        return (
+            encode(["bytes"], [b"\xff"])
+            if data == SYMBOL_CALL
+            else encode(["uint8"], [18])
+        )
+    if target not in TOKENS:
+        # Calls to accounts without code succeed with empty return data.
+        return b""
+    symbol, decimals = TOKENS[target]
+    if data == SYMBOL_CALL:
+        return encode(["string"], [symbol])
+    if data == DECIMALS_CALL:
+        return encode(["uint8"], [decimals])
+    return None
 
 
 class TestAppendToFile(unittest.TestCase):
@@ -31,5 +86,262 @@ class TestAppendToFile(unittest.TestCase):
         os.remove(test_file)
 
 
+class TestResolveTokenDetails(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tokens = [Address(t) for t in TOKENS] + [
+            REVERTING,
+            NOT_A_TOKEN,
+            NOT_UTF8,
+            Address(ETH_SENTINEL),
+        ]
+
+    def assert_resolved(self, details, failures):
+        self.assertEqual(len(details), len(TOKENS) + 1)
+        for address, (symbol, decimals) in TOKENS.items():
+            self.assertEqual(details[Address(address)].symbol, symbol)
+            self.assertEqual(details[Address(address)].decimals, decimals)
+        self.assertEqual(details[Address(ETH_SENTINEL)].symbol, "ETH")
+        self.assertEqual(
+            {t: type(e).__name__ for t, e in failures.items()},
+            {
+                REVERTING: "ContractLogicError",
+                NOT_A_TOKEN: "BadFunctionCallOutput",
+                NOT_UTF8: "BadFunctionCallOutput",
+            },
+        )
+
+    def test_multicall(self):
+        with StubRpc(erc20_handler) as rpc:
+            details, failures = resolve_token_details(self.tokens, rpc.url)
+        self.assert_resolved(details, failures)
+        # Two eth_calls per token contract, but only a single round trip
+        # (versus 86 sequential round trips for one call at a time).
+        self.assertEqual(rpc.eth_calls, 2 * (len(self.tokens) - 1))
+        self.assertEqual(rpc.http_requests, 1)
+
+    def test_json_rpc_batch_fallback(self):
+        with StubRpc(erc20_handler, multicall_deployed=False) as rpc:
+            details, failures = resolve_token_details(self.tokens, rpc.url)
+        self.assert_resolved(details, failures)
+        # One failed multicall attempt and one JSON-RPC batch of 86 eth_calls.
+        self.assertEqual(rpc.http_requests, 2)
+
+    def test_token_cache(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "cache.sqlite")
+            with StubRpc(erc20_handler) as rpc:
+                cache = TokenCache(chain_id=1, path=path)
+                resolve_token_details(self.tokens, rpc.url, cache)
+                self.assertEqual(rpc.http_requests, 1)
+                # Second run is served entirely from cache, including failures.
+                details, failures = resolve_token_details(self.tokens, rpc.url, cache)
+                self.assert_resolved(details, failures)
+                self.assertEqual(rpc.http_requests, 1)
+                cache.close()
+
+                # Other chains don't share entries.
+                other_chain = TokenCache(chain_id=100, path=path)
+                self.assertEqual(other_chain.lookup(self.tokens), {})
+                other_chain.close()
+
+                # Expired negative entries are revalidated, positive ones are kept.
+                cache = TokenCache(chain_id=1, path=path, negative_ttl=timedelta(0))
+                self.assertEqual(len(cache.lookup(self.tokens)), len(TOKENS))
+                calls_before = rpc.eth_calls
+                details, failures = resolve_token_details(self.tokens, rpc.url, cache)
+                self.assert_resolved(details, failures)
+                self.assertEqual(rpc.eth_calls - calls_before, 6)
+                cache.close()
+
+    def test_token_cache_in_working_directory(self):
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as tmp:
+            os.chdir(tmp)
+            try:
+                with TokenCache(chain_id=1, path="cache.sqlite") as cache:
+                    cache.store({REVERTING: CachedToken(None, None, error="Revert")})
+                    self.assertEqual(len(cache.lookup([REVERTING])), 1)
+            finally:
+                os.chdir(cwd)
+        # Closed on leaving the block
+        with self.assertRaises(sqlite3.ProgrammingError):
+            cache.lookup([REVERTING])
+
+    def test_rpc_errors_are_not_cached(self):
+        rate_limited = {"code": -32005, "message": "rate limit exceeded"}
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = TokenCache(chain_id=1, path=os.path.join(tmp, "cache.sqlite"))
+            for multicall_deployed in (True, False):
+                with StubRpc(erc20_handler, multicall_deployed, rate_limited) as rpc:
+                    with self.assertRaises(RpcError):
+                        resolve_token_details(self.tokens, rpc.url, cache)
+            self.assertEqual(cache.lookup(self.tokens), {})
+            cache.close()
+
+
+class TestMulticall(unittest.TestCase):
+    def test_rpc_errors_are_not_reverts(self):
+        calls = [Call(t, SYMBOL_CALL) for t in TOKENS]
+        rate_limited = {"code": -32005, "message": "rate limit exceeded"}
+        with StubRpc(erc20_handler, error=rate_limited) as rpc:
+            with self.assertRaises(RpcError):
+                multicall(rpc.url, calls)
+            # No silent fallback to plain eth_calls
+            self.assertEqual(rpc.http_requests, 1)
+            with self.assertRaises(RpcError):
+                batch_eth_call(rpc.url, calls)
+
+    def test_reverts_are_unsuccessful_results(self):
+        calls = [
+            Call(REVERTING.address, SYMBOL_CALL),
+            Call(next(iter(TOKENS)), SYMBOL_CALL),
+        ]
+        with StubRpc(erc20_handler, multicall_deployed=False) as rpc:
+            results = batch_eth_call(rpc.url, calls)
+        self.assertEqual([r.success for r in results], [False, True])
+
+
+class TestTradedTokens(unittest.TestCase):
+    def test_traded_tokens_from_csv(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            csv_path = os.path.join(tmp, "traded.csv")
+            with open(csv_path, "w", encoding="utf-8") as file:
+                file.write(
+                    "blockchain,token\n"
+                    f"ethereum,{Address.from_int(1)}\n"
+                    f"gnosis,{Address.from_int(2)}\n"
+                    f"ethereum,{Address.from_int(3)}\n"
+                )
+            self.assertEqual(
+                traded_tokens_from_csv(csv_path, Network.MAINNET),
+                [Address.from_int(1), Address.from_int(3)],
+            )
+            self.assertEqual(
+                traded_tokens_from_csv(csv_path, Network.GNOSIS),
+                [Address.from_int(2)],
+            )
+
+    def test_traded_tokens_from_dune_never_executes(self):
+        rows = [
+            {"blockchain": "ethereum", "token": str(Address.from_int(1))},
+            {"blockchain": "gnosis", "token": str(Address.from_int(2))},
+        ]
+        with StubDune({5: rows}) as stub:
+            stub.latest_ended_at = "2020-01-01T00:00:00+00:00"
+            tokens = traded_tokens_from_dune(stub.client(), 5, Network.GNOSIS)
+        self.assertEqual(tokens, [Address.from_int(2)])
+        self.assertEqual(list(stub.executions), ["5-latest"])
+
+
+class TestRunLocally(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+        self.spellbook = os.path.join(self.tmp.name, "spellbook")
+        self.main_file = token_file(self.spellbook, "ethereum")
+        os.makedirs(os.path.dirname(self.main_file))
+        for name, token in [("erc20", 1), ("erc20_extra", 2)]:
+            with open(
+                os.path.join(
+                    os.path.dirname(self.main_file), f"tokens_ethereum_{name}.sql"
+                ),
+                "w",
+                encoding="utf-8",
+            ) as file:
+                file.write(
+                    "FROM (VALUES\n"
+                    f"    ({Address.from_int(token)}, 'TKN{token}', {token})\n"
+                    ") AS temp_table (contract_address, symbol, decimals)\n"
+                )
+
+    def tearDown(self) -> None:
+        self.tmp.cleanup()
+
+    def run_locally(self, rpc_url, traded_tokens):
+        cache = functools.partial(
+            TokenCache, path=os.path.join(self.tmp.name, "cache.sqlite")
+        )
+        out = io.StringIO()
+        with mock.patch.object(Network, "node_url", return_value=rpc_url), mock.patch(
+            "src.missing_tokens.TokenCache", cache
+        ), contextlib.redirect_stdout(out):
+            run_missing_tokens_locally(
+                Network.MAINNET, traded_tokens, self.spellbook, self.main_file
+            )
+        return out.getvalue()
+
+    def test_inserts_missing_tokens_into_spellbook(self):
+        # Listed in either spellbook file, new, repeated and reverting
+        traded = [Address.from_int(i) for i in [1, 2, 3, 4, 3]] + [REVERTING]
+        with StubRpc(erc20_handler) as rpc:
+            first = self.run_locally(rpc.url, traded)
+            second = self.run_locally(rpc.url, traded)
+
+        self.assertIn("Loaded 2 mainnet tokens from spellbook", first)
+        self.assertIn("ContractLogicError on", first)
+        self.assertIn("Inserted 2 tokens, skipped 0 already listed.", first)
+        self.assertEqual(
+            load_token_addresses(self.main_file),
+            {Address.from_int(i).address for i in [1, 3, 4]},
+        )
+        # Only the reverting token is left (and no row is written for it)
+        self.assertIn("Loaded 4 mainnet tokens from spellbook", second)
+        self.assertIn("Inserted 0 tokens, skipped 0 already listed.", second)
+
+
+class TestRunConcurrently(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+        self.finished: list[Network] = []
+        self.written: list[tuple[str, list[str]]] = []
+        self.gnosis_resolved = threading.Event()
+
+    def tearDown(self) -> None:
+        self.tmp.cleanup()
+
+    def resolve(self, chain, missing_tokens):
+        if chain == Network.MAINNET:
+            # Mainnet only finishes after gnosis (which comes later in insert_locs)
+            self.assertTrue(self.gnosis_resolved.wait(timeout=5))
+        self.finished.append(chain)
+        if chain == Network.GNOSIS:
+            self.gnosis_resolved.set()
+        return [TokenDetails(t, f"{chain}", 18) for t in missing_tokens]
+
+    def write(self, token_details, insert_loc=None):
+        self.written.append((insert_loc, [t.symbol for t in token_details]))
+
+    def test_submits_up_front_and_writes_in_order(self):
+        rows = [{"token": str(Address.from_int(1))}]
+        with StubDune({3645484: rows}, polls=2) as stub:
+            executor = DuneExecutor(
+                stub.client(),
+                os.path.join(self.tmp.name, "executor.sqlite"),
+                min_delay=0.01,
+                max_delay=0.05,
+            )
+            with mock.patch(
+                "src.missing_tokens.dune_executor", return_value=executor
+            ), mock.patch(
+                "src.missing_tokens.resolve_missing_tokens", self.resolve
+            ), mock.patch(
+                "src.missing_tokens.write_missing_tokens", self.write
+            ):
+                run_missing_tokens_concurrently(
+                    {Network.MAINNET: "mainnet.sql", Network.GNOSIS: "gnosis.sql"}
+                )
+
+        # Both executions are submitted before any of them is polled
+        routes = [route for _, route in stub.calls]
+        first_status = next(i for i, r in enumerate(routes) if r.endswith("/status"))
+        self.assertEqual(routes[:first_status], ["/query/3645484/execute"] * 2)
+        self.assertEqual(stub.execution_count(3645484), 2)
+        # Gnosis finished first, but files are written in the order of insert_locs
+        self.assertEqual(self.finished, [Network.GNOSIS, Network.MAINNET])
+        self.assertEqual(
+            self.written,
+            [("mainnet.sql", ["mainnet"]), ("gnosis.sql", ["gnosis"])],
+        )
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,104 @@
+import os
+import threading
+import unittest
+from unittest import mock
+from urllib.parse import urlparse
+
+from eth_abi import encode
+
+from src.clients import rate_limiter, reset_clients, web3_client
+from src.multicall import Call, multicall
+from src.rate_limit import TokenBucket, configured_rate
+from tests.stub_rpc import StubRpc
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.lock = threading.Lock()
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        with self.lock:
+            self.now += seconds
+
+
+class TestTokenBucket(unittest.TestCase):
+    def test_burst_then_throttle(self):
+        clock = FakeClock()
+        bucket = TokenBucket(rate=2, capacity=3, clock=clock, sleep=clock.sleep)
+        waits = [bucket.acquire() for _ in range(5)]
+        self.assertEqual(waits[:3], [0, 0, 0])
+        self.assertAlmostEqual(waits[3], 0.5)
+        # The second throttled caller waits for its own token (after the first one).
+        self.assertAlmostEqual(waits[4], 0.5)
+        self.assertAlmostEqual(clock.now, 1.0)
+
+    def test_refills_up_to_capacity(self):
+        clock = FakeClock()
+        bucket = TokenBucket(rate=1, capacity=2, clock=clock, sleep=clock.sleep)
+        bucket.acquire(2)
+        clock.now += 100
+        self.assertEqual(bucket.acquire(2), 0)
+        self.assertAlmostEqual(bucket.acquire(), 1.0)
+
+    def test_concurrent_callers_are_spaced(self):
+        clock = FakeClock()
+        bucket = TokenBucket(rate=10, clock=clock, sleep=lambda _: None)
+        waits = []
+        threads = [
+            threading.Thread(target=lambda: waits.append(bucket.acquire()))
+            for _ in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(
+            sorted(round(w, 6) for w in waits), [round(i / 10, 6) for i in range(8)]
+        )
+
+    def test_invalid_rate(self):
+        with self.assertRaises(ValueError):
+            TokenBucket(rate=0)
+
+    def test_records_waits(self):
+        clock = FakeClock()
+        bucket = TokenBucket(rate=2, capacity=2, clock=clock, sleep=clock.sleep)
+        for _ in range(4):
+            bucket.acquire()
+        stats = bucket.stats
+        self.assertEqual((stats.acquisitions, stats.throttled), (4, 2))
+        self.assertAlmostEqual(stats.seconds, 1.0)
+        self.assertAlmostEqual(stats.max_seconds, 0.5)
+
+
+class TestRateLimiter(unittest.TestCase):
+    def tearDown(self) -> None:
+        reset_clients()
+
+    def test_shared_by_upstream(self):
+        self.assertIs(rate_limiter("rpc", "a"), rate_limiter("rpc", "a"))
+        self.assertIsNot(rate_limiter("rpc", "a"), rate_limiter("rpc", "b"))
+        self.assertEqual(rate_limiter("dune").rate, configured_rate("dune")[0])
+
+    def test_configured_rate(self):
+        with mock.patch.dict(os.environ, {"RATE_LIMIT_SUBGRAPH": "0.5"}):
+            self.assertEqual(configured_rate("subgraph"), (0.5, 1.0))
+            self.assertEqual(rate_limiter("subgraph").rate, 0.5)
+        with self.assertRaises(KeyError):
+            configured_rate("unknown")
+
+    def test_web3_shares_the_rpc_limit(self):
+        with StubRpc(lambda _target, _data: encode(["uint8"], [18])) as stub:
+            limiter = rate_limiter("rpc", urlparse(stub.url).netloc)
+            web3_client(stub.url).eth.call({"to": "0x" + "11" * 20, "data": "0x"})
+            multicall(stub.url, [Call("0x" + "11" * 20, b"")])
+        self.assertGreater(stub.http_requests, 1)
+        self.assertEqual(limiter.stats.acquisitions, stub.http_requests)
+
+
+if __name__ == "__main__":
+    unittest.main()
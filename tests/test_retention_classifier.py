@@ -0,0 +1,121 @@
+import random
+import unittest
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+from src.retention.classifier import CATEGORIES, UNCLASSIFIED, RetentionActivity
+
+EPOCH_START = datetime(2021, 4, 28)
+
+
+def ceil_day(time: datetime) -> datetime:
+    midnight = datetime(time.year, time.month, time.day)
+    return midnight if time == midnight else midnight + timedelta(days=1)
+
+
+def activity_rows(cow_trades, other_trades):
+    """What retention-activity.sql returns for the given raw trades"""
+    rows = []
+    for trader, times in cow_trades.items():
+        first = min(times)
+        rows.append((trader, "first", datetime(first.year, first.month, first.day)))
+        rows.extend((trader, "cow", day) for day in {ceil_day(t) for t in times})
+    for trader, times in other_trades.items():
+        if trader in cow_trades:
+            rows.extend((trader, "other", day) for day in {ceil_day(t) for t in times})
+    return pd.DataFrame(rows, columns=["trader", "source", "day"])
+
+
+def sql_classification(cow_trades, other_trades, day, num_days):
+    """Straight port of retention-on-date.sql on raw trades"""
+    start = day - timedelta(days=num_days)
+    result = {}
+    for trader, times in cow_trades.items():
+        times = [t for t in times if EPOCH_START <= t <= day]
+        if not times or min(times) >= start:
+            continue
+        cow_recent = max(times) > start
+        other_recent = any(start < t <= day for t in other_trades.get(trader, []))
+        if cow_recent and not other_recent:
+            result[trader] = "retained"
+        elif cow_recent and other_recent:
+            result[trader] = "hybrid"
+        elif other_recent:
+            result[trader] = "lost"
+        else:
+            result[trader] = "gone"
+    return result
+
+
+class TestRetentionActivity(unittest.TestCase):
+    def test_categories(self):
+        day = datetime(2022, 6, 30)
+        cow = {
+            "0xa": [datetime(2022, 1, 1), datetime(2022, 6, 29, 12)],
+            "0xb": [datetime(2022, 1, 1), datetime(2022, 6, 20)],
+            "0xc": [datetime(2022, 1, 1)],
+            "0xd": [datetime(2022, 1, 1)],
+            # First trade within the window: not classified
+            "0xe": [datetime(2022, 6, 15)],
+            # Trades at exactly the window's (exclusive) start and (inclusive) end
+            "0xf": [datetime(2022, 1, 1), datetime(2022, 5, 31)],
+            "0x0": [datetime(2022, 1, 1), datetime(2022, 6, 30)],
+        }
+        other = {"0xb": [datetime(2022, 6, 10)], "0xc": [datetime(2022, 6, 30)]}
+        activity = RetentionActivity.from_frame(activity_rows(cow, other))
+        codes = dict(zip(activity.traders, activity.classify(day, num_days=30)))
+        self.assertEqual(
+            {t: CATEGORIES[c] for t, c in codes.items() if c != UNCLASSIFIED},
+            {
+                "0xa": "retained",
+                "0xb": "hybrid",
+                "0xc": "lost",
+                "0xd": "gone",
+                "0xf": "gone",
+                "0x0": "retained",
+            },
+        )
+        self.assertEqual(codes["0xe"], UNCLASSIFIED)
+        self.assertEqual(activity.wallets(day, "lost"), {"0xc"})
+
+    def test_matches_query_semantics(self):
+        rand = random.Random(42)
+        traders = [f"0x{i:040x}" for i in range(200)]
+
+        def random_times(count):
+            return [
+                EPOCH_START + timedelta(days=rand.randrange(400))
+                # A good share of trades falls exactly on midnight.
+                + timedelta(seconds=rand.choice([0, rand.randrange(86400)]))
+                for _ in range(count)
+            ]
+
+        cow = {t: random_times(rand.randrange(1, 6)) for t in traders}
+        other = {t: random_times(rand.randrange(0, 6)) for t in traders[::2]}
+        activity = RetentionActivity.from_frame(activity_rows(cow, other))
+        for offset in range(0, 400, 13):
+            day = EPOCH_START + timedelta(days=offset)
+            for num_days in (7, 30):
+                expected = sql_classification(cow, other, day, num_days)
+                for category in CATEGORIES:
+                    self.assertEqual(
+                        activity.wallets(day, category, num_days),
+                        {t for t, c in expected.items() if c == category},
+                        f"{category} on {day.date()} over {num_days} days",
+                    )
+
+    def test_retention_curves(self):
+        cow = {"0xa": [datetime(2022, 1, 1), datetime(2022, 2, 1)]}
+        activity = RetentionActivity.from_records(
+            activity_rows(cow, {}).to_dict("records")
+        )
+        days = [datetime(2022, 1, 15), datetime(2022, 2, 15), datetime(2022, 4, 1)]
+        curves = activity.retention_curves(days)
+        self.assertEqual(list(curves.columns), list(CATEGORIES))
+        self.assertEqual(curves["retained"].tolist(), [0, 1, 0])
+        self.assertEqual(curves["gone"].tolist(), [0, 0, 1])
+
+
+if __name__ == "__main__":
+    unittest.main()
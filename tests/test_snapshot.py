@@ -0,0 +1,73 @@
+import tempfile
+import unittest
+from datetime import timedelta
+
+from src.snapshot import SnapshotStore
+from tests.stub_http import StubServer, json_response
+
+
+class EtagServer(StubServer):
+    """Serves a JSON payload with an ETag, answering conditional requests with 304"""
+
+    def __init__(self):
+        super().__init__()
+        self.payload = [{"id": "btc-bitcoin"}]
+        self.full_responses = 0
+        self.not_modified = 0
+
+    @property
+    def coins_url(self) -> str:
+        return self.url + "/v1/coins"
+
+    def respond(self, method, path, headers, body):
+        etag = f'"{len(self.payload)}"'
+        if headers.get("If-None-Match") == etag:
+            self.not_modified += 1
+            return 304, {}, b""
+        self.full_responses += 1
+        status, response_headers, payload = json_response(self.payload)
+        return status, response_headers | {"ETag": etag}, payload
+
+
+class TestSnapshotStore(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+        self.server = EtagServer()
+        self.server.start()
+
+    def tearDown(self) -> None:
+        self.server.stop()
+        self.tmp.cleanup()
+
+    def test_fresh_snapshot_is_served_locally(self):
+        store = SnapshotStore(self.tmp.name, max_age=timedelta(hours=1))
+        self.assertEqual(store.get_json(self.server.coins_url), self.server.payload)
+        self.assertEqual(store.get_json(self.server.coins_url), self.server.payload)
+        self.assertEqual(self.server.full_responses, 1)
+        self.assertEqual(self.server.not_modified, 0)
+
+    def test_revalidation(self):
+        store = SnapshotStore(self.tmp.name, max_age=timedelta(0))
+        store.get_json(self.server.coins_url)
+        self.assertEqual(store.get_json(self.server.coins_url), self.server.payload)
+        self.assertEqual(self.server.not_modified, 1)
+
+        self.server.payload = [{"id": "btc-bitcoin"}, {"id": "eth-ethereum"}]
+        self.assertEqual(store.get_json(self.server.coins_url), self.server.payload)
+        self.assertEqual(self.server.full_responses, 2)
+
+    def test_offline(self):
+        offline = SnapshotStore(self.tmp.name, offline=True)
+        with self.assertRaises(FileNotFoundError):
+            offline.get_json(self.server.coins_url)
+
+        SnapshotStore(self.tmp.name).get_json(self.server.coins_url)
+        self.server.payload = []
+        self.assertEqual(
+            offline.get_json(self.server.coins_url), [{"id": "btc-bitcoin"}]
+        )
+        self.assertEqual(self.server.full_responses, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+import os
+import tempfile
+import unittest
+
+from src.spellbook import (
+    insert_token_rows,
+    load_spellbook_tokens,
+    load_token_addresses,
+    token_file,
+)
+
+TOKEN_FILE = """{{ config(alias = 'erc20', tags=['static']) }}
+
+SELECT contract_address, symbol, decimals
+FROM (VALUES
+    (0xfcc5c47be19d06bf83eb04298b026f81069ff65b, 'yCRV', 18)
+    , (0xA0b86991c6218b36c1d19D4a2e9Eb0cE3606eB48, 'USDC', 6)
+) AS temp_table (contract_address, symbol, decimals)
+"""
+
+
+class TestSpellbookTokenFile(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+        self.file_loc = os.path.join(self.tmp.name, "tokens_ethereum_erc20.sql")
+        with open(self.file_loc, "w", encoding="utf-8") as file:
+            file.write(TOKEN_FILE)
+
+    def tearDown(self) -> None:
+        self.tmp.cleanup()
+
+    def test_load_token_addresses(self):
+        self.assertEqual(
+            load_token_addresses(self.file_loc),
+            {
+                "0xfcc5c47be19d06bf83eb04298b026f81069ff65b",
+                "0xa0b86991c6218b36c1d19d4a2e9eb0ce3606eb48",
+            },
+        )
+
+    def test_load_spellbook_tokens(self):
+        main_file = token_file(self.tmp.name, "gnosis")
+        os.makedirs(os.path.dirname(main_file))
+        os.rename(self.file_loc, main_file)
+        with open(
+            os.path.join(os.path.dirname(main_file), "tokens_gnosis_erc20_extra.sql"),
+            "w",
+            encoding="utf-8",
+        ) as file:
+            file.write(
+                "FROM (VALUES\n"
+                "    (0xdac17f958d2ee523a2206206994597c13d831ec7, 'USDT', 6)\n"
+                ") AS temp_table (contract_address, symbol, decimals)\n"
+            )
+        self.assertEqual(len(load_spellbook_tokens(self.tmp.name, "gnosis")), 3)
+        self.assertEqual(load_spellbook_tokens(self.tmp.name, "ethereum"), set())
+
+    def test_insert_token_rows(self):
+        report = insert_token_rows(
+            self.file_loc,
+            [
+                ", (0xa0b86991c6218b36c1d19d4a2e9eb0ce3606eb48, 'USDC', 6)",
+                ", (0xdac17f958d2ee523a2206206994597c13d831ec7, 'USDT', 6)",
+                ", (0xdac17f958d2ee523a2206206994597c13d831ec7, 'USDT', 6)",
+            ],
+        )
+        self.assertEqual(report.inserted, 1)
+        self.assertEqual(report.duplicates, 2)
+        with open(self.file_loc, "r", encoding="utf-8") as file:
+            self.assertEqual(
+                file.read(),
+                TOKEN_FILE.replace(
+                    ") AS temp_table",
+                    "    , (0xdac17f958d2ee523a2206206994597c13d831ec7, 'USDT', 6)\n"
+                    ") AS temp_table",
+                ),
+            )
+
+    def test_insert_without_values_block(self):
+        with open(self.file_loc, "w", encoding="utf-8") as file:
+            file.write("SELECT 1\n")
+        with self.assertRaises(ValueError):
+            insert_token_rows(self.file_loc, [])
+        # The original is untouched and no temporary files are left behind.
+        self.assertEqual(os.listdir(self.tmp.name), ["tokens_ethereum_erc20.sql"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,6 +1,43 @@
 import unittest
+from unittest import mock
 
-from src.subgraph.ens_data import get_wallet_ens_data
+import requests
+
+from src.clients import reset_clients
+from src.rate_limit import TokenBucket
+from src.subgraph import ens_data
+from src.subgraph.ens_data import (
+    DomainQuery,
+    PartitionCursor,
+    get_wallet_ens_data,
+    read_ens_texts,
+    resolve_batch_query,
+    resolve_query,
+)
+from src.subgraph.fetch import (
+    AdaptiveBatchSize,
+    RequestStats,
+    SubgraphClient,
+    SubgraphError,
+)
+from tests.stub_http import StubServer, json_response
+from tests.stub_rpc import StubRpc, text_records
+from tests.stub_subgraph import LATEST_BLOCK, StubEnsSubgraph, domain
+
+
+class ScriptedSubgraph(StubServer):
+    """
+    Replies with the scripted responses in order (repeating the last one).
+    Also serves as a failing RPC node.
+    """
+
+    def __init__(self, responses):
+        super().__init__()
+        self.responses = responses
+
+    def respond(self, method, path, headers, body):
+        assert "gzip" in headers["Accept-Encoding"]
+        return self.responses[min(self.http_requests, len(self.responses)) - 1]
 
 
 class MyTestCase(unittest.TestCase):
@@ -33,5 +70,208 @@ class MyTestCase(unittest.TestCase):
             self.assertEqual(results[wallet], data, f"failed for wallet {wallet}")
 
 
+class TestSubgraphClient(unittest.TestCase):
+    def test_retries_transient_failures(self):
+        data = {"data": {"domains": []}}
+        responses = [
+            json_response({}, status=503),
+            json_response({"errors": [{"message": "indexer busy"}]}),
+            json_response(data),
+        ]
+        with ScriptedSubgraph(responses) as subgraph:
+            client = SubgraphClient(subgraph.url, backoff=0)
+            self.assertEqual(client.execute("{ domains { id } }"), data)
+        self.assertEqual(client.stats.requests, 3)
+        self.assertEqual(client.stats.retries, 2)
+        self.assertGreater(client.stats.bytes, 0)
+
+    def test_execute_timed(self):
+        data = {"data": {"domains": []}}
+        responses = [json_response({}, status=502), json_response(data)]
+        with ScriptedSubgraph(responses) as subgraph:
+            client = SubgraphClient(subgraph.url, backoff=0)
+            client.execute("{ domains { id } }")
+            result, stats = client.execute_timed("{ domains { id } }")
+        self.assertEqual(result, data)
+        self.assertEqual((stats.requests, stats.retries), (1, 0))
+        self.assertEqual((client.stats.requests, client.stats.retries), (3, 1))
+
+    def test_gives_up(self):
+        with ScriptedSubgraph([json_response({}, status=429)]) as subgraph:
+            client = SubgraphClient(subgraph.url, backoff=0, max_retries=2)
+            with self.assertRaises(SubgraphError):
+                client.execute("{ domains { id } }")
+        self.assertEqual(client.stats.requests, 3)
+
+    def test_retries_take_tokens(self):
+        limiter = TokenBucket(rate=1000, capacity=10)
+        with ScriptedSubgraph([json_response({}, status=429)]) as subgraph:
+            client = SubgraphClient(
+                subgraph.url, backoff=0, max_retries=2, limiter=limiter
+            )
+            with self.assertRaises(SubgraphError):
+                client.execute("{ domains { id } }")
+        self.assertEqual(limiter.stats.acquisitions, 3)
+
+
+class TestAdaptiveBatchSize(unittest.TestCase):
+    def test_grows_and_shrinks(self):
+        batch_size = AdaptiveBatchSize(initial=4, maximum=5, max_bytes=100)
+        batch_size.update(RequestStats(bytes=10, max_seconds=1), 4)
+        batch_size.update(RequestStats(bytes=10, max_seconds=1), 5)
+        self.assertEqual(batch_size.size, 5)
+        # Partial batches say nothing about larger ones.
+        batch_size.update(RequestStats(bytes=10, max_seconds=1), 2)
+        self.assertEqual(batch_size.size, 5)
+        batch_size.update(RequestStats(bytes=101, max_seconds=1), 5)
+        self.assertEqual(batch_size.size, 2)
+        batch_size.update(RequestStats(bytes=10, max_seconds=11), 2)
+        batch_size.shrink()
+        self.assertEqual(batch_size.size, 1)
+
+
+class TestEnsPagination(unittest.TestCase):
+    def setUp(self):
+        reset_clients()
+
+    def tearDown(self):
+        reset_clients()
+
+    def test_resolve_query(self):
+        query = resolve_query(["0x01"], last_id="0xab", block=123)
+        self.assertIn('id_gt: "0xab"', query)
+        self.assertIn("orderBy: id", query)
+        self.assertIn("block: {number: 123}", query)
+        self.assertIn(f"first: {ens_data.PAGE_SIZE}", query)
+        self.assertNotIn("skip", query)
+        with self.assertRaises(AssertionError):
+            resolve_query(["0xAB"])
+
+    def test_resolve_batch_query(self):
+        cursors = [PartitionCursor(0, ["0x01"]), PartitionCursor(3, ["0x02"], "0xff")]
+        query = resolve_batch_query(cursors, DomainQuery(block=7))
+        self.assertIn("p0: domains(", query)
+        self.assertIn("p1: domains(", query)
+        self.assertEqual(query.count("block: {number: 7}"), 2)
+        self.assertEqual(query.count("fragment DomainFields"), 1)
+
+    def test_batches_shrink_on_failure(self):
+        wallets = [f"0x{i:040x}" for i in range(3000)]
+        domains = [domain(i, wallets[i]) for i in range(3000)]
+        with StubEnsSubgraph(domains) as subgraph, mock.patch.object(
+            ens_data, "SUBGRAPH_URL", subgraph.url
+        ):
+            subgraph.fail_batches_over = 2
+            get_wallet_ens_data(set(wallets), block=1)
+        # Six partitions: the first batch of 4 is rejected and retried in smaller ones.
+        self.assertEqual(subgraph.batch_sizes[:2], [4, 2])
+        # Every partition is eventually served exactly once.
+        self.assertEqual(sum(s for s in subgraph.batch_sizes if s <= 2), 6)
+
+    def test_rpc_failures_do_not_shrink_batches(self):
+        wallets = [f"0x{i:040x}" for i in range(1200)]
+        domains = [domain(i, wallets[i]) for i in range(1200)]
+        for rec in domains:
+            rec["resolver"] = {"address": "0x" + "2" * 40, "texts": ["url"]}
+        batch_size = AdaptiveBatchSize(initial=4)
+        # An RPC node which is unavailable
+        rpc = ScriptedSubgraph([json_response({}, status=503)])
+        with rpc, StubEnsSubgraph(domains) as subgraph, mock.patch.object(
+            ens_data, "SUBGRAPH_URL", subgraph.url
+        ), mock.patch.object(ens_data, "ETH_RPC", rpc.url):
+            with self.assertRaises(requests.HTTPError):
+                get_wallet_ens_data(set(wallets), block=1, batch_size=batch_size)
+        # The batch was fetched once and not retried in smaller ones.
+        self.assertEqual(subgraph.batch_sizes, [3])
+        self.assertEqual(batch_size.size, 4)
+
+    def test_pages_by_cursor_at_pinned_block(self):
+        wallets = [f"0x{i:040x}" for i in range(5)]
+        domains = [domain(i, wallets[i % 5]) for i in range(2500)]
+        with StubEnsSubgraph(domains) as subgraph, mock.patch.object(
+            ens_data, "SUBGRAPH_URL", subgraph.url
+        ):
+            results = get_wallet_ens_data(set(wallets))
+        # One _meta lookup followed by three pages of (at most) 1000 domains.
+        self.assertEqual(subgraph.http_requests, 4)
+        self.assertEqual(subgraph.blocks, [LATEST_BLOCK] * 3)
+        self.assertEqual(
+            subgraph.cursors, ["", domains[999]["id"], domains[1999]["id"]]
+        )
+        # Domains without a resolver carry no text records.
+        self.assertEqual(results, {})
+
+    def test_explicit_block(self):
+        wallets = {"0x" + "1" * 40}
+        with StubEnsSubgraph([]) as subgraph, mock.patch.object(
+            ens_data, "SUBGRAPH_URL", subgraph.url
+        ):
+            get_wallet_ens_data(wallets, block=42)
+        self.assertEqual(subgraph.http_requests, 1)
+        self.assertEqual(subgraph.blocks, [42])
+
+    def test_concurrent_partitions_merge_in_order(self):
+        wallets = [f"0x{i:040x}" for i in range(1200)]
+        domains = [domain(i, wallets[i]) for i in range(1200)]
+        for rec in domains:
+            rec["resolver"] = {"address": "0x" + "2" * 40, "texts": ["url"]}
+        with StubEnsSubgraph(domains) as subgraph, StubRpc(
+            text_records
+        ) as rpc, mock.patch.object(
+            ens_data, "SUBGRAPH_URL", subgraph.url
+        ), mock.patch.object(
+            ens_data, "ETH_RPC", rpc.url
+        ):
+            sequential = get_wallet_ens_data(set(wallets))
+            concurrent = get_wallet_ens_data(
+                set(wallets),
+                concurrency=3,
+                rate=1000,
+                batch_size=AdaptiveBatchSize(initial=1, maximum=1),
+            )
+        # _meta and the three partitions (of 500, 500 and 200 wallets) in one
+        # request, then _meta and one request per partition.
+        self.assertEqual(subgraph.batch_sizes, [3, 1, 1, 1])
+        # All text records of a page are read in a single multicall.
+        self.assertEqual(rpc.http_requests, 3 + 3)
+        self.assertEqual(list(concurrent.items()), list(sequential.items()))
+        self.assertEqual(list(concurrent), wallets)
+        self.assertEqual(
+            concurrent[wallets[7]],
+            [{"name7.eth": {"id": domains[7]["id"], "texts": {"url": "url:0007"}}}],
+        )
+
+    def test_unreadable_text_records_are_skipped(self):
+        wallet = "0x" + "1" * 40
+        domains = [domain(i, wallet) for i in range(3)]
+        for rec in domains:
+            rec["resolver"] = {
+                "address": "0x" + "2" * 40,
+                "texts": ["avatar", "com.twitter"],
+            }
+        with StubEnsSubgraph(domains) as subgraph, StubRpc(
+            text_records
+        ) as rpc, mock.patch.object(
+            ens_data, "SUBGRAPH_URL", subgraph.url
+        ), mock.patch.object(
+            ens_data, "ETH_RPC", rpc.url
+        ):
+            results = get_wallet_ens_data({wallet}, block=1)
+        self.assertEqual(rpc.http_requests, 1)
+        self.assertEqual(rpc.eth_calls, 6)
+        self.assertEqual(
+            [next(iter(names.values()))["texts"] for names in results[wallet]],
+            [{"com.twitter": f"com.twitter:000{i}"} for i in range(3)],
+        )
+
+    def test_undecodable_text_records_are_skipped(self):
+        resolver, node = "0x" + "2" * 40, "0x" + "0" * 60 + "0007"
+        records = [(resolver, node, key) for key in ["url", "invalid", "email"]]
+        with StubRpc(text_records) as rpc:
+            texts = read_ens_texts(records, rpc.url)
+        self.assertEqual(rpc.http_requests, 1)
+        self.assertEqual(texts, ["url:0007", None, "email:0007"])
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -5,8 +5,19 @@ import unittest
 import shutil
 from datetime import datetime
 
+from marshmallow import fields
+
+from src.address import Address
 from src.missing_tokens import Network
-from src.utils import partition_array, write_to_json, valid_date
+from src.utils import (
+    CoinSchema,
+    CoinsSchema,
+    EthereumAddress,
+    LazyCoins,
+    partition_array,
+    write_to_json,
+    valid_date,
+)
 
 
 class MyTestCase(unittest.TestCase):
@@ -49,6 +60,33 @@ class MyTestCase(unittest.TestCase):
         self.assertEqual(gnosis.as_dune_v2_repr(), "gnosis")
         self.assertEqual(mainnet.as_dune_v2_repr(), "ethereum")
 
+    def test_lazy_coins(self):
+        usdc = "0xa0b86991c6218b36c1d19d4a2e9eb0ce3606eb48"
+        broken = "0xdac17f958d2ee523a2206206994597c13d831ec7"
+        entries = {
+            usdc: {
+                "id": "usdc-usd-coin",
+                "name": "USD Coin",
+                "symbol": "USDC",
+                "rank": 6,
+                "is_new": False,
+                "is_active": True,
+                "type": "token",
+                "address": usdc,
+            },
+            # missing required symbol
+            broken: {"id": "broken", "address": broken},
+        }
+        eager = CoinsSchema(
+            keys=EthereumAddress, values=fields.Nested(CoinSchema)
+        ).load(entries)
+        lazy = LazyCoins(entries)
+
+        self.assertEqual(lazy[Address(usdc)], eager[Address(usdc)])
+        self.assertIsNone(lazy.get(Address(broken)))
+        self.assertIsNone(lazy.get(Address.zero()))
+        self.assertEqual(len(lazy), 2)
+
 
 if __name__ == "__main__":
     unittest.main()